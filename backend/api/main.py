@@ -119,6 +119,13 @@ def startup_event():
 def shutdown_event():
     """Runs on application shutdown"""
     logger.info("SmartSniffer API shutting down")
+    
+    # Stop live captures so their threads and sockets don't outlive the app
+    from backend.api.routes.sniffer import active_sniffers
+    from backend.sniffer.adapters.socket_cache import socket_cache
+    for data in active_sniffers.values():
+        data["sniffer"].stop()
+    socket_cache.close_all()
 
 if __name__ == "__main__":
     import uvicorn
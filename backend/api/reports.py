@@ -0,0 +1,311 @@
+# backend/api/reports.py
+"""
+Report sections of the PCAP upload endpoints.
+
+Each section wraps the detectors or processors behind one upload endpoint:
+feed() takes a batch of packets and report() returns what the endpoint
+returns. run_sections() reads an upload once for any number of sections and
+caches every section's report by the upload's content and the section's
+parameters, so the same capture sent again, to the same endpoint or as part
+of /api/detect/report, is not read again.
+"""
+from fastapi import UploadFile, HTTPException
+from backend.api.uploads import spool_upload, iter_spooled_batches
+import os
+
+class AnomalySection:
+    """SYN flood, port scan, DNS tunneling and ARP spoofing (/api/detect/anomalies)"""
+
+    name = "anomalies"
+
+    def __init__(self, syn_threshold=100, port_threshold=20, dns_min_subdomains=5, dns_min_length=50):
+        from backend.detectors.anomaly.syn_flood import SynFloodDetector
+        from backend.detectors.anomaly.port_scan import PortScanDetector
+        from backend.detectors.anomaly.dns_tunneling import DNSTunnelingDetector
+        from backend.detectors.anomaly.arp_spoof import ARPSpoofDetector
+
+        # Everything the report depends on, part of its cache key
+        self.params = {
+            "syn_threshold": syn_threshold, "port_threshold": port_threshold,
+            "dns_min_subdomains": dns_min_subdomains, "dns_min_length": dns_min_length
+        }
+        self.syn_threshold = syn_threshold
+        self.port_threshold = port_threshold
+        self.syn_detector = SynFloodDetector(threshold=syn_threshold)
+        self.port_scan_detector = PortScanDetector(scan_threshold=port_threshold)
+        self.dns_detector = DNSTunnelingDetector(min_subdomains=dns_min_subdomains, min_length=dns_min_length)
+        self.arp_detector = ARPSpoofDetector()
+
+    def feed(self, batch):
+        self.syn_detector.detect_batch(batch)
+        for pkt in batch:
+            self.port_scan_detector.detect(pkt)
+            self.dns_detector.detect(pkt)
+            self.arp_detector.detect(pkt)
+
+    def report(self):
+        syn_counter = self.syn_detector.syn_counter
+        scan_map = self.port_scan_detector.scan_map
+        mapping_table = self.arp_detector.get_mapping_table()
+        return {
+            "syn_flood": {
+                "detected_ips": list(syn_counter.keys()),
+                "counts": syn_counter,
+                "threshold_exceeded": [ip for ip, count in syn_counter.items() if count > self.syn_threshold]
+            },
+            "port_scan": {
+                "scanner_ips": list(scan_map.keys()),
+                "ports_scanned": {ip: len(ports) for ip, ports in scan_map.items()},
+                "threshold_exceeded": [ip for ip, ports in scan_map.items() if len(ports) > self.port_threshold]
+            },
+            "dns_tunneling": {
+                "suspicious_queries": self.dns_detector.get_suspicious_queries(),
+                "total_detected": len(self.dns_detector.get_suspicious_queries())
+            },
+            "arp_spoofing": {
+                "ip_mac_mappings": mapping_table,
+                "potential_spoofs": [ip for ip, mac in mapping_table.items() if len(mac) > 1]
+            }
+        }
+
+class BehaviorSection:
+    """Timing, connection rate and bandwidth (/api/detect/behavior)"""
+
+    name = "behavior"
+
+    def __init__(self, conn_limit=100, window=10, bw_threshold=1e6, timing_threshold=0.001):
+        from backend.detectors.behavioral.timing import TimingAnomalyDetector
+        from backend.detectors.behavioral.connection_rate import ConnectionRateMonitor
+        from backend.detectors.behavioral.bandwidth import BandwidthMonitor
+
+        self.params = {
+            "conn_limit": conn_limit, "window": window,
+            "bw_threshold": bw_threshold, "timing_threshold": timing_threshold
+        }
+        self.conn_limit = conn_limit
+        self.window = window
+        self.bw_threshold = bw_threshold
+        self.timing_threshold = timing_threshold
+        self.timing_detector = TimingAnomalyDetector(min_interval=timing_threshold)
+        self.conn_monitor = ConnectionRateMonitor(window=window, limit=conn_limit)
+        self.bw_monitor = BandwidthMonitor(threshold=bw_threshold)
+
+    def feed(self, batch):
+        self.conn_monitor.monitor_batch(batch)
+        for pkt in batch:
+            self.timing_detector.detect(pkt)
+            self.bw_monitor.monitor(pkt)
+
+    def report(self):
+        return {
+            "timing_anomalies": {
+                "total_detected": self.timing_detector.get_anomaly_count(),
+                "threshold": self.timing_threshold
+            },
+            "connection_rate": {
+                "current_rate": self.conn_monitor.get_alert_count(),
+                "limit": self.conn_limit,
+                "window": self.window,
+                "threshold_exceeded": self.conn_monitor.get_alert_count() > 0
+            },
+            "bandwidth": {
+                "bytes_consumed": self.bw_monitor.get_bandwidth_usage(),
+                "threshold": self.bw_threshold,
+                "threshold_exceeded": self.bw_monitor.is_threshold_exceeded()
+            }
+        }
+
+class FingerprintSection:
+    """TLS, HTTP and device fingerprints (/api/detect/fingerprints)"""
+
+    name = "fingerprints"
+    params = {}
+
+    def __init__(self):
+        from backend.detectors.fingerprinting.tls import TLSFingerprinter
+        from backend.detectors.fingerprinting.http import HTTPFingerprinter
+        from backend.detectors.fingerprinting.device import DeviceFingerprinter
+
+        self.tls_fingerprinter = TLSFingerprinter()
+        self.http_fingerprinter = HTTPFingerprinter()
+        self.device_fingerprinter = DeviceFingerprinter()
+
+    def feed(self, batch):
+        for pkt in batch:
+            self.tls_fingerprinter.get_ja3(pkt)
+            self.http_fingerprinter.get_user_agent(pkt)
+            if hasattr(pkt, "src"):  # if MAC is available
+                mac = getattr(pkt, "src", None)
+                if mac:
+                    self.device_fingerprinter.fingerprint(mac)
+
+    def report(self):
+        ja3 = self.tls_fingerprinter.get_all_ja3()
+        user_agents = self.http_fingerprinter.get_all_user_agents()
+        device_types = self.device_fingerprinter.get_all_device_types()
+        return {
+            "tls_fingerprints": {
+                "ja3_hashes": list(ja3),
+                "total_unique": len(ja3)
+            },
+            "http_fingerprints": {
+                "user_agents": list(user_agents),
+                "total_unique": len(user_agents)
+            },
+            "device_fingerprints": {
+                "device_types": list(device_types),
+                "total_unique": len(device_types)
+            }
+        }
+
+class ThreatSection:
+    """Tor, Metasploit and Cobalt Strike traffic (/api/detect/threats)"""
+
+    name = "threats"
+    params = {}
+
+    def __init__(self):
+        from backend.detectors.threats.tor import TorDetector
+        from backend.detectors.threats.metasploit import MetasploitDetector
+        from backend.detectors.threats.cobalt_strike import CobaltStrikeDetector
+
+        self.tor_detector = TorDetector()
+        self.metasploit_detector = MetasploitDetector()
+        self.cobalt_detector = CobaltStrikeDetector()
+
+    def feed(self, batch):
+        for pkt in batch:
+            self.tor_detector.detect(pkt)
+            self.metasploit_detector.detect(pkt)
+            self.cobalt_detector.detect(pkt)
+
+    def report(self):
+        tor_count = self.tor_detector.get_tor_packet_count()
+        metasploit_count = self.metasploit_detector.get_metasploit_packet_count()
+        cobalt_count = self.cobalt_detector.get_cobalt_packet_count()
+        return {
+            "tor_traffic": {
+                "detected": tor_count > 0,
+                "packet_count": tor_count
+            },
+            "metasploit": {
+                "detected": metasploit_count > 0,
+                "packet_count": metasploit_count
+            },
+            "cobalt_strike": {
+                "detected": cobalt_count > 0,
+                "packet_count": cobalt_count
+            }
+        }
+
+class StatisticsSection:
+    """Traffic statistics (/api/processing/upload-pcap/statistics)"""
+
+    name = "statistics"
+    params = {}
+
+    def __init__(self):
+        from backend.processing.statistics import TrafficStats
+        self.stats = TrafficStats()
+
+    def feed(self, batch):
+        update = self.stats.update
+        for pkt in batch:
+            update(pkt)
+
+    def report(self):
+        return {"stats_summary": self.stats.summary()}
+
+class FlowSection:
+    """Flows and their packet times (/api/processing/upload-pcap/flows)"""
+
+    name = "flows"
+    params = {}
+
+    def __init__(self):
+        from backend.processing.flow_analyzer import FlowAnalyzer
+        self.analyzer = FlowAnalyzer()
+
+    def feed(self, batch):
+        process_packet = self.analyzer.process_packet
+        for pkt in batch:
+            process_packet(pkt)
+
+    def report(self):
+        serialized_flows = {
+            str(key): times for key, times in self.analyzer.get_active_flows().items()
+        }
+        return {"flows": serialized_flows}
+
+# Report section name -> section class, in report order
+SECTIONS = {
+    "anomalies": AnomalySection,
+    "behavior": BehaviorSection,
+    "fingerprints": FingerprintSection,
+    "threats": ThreatSection,
+    "statistics": StatisticsSection,
+    "flows": FlowSection
+}
+
+def parse_sections(names: str):
+    """
+    Section names from a comma-separated list, in report order.
+
+    Raises:
+        HTTPException: 400 for unknown or missing names
+    """
+    requested = {name.strip() for name in names.split(",") if name.strip()}
+    unknown = requested - SECTIONS.keys()
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown report sections: {', '.join(sorted(unknown))}. Available: {', '.join(SECTIONS)}"
+        )
+    if not requested:
+        raise HTTPException(status_code=400, detail="No report sections selected")
+    return [name for name in SECTIONS if name in requested]
+
+def run_sections(file: UploadFile, sections):
+    """
+    Reports of several sections over one upload.
+
+    Cached reports are returned as they are; the upload is read once, and
+    only if some section has no cached report, feeding every batch of
+    packets to each of those sections.
+
+    Returns:
+        (packet count, {section name: report})
+    """
+    from backend.sniffer.result_cache import get_result_cache
+    cache = get_result_cache()
+    path, content_hash = spool_upload(file)
+    try:
+        packet_count = None
+        reports = {}
+        pending = []
+        for section in sections:
+            key = cache.key(content_hash, "report/" + section.name, section.params)
+            cached = cache.get(key)
+            if cached is None:
+                pending.append((section, key))
+            else:
+                packet_count = cached["packet_count"]
+                reports[section.name] = cached["report"]
+
+        if pending:
+            packet_count = 0
+            for batch in iter_spooled_batches(path):
+                packet_count += len(batch)
+                for section, _ in pending:
+                    section.feed(batch)
+            for section, key in pending:
+                report = section.report()
+                cache.put(key, {"packet_count": packet_count, "report": report})
+                reports[section.name] = report
+    finally:
+        os.unlink(path)
+    return packet_count, {section.name: reports[section.name] for section in sections}
+
+def run_section(file: UploadFile, section):
+    """Report of a single section over an upload, see run_sections()"""
+    return run_sections(file, [section])[1][section.name]
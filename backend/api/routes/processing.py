@@ -1,7 +1,6 @@
 from fastapi import APIRouter, UploadFile, File
 from pydantic import BaseModel
-from scapy.all import rdpcap
-import tempfile
+from backend.api.reports import run_section, StatisticsSection, FlowSection
 
 router = APIRouter()
 
@@ -15,35 +14,15 @@ class NormalizationRequest(BaseModel):
 
 
 @router.post("/upload-pcap/statistics")
-async def analyze_traffic_stats(file: UploadFile = File(...)):
-    from backend.processing.statistics import TrafficStats
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(await file.read())
-        packets = rdpcap(tmp.name)
-
-    stats = TrafficStats()
-    for pkt in packets:
-        stats.update(pkt)
-
-    return {"stats_summary": stats.summary()}
+def analyze_traffic_stats(file: UploadFile = File(...)):
+    section = StatisticsSection()
+    return run_section(file, section)
 
 
 @router.post("/upload-pcap/flows")
-async def analyze_flows(file: UploadFile = File(...)):
-    from backend.processing.flow_analyzer import FlowAnalyzer
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(await file.read())
-        packets = rdpcap(tmp.name)
-
-    analyzer = FlowAnalyzer()
-    for pkt in packets:
-        analyzer.process_packet(pkt)
-
-    serialized_flows = {
-        str(key): times for key, times in analyzer.get_active_flows().items()
-    }
-
-    return {"flows": serialized_flows}
+def analyze_flows(file: UploadFile = File(...)):
+    section = FlowSection()
+    return run_section(file, section)
 
 
 @router.post("/geoip/lookup")
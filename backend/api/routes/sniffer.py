@@ -1,9 +1,9 @@
 # backend/api/routes/sniffer.py
 from fastapi import APIRouter, UploadFile, File, Form, Query, HTTPException, BackgroundTasks
-from pydantic import BaseModel
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 # from backend.sniffer.adapters.pcap_adapter import read_pcap
-import tempfile
 import os, time
 import uuid, sys
 
@@ -16,6 +16,14 @@ class SnifferConfig(BaseModel):
     iface: str
     filters: List[str] = []
     name: Optional[str] = None
+    buffer_size: int = Field(10000, ge=1, le=1000000)
+    adapter: str = Field("scapy", pattern="^(scapy|afpacket)$")
+    workers: int = Field(0, ge=0, le=64)
+    detectors: List[str] = []
+    save_pcap: bool = False
+    adaptive_sampling: bool = True
+    shared: bool = False
+    reassemble: bool = True
 
 class SnifferResponse(BaseModel):
     id: str
@@ -31,12 +39,31 @@ class SnifferStatusResponse(BaseModel):
     interface: str
     filters: List[str]
     name: Optional[str] = None
+    buffer_capacity: int
+    buffer_size: int
+    first_seq: int
+    last_seq: int
+    evicted_count: int
+    dropped_count: int
+    workers: Optional[Dict[str, Any]] = None
+    capture_filter: str = ""
+    filter_selectivity: Optional[Dict[str, Any]] = None
+    pcap: Optional[Dict[str, Any]] = None
+    sample_rate: int = 1
+    sampling: Optional[Dict[str, Any]] = None
+    reassembly: Optional[Dict[str, Any]] = None
+    parsers: Dict[str, Dict[str, int]] = {}
+    counters: Dict[str, Optional[int]] = {}
+    rates: Dict[str, Optional[float]] = {}
 
 class SnifferResultsResponse(BaseModel):
     id: str
     results: List[Dict[str, Any]]
     more_available: bool
     total_count: int
+    next_seq: int
+    missed: int
+    timestamp: float
 
 @router.get("/status")
 def sniffer_status():
@@ -51,11 +78,28 @@ def sniffer_status():
 @router.post("/start-live", response_model=SnifferResponse)
 def start_live_sniffer(config: SnifferConfig):
     from backend.sniffer import Sniffer
+    from backend.config.settings import settings
     """Start a live sniffer with the given configuration"""
     sniffer_id = str(uuid.uuid4())
-    sniffer = Sniffer(iface=config.iface, filters=config.filters)
+    sniffer = Sniffer(
+        iface=config.iface,
+        filters=config.filters,
+        buffer_size=config.buffer_size,
+        adapter=config.adapter,
+        workers=config.workers,
+        detectors=config.detectors,
+        save_pcap=config.save_pcap,
+        pcap_dir=os.path.join(settings.PCAP_SAVE_PATH, sniffer_id),
+        adaptive_sampling=config.adaptive_sampling,
+        shared=config.shared,
+        reassemble=config.reassemble
+    )
     
-    if not sniffer.start():
+    try:
+        started = sniffer.start()
+    except OSError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to open capture on {config.iface}: {str(e)}")
+    if not started:
         raise HTTPException(status_code=400, detail="Failed to start sniffer. It may already be running.")
     
     # Store the sniffer instance
@@ -84,21 +128,16 @@ def get_live_sniffer_status(sniffer_id: str):
     stats = sniffer.get_stats()
     
     return {
+        **stats,
         "id": sniffer_id,
-        "running": stats["running"],
-        "packet_count": stats["packet_count"],
-        "interface": stats["interface"],
-        "filters": stats["filters"],
         "name": config.get("name")
     }
 
-# Modify this function in backend/api/routes/sniffer.py
 @router.get("/live/{sniffer_id}/results", response_model=SnifferResultsResponse)
 def get_live_sniffer_results(
     sniffer_id: str, 
     limit: int = Query(100, ge=1, le=1000),
-    clear: bool = Query(False),
-    since_timestamp: Optional[float] = Query(None, description="Only return results after this timestamp")
+    after_seq: Optional[int] = Query(None, ge=-1, description="Only return results with a sequence number after this one")
 ):
     """Get the results from a specific sniffer"""
     if sniffer_id not in active_sniffers:
@@ -106,8 +145,8 @@ def get_live_sniffer_results(
     
     sniffer = active_sniffers[sniffer_id]["sniffer"]
     
-    # Modify sniffer.get_results to accept a timestamp parameter
-    results = sniffer.get_results(limit=limit, clear=clear, since_timestamp=since_timestamp)
+    # Resume from the caller's cursor; pass next_seq back as after_seq
+    results, next_seq, missed = sniffer.get_results(limit=limit, after_seq=after_seq)
     stats = sniffer.get_stats()
     
     # Add timestamp to response
@@ -115,13 +154,44 @@ def get_live_sniffer_results(
     
     return {
         "id": sniffer_id,
-        "results": results,
-        "more_available": len(results) == limit,
+        "results": [record.to_dict() for record in results],
+        "more_available": next_seq < stats["last_seq"],
         "total_count": stats["packet_count"],
+        "next_seq": next_seq,
+        "missed": missed,
         "timestamp": current_timestamp
     }
 
 
+@router.get("/live/{sniffer_id}/pcaps")
+def list_live_sniffer_pcaps(sniffer_id: str):
+    """List the PCAP files recorded by a specific sniffer"""
+    if sniffer_id not in active_sniffers:
+        raise HTTPException(status_code=404, detail="Sniffer not found")
+
+    sniffer = active_sniffers[sniffer_id]["sniffer"]
+    files = sniffer.get_pcap_files()
+    return {
+        "id": sniffer_id,
+        "recording": sniffer.save_pcap,
+        "files": files,
+        "count": len(files),
+        "total_bytes": sum(f["size"] for f in files)
+    }
+
+@router.get("/live/{sniffer_id}/pcaps/{file_name}")
+def download_live_sniffer_pcap(sniffer_id: str, file_name: str):
+    """Download one PCAP file recorded by a specific sniffer"""
+    from fastapi.responses import FileResponse
+    if sniffer_id not in active_sniffers:
+        raise HTTPException(status_code=404, detail="Sniffer not found")
+
+    sniffer = active_sniffers[sniffer_id]["sniffer"]
+    for f in sniffer.get_pcap_files():
+        if f["name"] == file_name:
+            return FileResponse(f["path"], media_type="application/vnd.tcpdump.pcap", filename=file_name)
+    raise HTTPException(status_code=404, detail="Capture file not found")
+
 @router.post("/live/{sniffer_id}/stop")
 def stop_live_sniffer(sniffer_id: str):
     """Stop a specific sniffer"""
@@ -140,14 +210,23 @@ def stop_live_sniffer(sniffer_id: str):
     }
 
 @router.delete("/live/{sniffer_id}")
-def delete_live_sniffer(sniffer_id: str):
-    """Delete a specific sniffer and its results"""
+def delete_live_sniffer(
+    sniffer_id: str,
+    delete_pcaps: bool = Query(False, description="Also delete the session's PCAP recordings")
+):
+    """Delete a specific sniffer and its results; its PCAP recordings stay unless delete_pcaps is set"""
+    import shutil
     if sniffer_id not in active_sniffers:
         raise HTTPException(status_code=404, detail="Sniffer not found")
     
     sniffer = active_sniffers[sniffer_id]["sniffer"]
     sniffer.stop()  # Make sure it's stopped
     
+    # Kept recordings still count against PCAP_MAX_TOTAL_BYTES and are
+    # deleted oldest first like any other
+    if sniffer.pcap_dir and delete_pcaps:
+        shutil.rmtree(sniffer.pcap_dir, ignore_errors=True)
+    
     # Remove from active sniffers
     del active_sniffers[sniffer_id]
     
@@ -156,6 +235,53 @@ def delete_live_sniffer(sniffer_id: str):
         "status": "Sniffer deleted"
     }
 
+@router.get("/threads")
+def list_capture_threads():
+    """List live capture threads and parked capture sockets"""
+    from backend.sniffer.core import list_capture_threads as capture_threads
+    from backend.sniffer.adapters.socket_cache import socket_cache
+    from backend.sniffer.multiplexer import capture_mux
+
+    threads = capture_threads()
+    return {
+        "threads": threads,
+        "count": len(threads),
+        "running_sniffers": sum(1 for data in active_sniffers.values() if data["sniffer"].running),
+        "sockets": socket_cache.get_stats(),
+        "shared_captures": capture_mux.get_stats()
+    }
+
+@router.get("/parsers")
+def list_parsers():
+    """List the registered protocol parsers, their dispatch declarations and hit counts"""
+    from backend.sniffer.protocols import registry
+
+    parsers = registry.describe()
+    return {
+        "parsers": parsers,
+        "count": len(parsers)
+    }
+
+@router.get("/result-cache")
+def get_result_cache_stats():
+    """Size and hit counters of the analysis result cache"""
+    from backend.sniffer.result_cache import get_result_cache
+    return get_result_cache().get_stats()
+
+@router.delete("/result-cache")
+def clear_result_cache():
+    """Delete every cached analysis result"""
+    from backend.sniffer.result_cache import get_result_cache
+    cache = get_result_cache()
+    cache.clear()
+    return {"status": "Result cache cleared", **cache.get_stats()}
+
+@router.get("/column-store")
+def get_column_store_stats():
+    """Number and size of the column stores of offline analyses"""
+    from backend.sniffer.column_store import get_store_directory
+    return get_store_directory().get_stats()
+
 @router.get("/live")
 def list_active_sniffers():
     """List all active sniffers"""
@@ -180,24 +306,23 @@ def list_active_sniffers():
 active_analyzers = {}
 
 @router.post("/analyze-pcap")
-async def analyze_pcap(
+def analyze_pcap(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     name: str = Form(None)
 ):
     """Upload and analyze a PCAP file"""
-    # Create a temporary file
+    # Spool the upload to a temporary file in chunks; the analyzer streams it.
+    # The hash taken on the way finds earlier results for the same capture
     from backend.sniffer import OfflineAnalyzer
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        contents = await file.read()
-        tmp.write(contents)
-        tmp_path = tmp.name
+    from backend.api.uploads import spool_upload
+    tmp_path, content_hash = spool_upload(file)
     
     # Create an analyzer ID
     analyzer_id = str(uuid.uuid4())
     
     # Create and store the analyzer
-    analyzer = OfflineAnalyzer(tmp_path)
+    analyzer = OfflineAnalyzer(tmp_path, content_hash=content_hash)
     active_analyzers[analyzer_id] = {
         "analyzer": analyzer,
         "file_path": tmp_path,
@@ -218,10 +343,24 @@ async def analyze_pcap(
 
 def run_analysis(analyzer_id):
     """Run analysis in background"""
-    analyzer = active_analyzers[analyzer_id]["analyzer"]
-    summary = analyzer.analyze()
-    active_analyzers[analyzer_id]["status"] = "completed"
-    active_analyzers[analyzer_id]["summary"] = summary
+    from backend.sniffer.offline_analyzer import AnalysisCancelled
+    data = active_analyzers[analyzer_id]
+    try:
+        summary = data["analyzer"].analyze()
+    except AnalysisCancelled:
+        # Nothing is kept of a cancelled analysis but its entry
+        data["status"] = "cancelled"
+        try:
+            os.unlink(data["file_path"])
+        except OSError:
+            pass
+        return
+    except Exception as e:
+        data["status"] = "failed"
+        data["error"] = str(e)
+        return
+    data["status"] = "completed"
+    data["summary"] = summary
 
 @router.get("/pcap/{analyzer_id}/status")
 def get_pcap_analysis_status(analyzer_id: str):
@@ -231,11 +370,35 @@ def get_pcap_analysis_status(analyzer_id: str):
     
     data = active_analyzers[analyzer_id]
     
-    return {
+    response = {
         "id": analyzer_id,
         "status": data["status"],
         "filename": data["original_filename"],
-        "name": data["name"]
+        "name": data["name"],
+        "cached": data["analyzer"].cached,
+        "progress": data["analyzer"].get_progress()
+    }
+    if "error" in data:
+        response["error"] = data["error"]
+    return response
+
+@router.post("/pcap/{analyzer_id}/cancel")
+def cancel_pcap_analysis(analyzer_id: str):
+    """Stop a running PCAP analysis at its next batch of packets"""
+    if analyzer_id not in active_analyzers:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    data = active_analyzers[analyzer_id]
+    
+    if data["status"] != "processing":
+        raise HTTPException(status_code=400, detail=f"Analysis is not running ({data['status']})")
+    
+    data["analyzer"].cancel()
+    
+    return {
+        "id": analyzer_id,
+        "status": "Cancelling analysis",
+        "progress": data["analyzer"].get_progress()
     }
 
 @router.get("/pcap/{analyzer_id}/results")
@@ -258,13 +421,153 @@ def get_pcap_analysis_results(
     
     return {
         "id": analyzer_id,
-        "results": results,
+        "results": [record.to_dict() for record in results],
         "more_available": len(results) == limit,
         "offset": offset,
         "limit": limit,
         "total_count": analyzer.packet_count
     }
 
+@router.get("/pcap/{analyzer_id}/query")
+def query_pcap_analysis(
+    analyzer_id: str,
+    protocol: str = Query(None, description="Comma-separated protocol names"),
+    port: int = Query(None, ge=0, le=65535, description="Source or destination port"),
+    src_port: int = Query(None, ge=0, le=65535),
+    dst_port: int = Query(None, ge=0, le=65535),
+    ip: str = Query(None, description="Source or destination address"),
+    src_ip: str = Query(None),
+    dst_ip: str = Query(None),
+    start: float = Query(None, description="Earliest timestamp (epoch seconds)"),
+    end: float = Query(None, description="Latest timestamp (epoch seconds), exclusive"),
+    sort: str = Query("packet_number"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    fields: str = Query(None, description="Comma-separated fields to return"),
+    group_by: str = Query(None, description="Count packets per value of this field instead"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0)
+):
+    """Filter, sort, project or aggregate the packets of a PCAP analysis on the server"""
+    from backend.sniffer.column_store import RecordFilter
+    if analyzer_id not in active_analyzers:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    data = active_analyzers[analyzer_id]
+    
+    if data["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Analysis not yet completed")
+    
+    store = data["analyzer"].open_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="No column store for this analysis")
+    
+    try:
+        where = RecordFilter(
+            protocols=[name.strip() for name in protocol.split(",") if name.strip()] if protocol else None,
+            port=port, src_port=src_port, dst_port=dst_port,
+            ip=ip, src_ip=src_ip, dst_ip=dst_ip,
+            start=start, end=end
+        )
+        if group_by:
+            total, group_count, groups = store.aggregate(group_by, where, limit=limit)
+            return {
+                "id": analyzer_id,
+                "group_by": group_by,
+                "total_count": total,
+                "group_count": group_count,
+                "groups": groups
+            }
+        total, records = store.query(where, sort, order == "desc", limit=limit, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    results = [record.to_dict() for record in records]
+    if fields:
+        wanted = [name.strip() for name in fields.split(",") if name.strip()]
+        results = [{name: result[name] for name in wanted if name in result} for result in results]
+    
+    return {
+        "id": analyzer_id,
+        "results": results,
+        "more_available": offset + len(results) < total,
+        "offset": offset,
+        "limit": limit,
+        "total_count": total
+    }
+
+@router.get("/pcap/{analyzer_id}/packets/{packet_number}")
+def get_pcap_packet(
+    analyzer_id: str,
+    packet_number: int,
+    format: str = Query("json", pattern="^(json|raw)$")
+):
+    """Get one packet of a PCAP analysis with its frame's bytes, read from the capture through the frame index"""
+    if analyzer_id not in active_analyzers:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    data = active_analyzers[analyzer_id]
+    
+    if data["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Analysis not yet completed")
+    
+    analyzer = data["analyzer"]
+    store = analyzer.open_store()
+    index = analyzer.open_index()
+    if store is None or index is None:
+        raise HTTPException(status_code=404, detail="No frame index for this analysis")
+    
+    try:
+        frame = store.frame(packet_number)
+        record = store.record(*store.locate(packet_number))
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Packet not found")
+    frame_bytes = index.read(data["file_path"], frame)
+    
+    if format == "raw":
+        return Response(content=frame_bytes, media_type="application/octet-stream")
+    
+    return {
+        "id": analyzer_id,
+        "packet_number": packet_number,
+        **index.entry(frame),
+        "record": record.to_dict(),
+        "data": frame_bytes.hex()
+    }
+
+@router.get("/pcap/{analyzer_id}/seek")
+def seek_pcap_analysis(
+    analyzer_id: str,
+    timestamp: float = Query(..., description="Time to seek to (epoch seconds)")
+):
+    """Find the first packet from where a PCAP capture reaches a time, for paging through results from there"""
+    if analyzer_id not in active_analyzers:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    data = active_analyzers[analyzer_id]
+    
+    if data["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Analysis not yet completed")
+    
+    analyzer = data["analyzer"]
+    store = analyzer.open_store()
+    index = analyzer.open_index()
+    if store is None or index is None:
+        raise HTTPException(status_code=404, detail="No frame index for this analysis")
+    
+    frame = index.frame_at(timestamp)
+    packet_number = store.packet_at(frame) if frame is not None else None
+    if packet_number is None:
+        raise HTTPException(status_code=404, detail="No packet at or after that time")
+    
+    packet_frame = store.frame(packet_number)
+    return {
+        "id": analyzer_id,
+        "timestamp": timestamp,
+        "packet_number": packet_number,
+        "frame": packet_frame,
+        "frame_timestamp": index.entry(packet_frame)["timestamp"]
+    }
+
 @router.get("/pcap/{analyzer_id}/summary")
 def get_pcap_analysis_summary(analyzer_id: str):
     """Get the summary of a PCAP analysis"""
@@ -286,6 +589,10 @@ def delete_pcap_analysis(analyzer_id: str):
     
     data = active_analyzers[analyzer_id]
     
+    # A running analysis stops at its next batch, as with /cancel
+    if data["status"] == "processing":
+        data["analyzer"].cancel()
+    
     # Delete the temporary file
     try:
         if os.path.exists(data["file_path"]):
@@ -302,14 +609,12 @@ def delete_pcap_analysis(analyzer_id: str):
     }
 
 @router.post("/tshark")
-async def tshark_parser(file: UploadFile = File(...)):
+def tshark_parser(file: UploadFile = File(...)):
     from backend.sniffer.adapters.tshark_adapter import parse_with_tshark
+    from backend.sniffer.adapters.pcap_adapter import spool_to_file
     """Parse a PCAP file with TShark"""
-    # Create a temporary file
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        contents = await file.read()
-        tmp.write(contents)
-        tmp_path = tmp.name
+    # Spool the upload to a temporary file in chunks
+    tmp_path = spool_to_file(file.file)
     
     # Parse with TShark
     results = parse_with_tshark(tmp_path)
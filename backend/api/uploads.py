@@ -0,0 +1,27 @@
+# backend/api/uploads.py
+from fastapi import UploadFile, HTTPException
+from backend.sniffer.adapters.pcap_adapter import iter_pcap_batches, spool_to_file
+import hashlib
+
+def spool_upload(file: UploadFile):
+    """
+    Spool an upload to a temporary file, hashing it on the way.
+
+    Returns:
+        (path, SHA-256 hex digest); the caller deletes the file
+    """
+    digest = hashlib.sha256()
+    path = spool_to_file(file.file, digest=digest)
+    return path, digest.hexdigest()
+
+def iter_spooled_batches(path):
+    """Stream the packets of a spooled PCAP file in batches; read errors become a 400 response"""
+    batches = iter_pcap_batches(path)
+    while True:
+        try:
+            batch = next(batches)
+        except StopIteration:
+            return
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error processing PCAP file: {str(e)}")
+        yield batch
@@ -12,11 +12,39 @@ class AppSettings(BaseSettings):
     PCAP_SAVE_PATH: str = "captures/"
     ANOMALY_LOG_FILE: str = "logs/anomalies.json"
     RULE_PATH: str = "backend/config/detection_rules/"
+
+    # AF_PACKET (TPACKET_V3) capture ring
+    CAPTURE_RING_BLOCK_SIZE: int = 1 << 20      # Bytes per block, multiple of the page size
+    CAPTURE_RING_BLOCK_COUNT: int = 64          # Blocks in the ring
+    CAPTURE_RING_FRAME_SIZE: int = 2048         # Nominal frame slot size
+    CAPTURE_RING_BLOCK_TIMEOUT_MS: int = 64     # Retire partly filled blocks after this long
+
+    # Live session PCAP recording under PCAP_SAVE_PATH
+    PCAP_ROTATE_BYTES: int = 100 * 1024 * 1024      # Start a new file at this size
+    PCAP_ROTATE_SECONDS: int = 300                  # or when the current file is this old
+    PCAP_MAX_TOTAL_BYTES: int = 2 * 1024 ** 3       # All sessions together; oldest files are deleted beyond this
+
+    # TCP stream reassembly, per dissection context (sniffer, pool worker, offline analysis)
+    REASSEMBLY_MEMORY_BUDGET: int = 64 * 1024 * 1024    # Out-of-order bytes buffered over all flows
+    REASSEMBLY_FLOW_BUDGET: int = 1024 * 1024           # Out-of-order bytes buffered per direction
+    REASSEMBLY_IDLE_TIMEOUT: int = 120                  # Seconds before a quiet direction is closed
+
+    # Offline PCAP analysis
+    OFFLINE_ANALYSIS_WORKERS: int = 0                       # Processes for large captures, 0 = one per CPU
+    OFFLINE_PARALLEL_MIN_BYTES: int = 64 * 1024 * 1024      # Smaller captures are analysed in one process
+
+    # Analysis results cached by capture content and parameters
+    RESULT_CACHE_PATH: str = "cache/results/"
+    RESULT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024     # Least recently used results are deleted beyond this, 0 = off
+
+    # Columnar stores of offline analysis records, read by /pcap/{id}/results and /query
+    COLUMN_STORE_PATH: str = "cache/columns/"
+    COLUMN_STORE_MAX_BYTES: int = 2 * 1024 ** 3         # Least recently used stores are deleted beyond this, 0 = off
     
     @field_validator('*')
     @classmethod
-    def ensure_path_exists(cls, v: str) -> str:
-        if any(v.endswith(ext) for ext in ('_PATH', '_FILE')):
+    def ensure_path_exists(cls, v):
+        if isinstance(v, str) and any(v.endswith(ext) for ext in ('_PATH', '_FILE')):
             path = Path(v)
             if not path.parent.exists():
                 path.parent.mkdir(parents=True, exist_ok=True)
@@ -1,5 +1,6 @@
-from scapy.layers.dns import DNS, DNSQR
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Dict, Any
+
+from ...sniffer.protocols.dns import parse as parse_dns
 
 class DNSTunnelingDetector:
     def __init__(self, min_subdomains: int = 5, min_length: int = 50):
@@ -26,18 +27,30 @@ class DNSTunnelingDetector:
             - is_tunneling: True if tunneling detected
             - query: Suspicious query if detected, None otherwise
         """
-        if not packet.haslayer(DNS) or packet[DNS].qr != 0:
+        record = parse_dns(packet)
+        if not record:
             return False, None
+        return self.detect_record(record)
+
+    def detect_record(self, record: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+        """
+        Detect DNS tunneling in an already decoded DNS record.
+        
+        Args:
+            record: DNS result record from the sniffer's DNS parser
             
-        try:
-            query = packet[DNSQR].qname.decode()
-            if (len(query.split(".")) > self.min_subdomains and len(query) > self.min_length):
-                self.suspicious_queries.append(query)
-                return True, query
-            return False, None
-        except:
+        Returns:
+            Tuple of (is_tunneling, query), as for detect()
+        """
+        if record.get("qr") != 0 or not record.get("questions"):
             return False, None
 
+        query = record["query"]
+        if (len(query.split(".")) > self.min_subdomains and len(query) > self.min_length):
+            self.suspicious_queries.append(query)
+            return True, query
+        return False, None
+
     def get_suspicious_queries(self) -> List[str]:
         """Get all detected suspicious queries"""
         return self.suspicious_queries
@@ -1,5 +1,5 @@
 from scapy.all import TCP, IP
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 
 class SynFloodDetector:
     def __init__(self, threshold: int = 100):
@@ -37,6 +37,21 @@ class SynFloodDetector:
             return True, src_ip
         return False, None
 
+    def detect_batch(self, packets) -> List[Tuple[bool, Optional[str]]]:
+        """detect() for a list of packets, with the counter lookups hoisted out of the loop"""
+        counter = self.syn_counter
+        threshold = self.threshold
+        results = []
+        for packet in packets:
+            if not packet.haslayer(TCP) or packet[TCP].flags != 'S' or not packet.haslayer(IP):
+                results.append((False, None))
+                continue
+            src_ip = packet[IP].src
+            count = counter.get(src_ip, 0) + 1
+            counter[src_ip] = count
+            results.append((True, src_ip) if count > threshold else (False, None))
+        return results
+
     def reset(self):
         """Reset the SYN counter"""
         self.syn_counter = {}
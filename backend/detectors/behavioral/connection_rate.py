@@ -37,6 +37,20 @@ class ConnectionRateMonitor:
             
         return False
 
+    def monitor_batch(self, packets) -> List[bool]:
+        """monitor() for a list of packets, sharing one clock reading and window prune"""
+        now = time.time()
+        self.conn_times = [t for t in self.conn_times if now - t < self.window]
+
+        results = []
+        for _ in packets:
+            self.conn_times.append(now)
+            exceeded = len(self.conn_times) > self.limit
+            if exceeded:
+                self.alert_count += 1
+            results.append(exceeded)
+        return results
+
     def get_alert_count(self) -> int:
         """Get total number of rate limit alerts"""
         return self.alert_count
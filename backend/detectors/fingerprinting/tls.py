@@ -1,7 +1,8 @@
-from scapy.layers.tls.all import TLS, TLSClientHello
-import hashlib
+from scapy.layers.inet import TCP
 from typing import Optional, Set
 
+from ...sniffer.protocols.tls import parse_payload, looks_like_tls
+
 class TLSFingerprinter:
     def __init__(self):
         """Initialize TLS fingerprinter"""
@@ -17,19 +18,27 @@ class TLSFingerprinter:
         Returns:
             JA3 hash string if found, None otherwise
         """
-        if not packet.haslayer(TLSClientHello):
+        if not packet.haslayer(TCP):
             return None
+        return self.get_ja3_payload(bytes(packet[TCP].payload))
 
-        try:
-            hello = packet[TLSClientHello]
-            ciphers = "-".join(map(str, hello.ciphers))
-            extensions = "-".join(str(e.ext_type) for e in hello.ext)
-            ja3_str = f"{hello.version},{ciphers},{extensions},0,0"
-            ja3_hash = hashlib.md5(ja3_str.encode()).hexdigest()
-            self.ja3_hashes.add(ja3_hash)
-            return ja3_hash
-        except Exception:
+    def get_ja3_payload(self, payload) -> Optional[str]:
+        """
+        Extract JA3 fingerprint from a raw TCP payload.
+        
+        Args:
+            payload: TCP payload bytes (or memoryview)
+            
+        Returns:
+            JA3 hash string if the payload carries a ClientHello, None otherwise
+        """
+        if not looks_like_tls(payload):
             return None
+        hello = parse_payload(payload)
+        ja3_hash = hello.get("ja3")
+        if ja3_hash:
+            self.ja3_hashes.add(ja3_hash)
+        return ja3_hash
 
     def get_all_ja3(self) -> Set[str]:
         """Get all unique JA3 hashes detected"""
@@ -38,4 +47,3 @@ class TLSFingerprinter:
     def reset(self):
         """Reset collected hashes"""
         self.ja3_hashes = set()
-        
\ No newline at end of file
@@ -13,7 +13,8 @@ class FlowAnalyzer:
             dport = packet[proto].dport if proto != 'OTHER' else 0
 
             flow_key = (src, dst, sport, dport, proto)
-            self.flows[flow_key].append(packet.time)
+            # Plain floats; scapy's EDecimal times are several times larger
+            self.flows[flow_key].append(float(packet.time))
 
     def get_active_flows(self):
         return self.flows
@@ -2,4 +2,4 @@
 
 from .core import Sniffer
 from .offline_analyzer import OfflineAnalyzer
-
+from .record import PacketRecord
@@ -0,0 +1,266 @@
+# sniffer/adapters/afpacket_adapter.py
+"""
+Linux AF_PACKET capture using a memory-mapped TPACKET_V3 receive ring.
+
+The kernel fills whole blocks of frames into a ring shared with userspace, so
+a single wake-up hands us many packets and nothing is copied out of the ring
+until a consumer asks for it. Each filled block is delivered to the callback
+as batches of `(frame, timestamp)` tuples where `frame` is a `memoryview`
+slice of the ring; frames are only valid for the duration of the callback and
+must be copied (e.g. `bytes(frame)`) if they need to outlive it.
+"""
+import mmap
+import select
+import socket
+import struct
+import threading
+import time
+
+from .scapy_adapter import build_filter_expr, replace_filter
+from ..batching import DEFAULT_BATCH_SIZE
+from .socket_cache import socket_cache
+from .kernel_stats import KernelStats
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TPACKET_ALIGNMENT = 16
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_req3
+TPACKET_REQ3 = struct.Struct("IIIIIII")
+# struct tpacket_block_desc + struct tpacket_hdr_v1, up to blk_len
+BLOCK_DESC = struct.Struct("IIIIII")
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr, up to tp_net
+PACKET_HDR = struct.Struct("IIIIIIHH")
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+DEFAULT_BLOCK_COUNT = 64
+DEFAULT_FRAME_SIZE = 2048
+DEFAULT_BLOCK_TIMEOUT_MS = 64
+
+
+class RxRing:
+    """An AF_PACKET socket with its mapped receive ring and read position"""
+
+    def __init__(self, sock, ring):
+        self.sock = sock
+        self.ring = ring
+        self.view = memoryview(ring)
+        self.block = 0
+
+    def close(self):
+        """Unmap the ring and close the socket"""
+        self.view.release()
+        try:
+            self.ring.close()
+        except BufferError:
+            # A consumer kept a frame view; the map goes away with it
+            pass
+        self.sock.close()
+
+
+class AFPacketSniffer:
+    def __init__(self, iface, filters, callback,
+                 block_size=DEFAULT_BLOCK_SIZE,
+                 block_count=DEFAULT_BLOCK_COUNT,
+                 frame_size=DEFAULT_FRAME_SIZE,
+                 block_timeout_ms=DEFAULT_BLOCK_TIMEOUT_MS,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 filter_expr=None,
+                 reuse_socket=True):
+        """
+        Initialize the AF_PACKET capture.
+
+        Args:
+            iface: Interface to capture on
+            filters: Protocol names or BPF expressions, see BPF_MAP
+            callback: Called with a list of up to batch_size (frame, timestamp) tuples
+            block_size: Size of one ring block in bytes (multiple of the page size)
+            block_count: Number of blocks in the ring
+            frame_size: Nominal frame slot size used to size the ring
+            block_timeout_ms: Time after which the kernel retires a partly filled
+                block, which also bounds how long a frame waits for its batch
+            batch_size: Maximum frames per callback
+            filter_expr: Complete BPF expression to use instead of building one from filters
+            reuse_socket: Park the ring in the socket cache on close instead of closing it
+        """
+        if block_size % mmap.PAGESIZE:
+            raise ValueError(f"Ring block size must be a multiple of the page size ({mmap.PAGESIZE})")
+        if frame_size % TPACKET_ALIGNMENT or frame_size > block_size:
+            raise ValueError(f"Ring frame size must be a multiple of {TPACKET_ALIGNMENT} and fit in a block")
+        if block_count < 1:
+            raise ValueError("Ring block count must be at least 1")
+
+        self.iface = iface
+        self.filters = filters
+        self.callback = callback
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout_ms = block_timeout_ms
+        self.batch_size = batch_size
+        self.filter_expr = build_filter_expr(filters) if filter_expr is None else filter_expr
+        self.reuse_socket = reuse_socket
+        # Packets the kernel filter let through to us
+        self.packets_received = 0
+        # Packets the kernel dropped because the ring was full
+        self.kernel_stats = KernelStats()
+        self.running = False
+        self._stop_sniffer = threading.Event()
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._rx = None
+        # Frames captured before this time belong to a previous session
+        self._discard_before = 0.0
+        self._key = ("afpacket", iface, self.filter_expr, block_size, block_count, frame_size, block_timeout_ms)
+
+    def open(self):
+        """Set up the socket and mapped ring, reusing a parked one with the same layout and filter"""
+        if self._rx is not None:
+            return
+        if not self.reuse_socket:
+            self._rx = self._open_ring()
+            self.kernel_stats.reset(self._rx.sock)
+            return
+        self._rx, reused = socket_cache.acquire(self._key, self._open_ring)
+        if reused:
+            self._discard_before = time.time()
+            self._discard_pending()
+        self.kernel_stats.reset(self._rx.sock)
+
+    def _open_ring(self):
+        """Create the socket, set up the mapped ring and attach the kernel filter"""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            # The filter goes on before bind so nothing unfiltered is queued
+            if self.filter_expr:
+                from scapy.arch.linux import attach_filter
+                attach_filter(sock, self.filter_expr, self.iface)
+
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_count = (self.block_size // self.frame_size) * self.block_count
+            req = TPACKET_REQ3.pack(
+                self.block_size, self.block_count,
+                self.frame_size, frame_count,
+                self.block_timeout_ms, 0, 0
+            )
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+
+            ring = mmap.mmap(
+                sock.fileno(), self.block_size * self.block_count,
+                mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE
+            )
+            sock.bind((self.iface, ETH_P_ALL))
+        except Exception:
+            sock.close()
+            raise
+        return RxRing(sock, ring)
+
+    def close(self):
+        """Hand the socket and ring back to the cache for a later session to reuse"""
+        if self._rx is not None:
+            self.kernel_stats.poll(self._rx.sock)
+            if self.reuse_socket:
+                socket_cache.release(self._key, self._rx, RxRing.close)
+            else:
+                self._rx.close()
+            self._rx = None
+
+    def set_filter(self, expression):
+        """Replace the kernel filter of the open socket"""
+        self.filter_expr = expression
+        self._key = ("afpacket", self.iface, expression) + self._key[3:]
+        if self._rx is not None:
+            replace_filter(self._rx.sock, expression, self.iface)
+
+    def _discard_pending(self):
+        """
+        Give blocks filled while the ring was parked straight back to the kernel.
+
+        The block the kernel is filling right now may still mix old and new
+        frames; those are skipped by timestamp in _walk_block.
+        """
+        rx = self._rx
+        for _ in range(self.block_count):
+            offset = rx.block * self.block_size
+            if not self._block_ready(offset):
+                break
+            struct.pack_into("I", rx.ring, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            rx.block = (rx.block + 1) % self.block_count
+
+    def start(self):
+        self.open()
+        self.running = True
+        self._stopped.clear()
+
+        rx = self._rx
+        poller = select.poll()
+        poller.register(rx.sock, select.POLLIN | select.POLLERR)
+
+        try:
+            while not self._stop_sniffer.is_set():
+                offset = rx.block * self.block_size
+                if not self._block_ready(offset):
+                    # Wake up regularly so stop() is noticed
+                    poller.poll(100)
+                    continue
+                self._walk_block(offset)
+                # The kernel fills blocks in order; remember where we are so
+                # a session reusing this ring picks up at the right block
+                rx.block = (rx.block + 1) % self.block_count
+        finally:
+            self.close()
+            self.running = False
+            self._stopped.set()
+
+        return True
+
+    def stop(self, timeout=3):
+        """Ask the capture loop to exit and wait up to timeout seconds for it"""
+        self._stop_sniffer.set()
+        return self._stopped.wait(timeout)
+
+    def get_kernel_stats(self):
+        """Kernel packet/drop totals for this capture, None if unavailable"""
+        rx = self._rx
+        if rx is not None:
+            self.kernel_stats.poll(rx.sock)
+        return self.kernel_stats.get_stats()
+
+    def _block_ready(self, offset):
+        status = struct.unpack_from("I", self._rx.ring, offset + BLOCK_STATUS_OFFSET)[0]
+        return bool(status & TP_STATUS_USER)
+
+    def _walk_block(self, offset):
+        """Hand the frames of a filled block to the callback, then return it to the kernel"""
+        ring = self._rx.ring
+        view = self._rx.view
+        _, _, _, num_pkts, first_pkt, _ = BLOCK_DESC.unpack_from(ring, offset)
+        pkt_offset = offset + first_pkt
+        self.packets_received += num_pkts
+        callback = self.callback
+        batch_size = self.batch_size
+        discard_before = self._discard_before
+        batch = []
+
+        try:
+            for _ in range(num_pkts):
+                next_offset, sec, nsec, snaplen, _, _, mac, _ = PACKET_HDR.unpack_from(ring, pkt_offset)
+                timestamp = sec + nsec / 1e9
+                if timestamp >= discard_before:
+                    start = pkt_offset + mac
+                    batch.append((view[start:start + snaplen], timestamp))
+                    if len(batch) >= batch_size:
+                        callback(batch)
+                        batch = []
+                pkt_offset += next_offset
+            if batch:
+                callback(batch)
+        finally:
+            struct.pack_into("I", ring, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
@@ -0,0 +1,54 @@
+# sniffer/adapters/kernel_stats.py
+import socket
+import struct
+import threading
+
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+# struct tpacket_stats; TPACKET_V3 sockets append tp_freeze_q_cnt, which we ignore
+TPACKET_STATS = struct.Struct("II")
+
+
+class KernelStats:
+    """
+    Running totals of the kernel's PACKET_STATISTICS for one packet socket.
+
+    The kernel resets its counters on every read, so each poll adds the
+    delta to our totals. Polling happens from status requests, never from
+    the capture loop.
+    """
+
+    def __init__(self):
+        self.packets = 0
+        self.drops = 0
+        self.available = hasattr(socket, "AF_PACKET")
+        self._lock = threading.Lock()
+
+    def poll(self, sock):
+        """Add what the kernel counted since the last poll"""
+        if not self.available or sock is None:
+            return
+        with self._lock:
+            try:
+                raw = sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12)
+            except AttributeError:
+                self.available = False
+                return
+            except OSError:
+                # Socket closed under us; keep the totals we have
+                return
+            packets, drops = TPACKET_STATS.unpack_from(raw)
+            self.packets += packets
+            self.drops += drops
+
+    def reset(self, sock):
+        """Throw away what the kernel counted so far, e.g. while a socket was parked"""
+        self.poll(sock)
+        self.packets = 0
+        self.drops = 0
+
+    def get_stats(self):
+        """Return the totals, or None when the platform has no packet statistics"""
+        if not self.available:
+            return None
+        return {"packets": self.packets, "drops": self.drops}
@@ -0,0 +1,241 @@
+# sniffer/adapters/mmap_reader.py
+"""
+Zero-copy reader for classic pcap and pcapng files.
+
+The file is memory-mapped and walked record by record with `struct`; every
+record comes out as a `(timestamp, linktype, frame)` tuple where `frame` is
+a `memoryview` slice of the mapping, so nothing is read into Python objects
+beyond the header fields. Frames go straight into the fast-path decoder.
+
+Classic pcap is read in both byte orders, with microsecond or nanosecond
+timestamps. pcapng is read block by block: Section Header Blocks set the
+byte order, Interface Description Blocks give each interface its link type
+and timestamp resolution, and Enhanced Packet Blocks carry the frames.
+Other blocks are skipped. A classic pcap record cut off in its frame comes
+out with the bytes there are, as it does from scapy's PcapReader; a cut
+record header or pcapng block ends the file.
+
+Frames stay valid after the reader is closed: the mapping is only unmapped
+once the last frame referring to it is gone.
+"""
+import mmap
+import struct
+
+# Classic pcap magic numbers: (byte order, timestamp fraction scale)
+PCAP_MAGIC = {
+    b"\xa1\xb2\xc3\xd4": (">", 1e6),
+    b"\xd4\xc3\xb2\xa1": ("<", 1e6),
+    b"\xa1\xb2\x3c\x4d": (">", 1e9),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e9),
+}
+PCAP_HEADER_SIZE = 24
+PCAP_RECORD_SIZE = 16
+# Frames are cut to this length, as scapy's readers do
+MAX_FRAME_SIZE = 0xFFFF
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+# Section byte-order magic as it appears in little/big endian files
+PCAPNG_LITTLE_ENDIAN = b"\x4d\x3c\x2b\x1a"
+PCAPNG_BIG_ENDIAN = b"\x1a\x2b\x3c\x4d"
+PCAPNG_OPT_TSRESOL = 9
+# Block type, block length, interface, timestamp high/low, captured and original length
+EPB_HEADER_SIZE = 28
+
+
+class CaptureReader:
+    """
+    Memory-mapped pcap/pcapng file; iterate it for (timestamp, linktype,
+    frame) tuples.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Capture file
+
+        Raises:
+            ValueError: The file is neither classic pcap nor pcapng
+        """
+        with open(path, "rb") as f:
+            header = f.read(PCAP_HEADER_SIZE)
+            if header[:4] in PCAP_MAGIC and len(header) == PCAP_HEADER_SIZE:
+                self.format = "pcap"
+            elif header[:4] == PCAPNG_SHB.to_bytes(4, "big") and len(header) >= 12:
+                self.format = "pcapng"
+            else:
+                raise ValueError(f"Not a pcap or pcapng file: {path}")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.size = len(self._view)
+        if self.format == "pcap":
+            self.endian, self.scale = PCAP_MAGIC[header[:4]]
+            self.linktype = struct.unpack_from(self.endian + "I", header, 20)[0]
+
+    def __iter__(self):
+        if self.format == "pcap":
+            return self.records()
+        return _iter_pcapng(self._view, self.size)
+
+    def records(self, start=PCAP_HEADER_SIZE, end=None):
+        """
+        Records of a classic pcap file between two record boundaries, the
+        whole file by default.
+        """
+        if self.format != "pcap":
+            raise ValueError("Byte ranges are only supported for classic pcap files")
+        end = self.size if end is None else min(end, self.size)
+        return _iter_pcap(self._view, self.endian, self.scale, self.linktype, start, end)
+
+    def batches(self, batch_size, start=PCAP_HEADER_SIZE, end=None, offsets=None):
+        """
+        Records in (linktype, [(frame, timestamp), ...]) batches of up to
+        batch_size; consecutive records share a batch only if they have the
+        same link type. start and end are as for records().
+
+        offsets, an array("q") or list, gets the file offset of every frame
+        appended, before the frame's batch is yielded.
+        """
+        if self.format != "pcap":
+            yield from batch_records(_iter_pcapng(self._view, self.size, offsets), batch_size)
+            return
+        end = self.size if end is None else min(end, self.size)
+        for batch in _iter_pcap_batches(self._view, self.endian, self.scale, start, end, batch_size, offsets):
+            yield self.linktype, batch
+
+    def close(self):
+        """Unmap the file, or leave that to the last frame still referring to it"""
+        if self._view is None:
+            return
+        self._view.release()
+        self._view = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _iter_pcap(view, endian, scale, linktype, off, end):
+    unpack_from = struct.Struct(endian + "IIII").unpack_from
+    limit = end - PCAP_RECORD_SIZE
+    while off <= limit:
+        sec, frac, caplen, _ = unpack_from(view, off)
+        start = off + PCAP_RECORD_SIZE
+        off = start + caplen
+        # Slicing stops at the end of the file by itself
+        if caplen > MAX_FRAME_SIZE:
+            yield sec + frac / scale, linktype, view[start:start + MAX_FRAME_SIZE]
+        else:
+            yield sec + frac / scale, linktype, view[start:off]
+
+
+def _iter_pcap_batches(view, endian, scale, off, end, batch_size, offsets=None):
+    # _iter_pcap building the batches in place, which saves a generator
+    # round trip per record
+    unpack_from = struct.Struct(endian + "IIII").unpack_from
+    limit = end - PCAP_RECORD_SIZE
+    mark = offsets.append if offsets is not None else None
+    batch = []
+    append = batch.append
+    count = 0
+    while off <= limit:
+        sec, frac, caplen, _ = unpack_from(view, off)
+        start = off + PCAP_RECORD_SIZE
+        off = start + caplen
+        if mark is not None:
+            mark(start)
+        if caplen > MAX_FRAME_SIZE:
+            append((view[start:start + MAX_FRAME_SIZE], sec + frac / scale))
+        else:
+            append((view[start:off], sec + frac / scale))
+        count += 1
+        if count == batch_size:
+            yield batch
+            batch = []
+            append = batch.append
+            count = 0
+    if batch:
+        yield batch
+
+
+def batch_records(records, batch_size):
+    """Group (timestamp, linktype, frame) records as CaptureReader.batches() does"""
+    current = None
+    batch = []
+    for timestamp, linktype, frame in records:
+        if batch and (linktype != current or len(batch) >= batch_size):
+            yield current, batch
+            batch = []
+        current = linktype
+        batch.append((frame, timestamp))
+    if batch:
+        yield current, batch
+
+
+def _iter_pcapng(view, size, offsets=None):
+    endian = "<"
+    mark = offsets.append if offsets is not None else None
+    block_head = struct.Struct("<II").unpack_from
+    epb_head = struct.Struct("<7I").unpack_from
+    # Per section: interface id -> (link type, timestamp divisor)
+    interfaces = []
+    off = 0
+    while off + 12 <= size:
+        if off + EPB_HEADER_SIZE <= size:
+            # Read as a packet block up front, nearly every block is one
+            block_type, block_len, interface, high, low, caplen, _ = epb_head(view, off)
+            if (block_type == PCAPNG_EPB and EPB_HEADER_SIZE + 4 <= block_len
+                    and off + block_len <= size and interface < len(interfaces)):
+                linktype, divisor = interfaces[interface]
+                start = off + EPB_HEADER_SIZE
+                stop = start + caplen
+                if caplen > MAX_FRAME_SIZE or stop > off + block_len - 4:
+                    stop = start + min(caplen, MAX_FRAME_SIZE, block_len - EPB_HEADER_SIZE - 4)
+                if mark is not None:
+                    mark(start)
+                yield ((high << 32) | low) / divisor, linktype, view[start:stop]
+                off += block_len
+                continue
+        else:
+            block_type, block_len = block_head(view, off)
+
+        if block_type == PCAPNG_SHB:
+            magic = bytes(view[off + 8:off + 12])
+            if magic == PCAPNG_LITTLE_ENDIAN:
+                endian = "<"
+            elif magic == PCAPNG_BIG_ENDIAN:
+                endian = ">"
+            else:
+                return
+            block_head = struct.Struct(endian + "II").unpack_from
+            epb_head = struct.Struct(endian + "7I").unpack_from
+            block_len = block_head(view, off)[1]
+            interfaces = []
+        if block_len < 12 or off + block_len > size:
+            return
+        if block_type == PCAPNG_IDB and block_len >= 20:
+            linktype = struct.unpack_from(endian + "H", view, off + 8)[0]
+            interfaces.append((linktype, _tsresol(view, endian, off + 16, off + block_len - 4)))
+        off += block_len
+
+
+def _tsresol(view, endian, off, end):
+    """Timestamp units per second from the options of an Interface Description Block"""
+    option = struct.Struct(endian + "HH")
+    while off + 4 <= end:
+        code, length = option.unpack_from(view, off)
+        if code == 0:
+            break
+        if code == PCAPNG_OPT_TSRESOL and length >= 1 and off + 5 <= end:
+            value = view[off + 4]
+            return (2 if value & 0x80 else 10) ** (value & 0x7F)
+        off += 4 + length + (-length) % 4
+    return 1000000
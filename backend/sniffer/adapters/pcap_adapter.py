@@ -1,11 +1,131 @@
 # sniffer/adapters/pcap_adapter.py
-from scapy.all import rdpcap
+import mmap
+import shutil
+import struct
+import tempfile
+
+from scapy.all import PcapReader, RawPcapReader
+
+from ..batching import iter_batches, DEFAULT_BATCH_SIZE
+from .mmap_reader import CaptureReader, batch_records, PCAP_MAGIC, PCAP_HEADER_SIZE, PCAP_RECORD_SIZE
+
+LINKTYPE_ETHERNET = 1
+SPOOL_CHUNK_SIZE = 1024 * 1024
 
 def read_pcap(path):
-    """Read a PCAP file and return the packets"""
-    packets = rdpcap(path)
+    """Count the packets of a PCAP or PCAPNG file without reading the frames"""
+    try:
+        reader = CaptureReader(path)
+    except ValueError:
+        # Compressed or otherwise unusual files only scapy can open
+        with RawPcapReader(path) as raw_reader:
+            packet_count = sum(1 for _ in raw_reader)
+    else:
+        with reader:
+            packet_count = sum(1 for _ in reader)
     return {
-        "packet_count": len(packets),
+        "packet_count": packet_count,
         "file_path": path
     }
 
+def spool_to_file(fileobj, suffix=".pcap", digest=None):
+    """
+    Copy an uploaded file object to a named temporary file.
+
+    Copies in SPOOL_CHUNK_SIZE chunks, so an upload is never held in memory
+    at once. The caller deletes the file.
+
+    Args:
+        fileobj: File object to copy
+        suffix: Suffix of the temporary file
+        digest: Optional hashlib object fed the bytes as they are copied
+
+    Returns:
+        Path of the temporary file
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        if digest is None:
+            shutil.copyfileobj(fileobj, tmp, SPOOL_CHUNK_SIZE)
+        else:
+            for chunk in iter(lambda: fileobj.read(SPOOL_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                tmp.write(chunk)
+        return tmp.name
+
+def iter_pcap_batches(path, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield the packets of a PCAP file in lists of up to batch_size"""
+    with PcapReader(path) as reader:
+        yield from iter_batches(reader, batch_size)
+
+def iter_frame_batches(path, batch_size=DEFAULT_BATCH_SIZE, offsets=None):
+    """
+    Yield the raw frames of a PCAP or PCAPNG file without dissecting them.
+
+    Frames are memoryview slices of the memory-mapped file (bytes for files
+    only scapy can open, such as compressed ones). offsets gets the file
+    offset of every frame appended, see CaptureReader.batches(); it is left
+    alone for files only scapy can open.
+
+    Yields:
+        (linktype, frames) with frames a list of up to batch_size
+        (frame, timestamp) tuples; consecutive frames share a batch only if
+        they have the same link type
+    """
+    try:
+        reader = CaptureReader(path)
+    except ValueError:
+        yield from batch_records(_iter_scapy_records(path), batch_size)
+        return
+    with reader:
+        yield from reader.batches(batch_size, offsets=offsets)
+
+def _iter_scapy_records(path):
+    with RawPcapReader(path) as reader:
+        pcapng = not hasattr(reader, "nano")
+        scale = 1e9 if getattr(reader, "nano", False) else 1e6
+        for frame, meta in reader:
+            if pcapng:
+                yield ((meta.tshigh << 32) | meta.tslow) / meta.tsresol, meta.linktype, frame
+            else:
+                yield meta.sec + meta.usec / scale, reader.linktype, frame
+
+def split_pcap(path, chunks):
+    """
+    Split a classic pcap file into byte ranges on record boundaries.
+
+    Walks the record headers and cuts a range once it holds about
+    1/chunks of the file, so every range can be read on its own with
+    iter_pcap_range.
+
+    Returns:
+        [(start, end), ...], or None if the file is not a classic pcap file
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        if magic not in PCAP_MAGIC or f.seek(0, 2) < PCAP_HEADER_SIZE:
+            return None
+        endian = PCAP_MAGIC[magic][0]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            target = max(1, (size - PCAP_HEADER_SIZE) // max(1, chunks))
+            unpack_from = struct.Struct(endian + "8xI").unpack_from
+            ranges = []
+            start = off = PCAP_HEADER_SIZE
+            limit = size - PCAP_RECORD_SIZE
+            while off <= limit:
+                off += PCAP_RECORD_SIZE + unpack_from(data, off)[0]
+                if off - start >= target:
+                    ranges.append((start, min(off, size)))
+                    start = off
+            if start < size:
+                ranges.append((start, size))
+    return ranges
+
+def iter_pcap_range(path, start, end, batch_size=DEFAULT_BATCH_SIZE, offsets=None):
+    """
+    Yield the raw frames of the records between two record boundaries of a
+    classic pcap file, batched like iter_frame_batches, so any split of a
+    file reads back exactly what a pass over the whole file reads.
+    """
+    with CaptureReader(path) as reader:
+        yield from reader.batches(batch_size, start, end, offsets)
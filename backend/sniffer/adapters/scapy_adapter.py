@@ -1,8 +1,13 @@
 # sniffer/adapters/scapy_adapter.py
-from scapy.all import sniff
+from scapy.all import conf
+import socket
 import threading
 import time
 
+from ..batching import PacketBatcher, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_DELAY_MS
+from .socket_cache import socket_cache
+from .kernel_stats import KernelStats
+
 BPF_MAP = {
     "tcp": "tcp",
     "udp": "udp",
@@ -14,40 +19,147 @@ BPF_MAP = {
     "arp": "arp"
 }
 
+# How long the capture loop waits for traffic before checking for stop/flush
+POLL_INTERVAL = 0.05
+# Upper bound on stale packets thrown away when a parked socket is reused
+MAX_STALE_PACKETS = 100000
+SO_DETACH_FILTER = 27
+
+def build_filter_expr(filters):
+    """Turn protocol names (or raw BPF snippets) into a single BPF expression"""
+    if not filters:
+        return ""
+    return " or ".join([BPF_MAP.get(proto, proto) for proto in filters])
+
+def replace_filter(sock, expression, iface=None):
+    """Swap the kernel filter on an open packet socket; "" removes it"""
+    if expression:
+        from scapy.arch.linux import attach_filter
+        attach_filter(sock, expression, iface)
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+    except OSError:
+        # No filter attached
+        pass
+
 class ScapySniffer:
-    def __init__(self, iface, filters, callback):
+    def __init__(self, iface, filters, callback,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_delay_ms=DEFAULT_BATCH_DELAY_MS, raw=False,
+                 filter_expr=None, reuse_socket=True):
+        """
+        Args:
+            iface: Interface to capture on
+            filters: Protocol names or BPF expressions, see BPF_MAP
+            callback: Called with a list of up to batch_size scapy packets,
+                or (frame, timestamp) tuples when raw is set
+            batch_size: Maximum packets per callback
+            batch_delay_ms: Maximum time a packet waits for its batch to fill
+            raw: Deliver undissected frame bytes instead of scapy packets
+            filter_expr: Complete BPF expression to use instead of building one from filters
+            reuse_socket: Park the socket in the socket cache on close instead of closing it
+        """
         self.iface = iface
         self.filters = filters
         self.callback = callback
+        self.batch_size = batch_size
+        self.batch_delay_ms = batch_delay_ms
+        self.raw = raw
+        self.filter_expr = build_filter_expr(filters) if filter_expr is None else filter_expr
+        self.reuse_socket = reuse_socket
+        # Packets the kernel filter let through to us
+        self.packets_received = 0
+        # Packets the kernel dropped because we did not read fast enough
+        self.kernel_stats = KernelStats()
         self.running = False
         self._stop_sniffer = threading.Event()
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._sock = None
+        self._key = ("scapy", iface, self.filter_expr)
+
+    def open(self):
+        """Open the listening socket, reusing a parked one for the same interface and filter"""
+        if self._sock is not None:
+            return
+        if not self.reuse_socket:
+            self._sock = self._open_socket()
+            self.kernel_stats.reset(getattr(self._sock, "ins", None))
+            return
+        self._sock, reused = socket_cache.acquire(self._key, self._open_socket)
+        if reused:
+            self._discard_pending()
+        self.kernel_stats.reset(getattr(self._sock, "ins", None))
+
+    def _open_socket(self):
+        return conf.L2listen(iface=self.iface, filter=self.filter_expr or None)
+
+    def close(self):
+        """Hand the socket back to the cache for a later session to reuse"""
+        if self._sock is not None:
+            self.kernel_stats.poll(getattr(self._sock, "ins", None))
+            if self.reuse_socket:
+                socket_cache.release(self._key, self._sock, _close_socket)
+            else:
+                _close_socket(self._sock)
+            self._sock = None
+
+    def set_filter(self, expression):
+        """Replace the kernel filter of the open socket"""
+        self.filter_expr = expression
+        self._key = ("scapy", self.iface, expression)
+        if self._sock is not None:
+            replace_filter(self._sock.ins, expression, self.iface)
+
+    def _discard_pending(self):
+        """Drop packets that queued up while the socket was parked"""
+        sock = self._sock
+        for _ in range(MAX_STALE_PACKETS):
+            if not sock.select([sock], 0):
+                break
+            sock.recv_raw()
         
     def start(self):
+        self.open()
         self.running = True
-        self._stop_sniffer.clear()
+        self._stopped.clear()
         
-        filter_expr = ""
-        if self.filters:
-            filter_expr = " or ".join([BPF_MAP.get(proto, proto) for proto in self.filters])
+        sock = self._sock
+        batcher = PacketBatcher(self.callback, self.batch_size, self.batch_delay_ms)
+        raw = self.raw
         
-        # Use stop_filter to check the event periodically
-        sniff(
-            iface=self.iface, 
-            prn=self.callback, 
-            filter=filter_expr, 
-            store=False,
-            stop_filter=lambda _: self._stop_sniffer.is_set()
-        )
-        
-        self.running = False
+        try:
+            while not self._stop_sniffer.is_set():
+                for ready in sock.select([sock], POLL_INTERVAL) or []:
+                    if raw:
+                        _, frame, timestamp = ready.recv_raw()
+                        if frame:
+                            self.packets_received += 1
+                            batcher.add((frame, timestamp or time.time()))
+                        continue
+                    packet = ready.recv()
+                    if packet is not None:
+                        self.packets_received += 1
+                        batcher.add(packet)
+                batcher.flush_if_due()
+            batcher.flush()
+        finally:
+            self.close()
+            self.running = False
+            self._stopped.set()
         return True
         
-    def stop(self):
+    def stop(self, timeout=3):
+        """Ask the capture loop to exit and wait up to timeout seconds for it"""
         self._stop_sniffer.set()
-        # Wait for the sniffer to actually stop
-        timeout = 3  # seconds
-        start_time = time.time()
-        while self.running and time.time() - start_time < timeout:
-            time.sleep(0.1)
-        return not self.running
+        return self._stopped.wait(timeout)
+
+    def get_kernel_stats(self):
+        """Kernel packet/drop totals for this capture, None if unavailable"""
+        sock = self._sock
+        if sock is not None:
+            self.kernel_stats.poll(getattr(sock, "ins", None))
+        return self.kernel_stats.get_stats()
 
+def _close_socket(sock):
+    sock.close()
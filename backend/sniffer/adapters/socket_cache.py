@@ -0,0 +1,105 @@
+# sniffer/adapters/socket_cache.py
+import threading
+import time
+
+DEFAULT_IDLE_TIMEOUT = 30  # seconds
+
+
+class SocketCache:
+    """
+    Keeps capture sockets of stopped sessions open for a short while.
+
+    Restarting a session on the same interface with the same filter picks the
+    parked socket up again instead of opening (and filter-compiling) a new
+    one. Sockets that stay idle longer than `idle_timeout` are closed by a
+    timer that runs while any are parked.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self.reused = 0
+        self.opened = 0
+
+    def acquire(self, key, factory):
+        """
+        Return a parked socket for key, or open one with factory().
+
+        Returns:
+            Tuple of (resource, reused)
+        """
+        with self._lock:
+            self._reap()
+            parked = self._idle.pop(key, None)
+            if parked is not None:
+                self.reused += 1
+                return parked[0], True
+        resource = factory()
+        with self._lock:
+            self.opened += 1
+        return resource, False
+
+    def release(self, key, resource, close):
+        """Park a socket for reuse; close(resource) is called when it expires"""
+        with self._lock:
+            self._reap()
+            previous = self._idle.pop(key, None)
+            self._idle[key] = (resource, close, time.time())
+            self._schedule()
+        if previous is not None:
+            previous[1](previous[0])
+
+    def close_all(self):
+        """Close every parked socket"""
+        with self._lock:
+            idle = list(self._idle.values())
+            self._idle = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for resource, close, _ in idle:
+            close(resource)
+
+    def _reap(self):
+        now = time.time()
+        expired = [key for key, (_, _, parked_at) in self._idle.items()
+                   if now - parked_at > self.idle_timeout]
+        for key in expired:
+            resource, close, _ = self._idle.pop(key)
+            close(resource)
+
+    def _schedule(self):
+        """Start the timer for the oldest parked socket, unless one is pending"""
+        if self._timer is not None or not self._idle:
+            return
+        oldest = min(parked_at for _, _, parked_at in self._idle.values())
+        delay = max(oldest + self.idle_timeout - time.time(), 0) + 0.1
+        self._timer = threading.Timer(delay, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            self._timer = None
+            self._reap()
+            self._schedule()
+
+    def get_stats(self):
+        """Return parked socket keys and reuse counters"""
+        with self._lock:
+            now = time.time()
+            idle = [
+                {"key": list(key), "idle_seconds": round(now - parked_at, 1)}
+                for key, (_, _, parked_at) in self._idle.items()
+            ]
+        return {
+            "idle_sockets": idle,
+            "opened": self.opened,
+            "reused": self.reused,
+            "idle_timeout": self.idle_timeout
+        }
+
+
+socket_cache = SocketCache()
@@ -0,0 +1,61 @@
+# sniffer/batching.py
+import time
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_BATCH_DELAY_MS = 50
+
+
+class PacketBatcher:
+    """
+    Collects packets from a capture loop and hands them on in batches.
+
+    A batch is delivered once it holds `max_size` packets, or when the capture
+    loop calls `flush_if_due()` and the oldest packet has waited at least
+    `max_delay_ms`. Only the capture thread touches the batcher, so no locking
+    is needed.
+    """
+
+    def __init__(self, callback, max_size=DEFAULT_BATCH_SIZE, max_delay_ms=DEFAULT_BATCH_DELAY_MS):
+        if max_size < 1:
+            raise ValueError("Batch size must be at least 1")
+        self.callback = callback
+        self.max_size = max_size
+        self.max_delay = max_delay_ms / 1000.0
+        self._batch = []
+        self._started = 0.0
+        self.batch_count = 0
+
+    def add(self, packet):
+        """Queue a packet, delivering the batch if it is full"""
+        batch = self._batch
+        if not batch:
+            self._started = time.monotonic()
+        batch.append(packet)
+        if len(batch) >= self.max_size:
+            self.flush()
+
+    def flush_if_due(self):
+        """Deliver the pending batch if it has waited long enough"""
+        if self._batch and time.monotonic() - self._started >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Deliver whatever is pending"""
+        if not self._batch:
+            return
+        batch = self._batch
+        self._batch = []
+        self.batch_count += 1
+        self.callback(batch)
+
+
+def iter_batches(items, size=DEFAULT_BATCH_SIZE):
+    """Yield lists of up to `size` items from any iterable"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,287 @@
+# sniffer/chunked_analysis.py
+"""
+Parallel offline analysis of large classic pcap files.
+
+The file is split into byte ranges on record boundaries and every range is
+dissected by a worker process into an AnalysisState; the states are merged
+as they come back.
+
+TCP reassembly can't be split that way, since the state of a stream runs
+from its first segment to its last. With reassembly on, the chunks leave
+the stream parsers out, and the streams are split by flow instead: each of
+STREAM_SHARDS_PER_WORKER * workers shard workers reads the file, skips the
+frames of flows that hash to other shards and feeds the rest to its own
+StreamDissector, like the workers of a live DissectionPool. A shard returns
+the frames that completed stream parser results, and the chunks the
+protocol of every frame's record without them; together they say how the
+protocol counts change, which is all the merged state needs to come out as
+a serial pass. As with a live pool, every shard has the whole reassembly
+budget to itself and expires idle flows on its own clock, so the two only
+differ for captures that run into those limits.
+
+When the records go to a column store, every chunk writes its own segments
+and the stream parser results are merged into their frames' rows once all
+chunks are in. Chunks index their frames the same way, and the pieces are
+concatenated at the end.
+
+Progress is counted as chunks come back. Cancelling sets an event every
+worker checks between batches, so the pool stops within a batch; so does
+a worker failing.
+"""
+from array import array
+from bisect import bisect_right
+import concurrent.futures
+import multiprocessing as mp
+import os
+import zlib
+
+from .adapters.pcap_adapter import split_pcap, iter_pcap_range, LINKTYPE_ETHERNET
+
+# More, smaller chunks than workers even out uneven stretches of the file
+CHUNKS_PER_WORKER = 4
+# Stream shards per worker; each reads the whole file
+STREAM_SHARDS_PER_WORKER = 1
+# Seconds between checks for cancellation while waiting for the workers
+CANCEL_POLL_INTERVAL = 0.2
+
+# Set in the workers by _init_worker
+_cancel_event = None
+
+
+def _init_worker(plugins, cancel_event):
+    global _cancel_event
+    from .protocols import registry
+    registry.load_plugins(plugins)
+    _cancel_event = cancel_event
+
+
+def _check_cancelled():
+    if _cancel_event is not None and _cancel_event.is_set():
+        from .offline_analyzer import AnalysisCancelled
+        raise AnalysisCancelled()
+
+
+def _analyze_chunk(path, start, end, stream_parsers, store_path=None, prefix=""):
+    """
+    Returns:
+        (AnalysisState, frames in the chunk, segment entries or None,
+        protocols or None); without stream parsers, protocols is
+        (array of one code per frame, protocol names) with code 0 for
+        frames without a record and n for names[n - 1]
+    """
+    from .offline_analyzer import AnalysisState, dissect_capture_batch
+    from .column_store import SegmentWriter
+    from .frame_index import FrameIndexWriter, INDEX_DIR
+    state = AnalysisState()
+    writer = index = None
+    if store_path is not None:
+        writer = SegmentWriter(store_path, prefix)
+        index = FrameIndexWriter(os.path.join(store_path, INDEX_DIR, prefix))
+    codes = names = None
+    if not stream_parsers:
+        codes = array("B")
+        names = {}
+    frame = 0
+    for linktype, frames in iter_pcap_range(path, start, end, offsets=index.offsets if index else None):
+        _check_cancelled()
+        if index is not None:
+            index.add(linktype, frames)
+        records = dissect_capture_batch(linktype, frames, stream_parsers=stream_parsers)
+        for i, record in enumerate(records):
+            if record is not None:
+                state.add(record)
+                if writer is not None:
+                    record.timestamp = frames[i][1]
+                    writer.append(record, frame + i)
+        if codes is not None:
+            codes.extend([
+                names.setdefault(record.protocol, len(names) + 1) if record is not None else 0
+                for record in records
+            ])
+        frame += len(frames)
+    protocols = (codes, list(names)) if codes is not None else None
+    if writer is None:
+        return state, frame, None, protocols
+    index.close()
+    return state, frame, writer.close(), protocols
+
+
+def _tcp_flow_hash(packet):
+    """flow_hash() for a scapy packet; all that matters is that it is the same both ways"""
+    from scapy.layers.inet import TCP
+    tcp = packet.getlayer(TCP)
+    if tcp is None:
+        return 0
+    ends = sorted(((str(tcp.underlayer.src), tcp.sport), (str(tcp.underlayer.dst), tcp.dport)))
+    return zlib.crc32(repr(ends).encode())
+
+
+def _analyze_streams(path, start, end, budgets, shard, shards):
+    """
+    Feed the frames of the flows of one shard to the stream parsers.
+
+    Returns:
+        ([(frame, timestamp, [stream parser result])] in frame order,
+        reassembly stats)
+    """
+    from .dissect_pool import flow_hash
+    from .offline_analyzer import capture_packets
+    from .protocols import StreamDissector, feed_streams, feed_stream_packets
+
+    streams = StreamDissector(**budgets)
+    completed = []
+    frame = 0
+    for linktype, frames in iter_pcap_range(path, start, end):
+        _check_cancelled()
+        if linktype == LINKTYPE_ETHERNET:
+            picked = [i for i, (data, _) in enumerate(frames) if flow_hash(data) % shards == shard]
+            done = feed_streams([frames[i] for i in picked], streams)
+        else:
+            packets = capture_packets(linktype, frames)
+            picked = [i for i, packet in enumerate(packets) if _tcp_flow_hash(packet) % shards == shard]
+            done = feed_stream_packets([packets[i] for i in picked], streams)
+        for j, results in done:
+            i = picked[j]
+            completed.append((frame + i, frames[i][1], results))
+        frame += len(frames)
+    streams.close_all()
+    return completed, streams.get_stats()
+
+
+def _wait(futures, cancelled):
+    """Yield futures as they complete; raises AnalysisCancelled once cancelled() turns true"""
+    from .offline_analyzer import AnalysisCancelled
+    pending = set(futures)
+    while pending:
+        if cancelled is not None and cancelled():
+            raise AnalysisCancelled()
+        done, pending = concurrent.futures.wait(
+            pending, timeout=CANCEL_POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        yield from done
+
+
+class _ChunkProtocols:
+    """Protocol of every frame's record without the stream parsers, from the chunks"""
+
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks: (frames, protocols) of every chunk, in file order
+        """
+        self._bases = []
+        self._protocols = []
+        base = 0
+        for frames, protocols in chunks:
+            self._bases.append(base)
+            self._protocols.append(protocols)
+            base += frames
+
+    def __getitem__(self, frame):
+        index = bisect_right(self._bases, frame) - 1
+        codes, names = self._protocols[index]
+        code = codes[frame - self._bases[index]]
+        return names[code - 1] if code else None
+
+
+def analyze_chunks(path, workers, budgets=None, store_path=None, progress=None, cancelled=None):
+    """
+    Analyse a classic pcap file with a pool of worker processes.
+
+    Args:
+        path: Capture file
+        workers: Worker processes
+        budgets: StreamDissector keyword arguments, None without reassembly
+        store_path: Column store directory being built, to write the
+            records to; see column_store.py
+        progress: Called with (frames, bytes) of every chunk that is done
+        cancelled: Polled while the workers run; once it returns True the
+            workers stop at their next batch and AnalysisCancelled is raised
+
+    Returns:
+        (AnalysisState, reassembly stats or None, segment entries or None),
+        the same as a serial pass would give; None if the file is not a
+        classic pcap file
+    """
+    from .offline_analyzer import AnalysisState
+    from .column_store import patch_segments
+    from .frame_index import merge_indexes, INDEX_DIR
+    from .protocols import registry, merge_stream_stats, BUILTIN_PARSERS
+
+    ranges = split_pcap(path, workers * CHUNKS_PER_WORKER)
+    if not ranges:
+        return None
+
+    context = mp.get_context("spawn")
+    cancel_event = context.Event()
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=context,
+        initializer=_init_worker, initargs=(registry.plugins(BUILTIN_PARSERS), cancel_event)
+    ) as pool:
+        shards = []
+        if budgets is not None:
+            count = workers * STREAM_SHARDS_PER_WORKER
+            # Each reads the whole file, so they go first
+            shards = [
+                pool.submit(_analyze_streams, path, ranges[0][0], ranges[-1][1], budgets, shard, count)
+                for shard in range(count)
+            ]
+        chunks = [
+            pool.submit(_analyze_chunk, path, start, end, budgets is None, store_path, f"{index:05d}-")
+            for index, (start, end) in enumerate(ranges)
+        ]
+
+        try:
+            sizes = {future: end - start for future, (start, end) in zip(chunks, ranges)}
+            state = AnalysisState()
+            for future in _wait(chunks, cancelled):
+                chunk_state, frames, _, _ = future.result()
+                state.merge(chunk_state)
+                if progress is not None:
+                    progress(frames, sizes[future])
+            segments = None
+            if store_path is not None:
+                index_path = os.path.join(store_path, INDEX_DIR)
+                pieces = [os.path.join(index_path, f"{index:05d}-") for index in range(len(ranges))]
+                merge_indexes(index_path, pieces)
+                # Chunk frames are numbered from the chunk's start
+                segments = []
+                frame_base = 0
+                for future in chunks:
+                    _, frames, chunk_segments, _ = future.result()
+                    for segment in chunk_segments:
+                        segment["frame_base"] = frame_base
+                    segments.extend(chunk_segments)
+                    frame_base += frames
+            stream_stats = None
+            if shards:
+                for _ in _wait(shards, cancelled):
+                    pass
+                protocols = _ChunkProtocols(
+                    (frames, codes) for _, frames, _, codes in (future.result() for future in chunks)
+                )
+                patches = []
+                for future in shards:
+                    completed, _ = future.result()
+                    patches.extend(completed)
+                patches.sort(key=lambda patch: patch[0])
+                replaced = {}
+                for frame, _, results in patches:
+                    before = after = protocols[frame]
+                    for result in results:
+                        after = result.get("protocol", after)
+                    key = (before, after)
+                    replaced[key] = replaced.get(key, 0) + 1
+                for (before, after), count in replaced.items():
+                    state.replace_protocol(before, after, count)
+                stream_stats = merge_stream_stats(future.result()[1] for future in shards)
+                if segments is not None:
+                    patch_segments(store_path, segments, patches)
+        except BaseException:
+            # Stop the other workers at their next batch rather than
+            # waiting out a whole analysis on the way out of the pool
+            cancel_event.set()
+            for future in shards + chunks:
+                future.cancel()
+            raise
+    return state, stream_stats, segments
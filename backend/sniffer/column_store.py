@@ -0,0 +1,731 @@
+# sniffer/column_store.py
+"""
+Columnar on-disk store of the records of an offline analysis.
+
+Records are written in segments of up to SEGMENT_ROWS rows, one NumPy .npy
+file per column, and read back memory-mapped: a query only touches the
+columns it filters, sorts or groups on, and nothing of the capture stays in
+process memory between requests. Columns are laid out as in a RecordTable:
+protocols as codes into a per-segment list of names, addresses as two 64-bit
+halves, missing integers as -1. Fields only application-layer parsers
+produce go to a JSON lines file per segment, one line per row that has any,
+and an "extra" column holds the offset of a row's line, so reading a row
+parses only its own.
+
+A store is a directory holding the segments and store.json, which lists
+them in packet order. Packet numbers are not stored; a row's number is the
+rows of the segments before it plus its position in its own. Every row
+keeps the index of its frame in the capture file, and the directory also
+holds the capture's frame index (frame_index.py), which tells where in the
+file that frame is.
+
+Stores are named by the capture's content and the analysis parameters, so
+analyses of the same capture share one. They are built in a temporary
+directory and renamed into place. Opening a store touches it, and the least
+recently used stores are deleted once they add up to more than
+COLUMN_STORE_MAX_BYTES.
+"""
+from array import array
+from bisect import bisect_right
+import ipaddress
+import json
+import math
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from .record import PacketRecord, RecordTable, ip_text
+
+SEGMENT_ROWS = 1024 * 1024
+STORE_FILE = "store.json"
+EXTRAS_FILE = "extras.jsonl"
+# Column of offsets into EXTRAS_FILE, -1 for rows without extra fields
+EXTRAS_COLUMN = "extra"
+# Part of store.json; bump it when the layout changes
+STORE_FORMAT = 1
+
+# Stored columns and their types
+COLUMNS = {
+    "frame": np.int64,
+    "timestamp": np.float64,
+    "protocol": np.uint8,
+    "ip_version": np.uint8,
+    "src_hi": np.uint64,
+    "src_lo": np.uint64,
+    "dst_hi": np.uint64,
+    "dst_lo": np.uint64,
+    "src_port": np.int32,
+    "dst_port": np.int32,
+    "flags": np.int16,
+    "seq": np.int64,
+    "ack": np.int64,
+}
+# Columns queries can sort and group by
+SORT_COLUMNS = ("packet_number", "timestamp", "src_port", "dst_port", "seq", "ack")
+GROUP_COLUMNS = ("protocol", "src_ip", "dst_ip", "src_port", "dst_port")
+
+_MISSING = -1
+_LOW_BITS = (1 << 64) - 1
+
+
+class SegmentWriter:
+    """Writes records, in frame order, as segments of a store directory"""
+
+    def __init__(self, path, prefix=""):
+        """
+        Args:
+            path: Store directory being built
+            prefix: Segment name prefix, for writers sharing a directory
+        """
+        self.path = path
+        self.prefix = prefix
+        self.segments = []
+        self._table = RecordTable()
+        self._frames = array("q")
+
+    def append(self, record, frame):
+        """Add a PacketRecord as the row of a frame"""
+        self._table.append(record)
+        self._frames.append(frame)
+        if len(self._frames) >= SEGMENT_ROWS:
+            self._flush()
+
+    def close(self):
+        """Write the last segment; returns the segment entries for write_store()"""
+        if self._frames:
+            self._flush()
+        return self.segments
+
+    def _flush(self):
+        name = f"{self.prefix}{len(self.segments):05d}"
+        arrays, protocols, extras = _table_arrays(self._table, self._frames)
+        _save_segment(os.path.join(self.path, name), arrays, extras)
+        frames = arrays["frame"]
+        self.segments.append({
+            "name": name,
+            "rows": len(frames),
+            "protocols": protocols,
+            "frame_base": 0,
+            "first_frame": int(frames[0]),
+            "last_frame": int(frames[-1])
+        })
+        self._table = RecordTable()
+        self._frames = array("q")
+
+
+def _table_arrays(table, frames):
+    """Columns of a RecordTable as arrays of the stored types"""
+    columns, protocols, extras = table.columns()
+    addresses = np.frombuffer(columns["addresses"], dtype=">u8").reshape(-1, 4)
+    arrays = {
+        "frame": np.frombuffer(frames, dtype=np.int64),
+        "src_hi": addresses[:, 0],
+        "src_lo": addresses[:, 1],
+        "dst_hi": addresses[:, 2],
+        "dst_lo": addresses[:, 3],
+    }
+    for name in ("timestamp", "protocol", "ip_version", "src_port", "dst_port", "flags", "seq", "ack"):
+        arrays[name] = np.frombuffer(columns[name], dtype=COLUMNS[name])
+    return arrays, list(protocols), extras
+
+
+def _save_segment(path, arrays, extras):
+    os.makedirs(path, exist_ok=True)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(arrays[name], dtype=dtype))
+    offsets = np.full(len(arrays["frame"]), _MISSING, dtype=np.int64)
+    lines = []
+    size = 0
+    for row in sorted(extras):
+        line = json.dumps(extras[row], separators=(",", ":"), default=str).encode() + b"\n"
+        offsets[row] = size
+        lines.append(line)
+        size += len(line)
+    np.save(os.path.join(path, EXTRAS_COLUMN + ".npy"), offsets)
+    with open(os.path.join(path, EXTRAS_FILE), "wb") as f:
+        f.write(b"".join(lines))
+
+
+def _load_extras(path):
+    """All extra fields of a segment, {row: extra}"""
+    offsets = np.load(os.path.join(path, EXTRAS_COLUMN + ".npy"))
+    with open(os.path.join(path, EXTRAS_FILE), "rb") as f:
+        lines = f.read().split(b"\n")
+    rows = np.flatnonzero(offsets != _MISSING)
+    # Lines are in row order
+    return {int(row): json.loads(line) for row, line in zip(rows, lines)}
+
+
+def patch_segments(path, segments, patches):
+    """
+    Merge parser results that came in after a segment was written (those of
+    the stream parsers) into the rows of their frames, inserting rows for
+    frames that had none.
+
+    Args:
+        path: Store directory being built
+        segments: Segment entries in frame order, with their frame_base set;
+            updated in place
+        patches: (frame, timestamp, [parser result]) in frame order, frames
+            counted from the start of the capture
+    """
+    if not patches:
+        return
+    if not segments:
+        writer = SegmentWriter(path, "patch-")
+        for frame, timestamp, results in patches:
+            writer.append(_patched_record(None, timestamp, results), frame)
+        segments.extend(writer.close())
+        return
+    firsts = [segment["frame_base"] + segment["first_frame"] for segment in segments]
+    by_segment = {}
+    for patch in patches:
+        # Frames before the first segment's go to its start
+        index = max(bisect_right(firsts, patch[0]) - 1, 0)
+        by_segment.setdefault(index, []).append(patch)
+    for index, items in by_segment.items():
+        _patch_segment(os.path.join(path, segments[index]["name"]), segments[index], items)
+
+
+def _patched_record(record, timestamp, results):
+    """The record of a frame with its late results merged in, as a serial pass builds it"""
+    if record is None:
+        record = PacketRecord()
+        record.timestamp = timestamp
+    for result in results:
+        record.update(result)
+    return record
+
+
+def _patch_segment(path, segment, items):
+    arrays = {name: np.load(os.path.join(path, name + ".npy")) for name in COLUMNS}
+    extras = _load_extras(path)
+    protocols = segment["protocols"]
+    base = segment["frame_base"]
+
+    stored = arrays["frame"]
+    table = RecordTable()
+    frames = array("q")
+    for frame, timestamp, results in items:
+        row = int(np.searchsorted(stored, frame - base))
+        record = None
+        if row < len(stored) and stored[row] == frame - base:
+            record = _row_record(lambda name: arrays[name][row].item(), protocols, extras.get(row))
+        table.append(_patched_record(record, timestamp, results))
+        frames.append(frame - base)
+    patch, patch_protocols, patch_extras = _table_arrays(table, frames)
+    for protocol in patch_protocols:
+        if protocol not in protocols:
+            protocols.append(protocol)
+    codes = np.array([protocols.index(protocol) for protocol in patch_protocols], dtype=np.uint8)
+    patch["protocol"] = codes[patch["protocol"]]
+
+    rows = np.searchsorted(arrays["frame"], patch["frame"])
+    found = rows < len(arrays["frame"])
+    found[found] = arrays["frame"][rows[found]] == patch["frame"][found]
+    for name in COLUMNS:
+        arrays[name][rows[found]] = patch[name][found]
+    for i in np.flatnonzero(found):
+        extra = patch_extras.get(int(i))
+        if extra:
+            extras[int(rows[i])] = extra
+        else:
+            extras.pop(int(rows[i]), None)
+
+    inserted = np.flatnonzero(~found)
+    if len(inserted):
+        positions = rows[inserted]
+        for name in COLUMNS:
+            arrays[name] = np.insert(arrays[name], positions, patch[name][inserted])
+        # Rows move down by the rows inserted before or at them
+        position_list = positions.tolist()
+        extras = {row + bisect_right(position_list, row): extra for row, extra in extras.items()}
+        for n, i in enumerate(inserted.tolist()):
+            extra = patch_extras.get(i)
+            if extra:
+                extras[position_list[n] + n] = extra
+        segment["rows"] = len(arrays["frame"])
+        segment["first_frame"] = int(arrays["frame"][0])
+        segment["last_frame"] = int(arrays["frame"][-1])
+    _save_segment(path, arrays, extras)
+
+
+def write_store(path, segments):
+    """Write store.json for the segments, in packet order"""
+    rows = 0
+    for segment in segments:
+        segment["row_base"] = rows
+        rows += segment["rows"]
+    with open(os.path.join(path, STORE_FILE), "w") as f:
+        json.dump({"format": STORE_FORMAT, "rows": rows, "segments": segments}, f, separators=(",", ":"))
+
+
+def _address(text):
+    """(IP version, high 64 bits, low 64 bits) of an address"""
+    address = ipaddress.ip_address(text)
+    value = int(address)
+    return address.version, value >> 64, value & _LOW_BITS
+
+
+class RecordFilter:
+    """Conditions on the rows of a store; a row must meet all of them"""
+
+    def __init__(self, protocols=None, port=None, src_port=None, dst_port=None,
+                 ip=None, src_ip=None, dst_ip=None, start=None, end=None):
+        """
+        Args:
+            protocols: Protocol names, any of them
+            port: Source or destination port
+            src_port: Source port
+            dst_port: Destination port
+            ip: Source or destination address
+            src_ip: Source address
+            dst_ip: Destination address
+            start: Earliest timestamp, inclusive
+            end: Latest timestamp, exclusive
+
+        Raises:
+            ValueError: An address is not a valid IPv4 or IPv6 address
+        """
+        self.protocols = set(protocols) if protocols is not None else None
+        self.port = port
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.ip = _address(ip) if ip is not None else None
+        self.src_ip = _address(src_ip) if src_ip is not None else None
+        self.dst_ip = _address(dst_ip) if dst_ip is not None else None
+        self.start = start
+        self.end = end
+
+    def match(self, store, index):
+        """Matching rows of a segment, in order"""
+        def column(name):
+            return store.column(index, name)
+
+        conditions = []
+        if self.protocols is not None:
+            names = store.segments[index]["protocols"]
+            codes = [code for code, name in enumerate(names) if name in self.protocols]
+            if not codes:
+                return np.empty(0, dtype=np.int64)
+            conditions.append(np.isin(column("protocol"), codes))
+        if self.port is not None:
+            conditions.append((column("src_port") == self.port) | (column("dst_port") == self.port))
+        if self.src_port is not None:
+            conditions.append(column("src_port") == self.src_port)
+        if self.dst_port is not None:
+            conditions.append(column("dst_port") == self.dst_port)
+        if self.ip is not None:
+            conditions.append(_is_address(column, "src", self.ip) | _is_address(column, "dst", self.ip))
+        if self.src_ip is not None:
+            conditions.append(_is_address(column, "src", self.src_ip))
+        if self.dst_ip is not None:
+            conditions.append(_is_address(column, "dst", self.dst_ip))
+        if self.start is not None:
+            conditions.append(column("timestamp") >= self.start)
+        if self.end is not None:
+            conditions.append(column("timestamp") < self.end)
+
+        if not conditions:
+            return np.arange(store.segments[index]["rows"])
+        mask = conditions[0]
+        for condition in conditions[1:]:
+            mask &= condition
+        return np.flatnonzero(mask)
+
+
+def _is_address(column, side, address):
+    version, high, low = address
+    return (
+        (column("ip_version") == version)
+        & (column(side + "_hi") == np.uint64(high))
+        & (column(side + "_lo") == np.uint64(low))
+    )
+
+
+class ColumnStore:
+    """A store opened for reading; columns are memory-mapped as they are used"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Store directory
+
+        Raises:
+            OSError: There is no store at path
+            ValueError: The store is of another format
+        """
+        store_file = os.path.join(path, STORE_FILE)
+        with open(store_file) as f:
+            meta = json.load(f)
+        if meta.get("format") != STORE_FORMAT:
+            raise ValueError(f"Unsupported column store format: {meta.get('format')}")
+        os.utime(store_file)
+        self.path = path
+        self.rows = meta["rows"]
+        self.segments = meta["segments"]
+        self._row_bases = [segment["row_base"] for segment in self.segments]
+        self._last_frames = [segment["frame_base"] + segment["last_frame"] for segment in self.segments]
+        self._columns = {}
+        self._extras = {}
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, index, name):
+        """A column of a segment, memory-mapped"""
+        key = (index, name)
+        column = self._columns.get(key)
+        if column is None:
+            segment_path = os.path.join(self.path, self.segments[index]["name"])
+            column = np.load(os.path.join(segment_path, name + ".npy"), mmap_mode="r")
+            self._columns[key] = column
+        return column
+
+    def extra(self, index, row):
+        """Extra fields of a row of a segment, or None"""
+        offset = int(self.column(index, EXTRAS_COLUMN)[row])
+        if offset == _MISSING:
+            return None
+        extras = self._extras.get(index)
+        if extras is None:
+            with open(os.path.join(self.path, self.segments[index]["name"], EXTRAS_FILE), "rb") as f:
+                extras = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._extras[index] = extras
+        return json.loads(extras[offset:extras.find(b"\n", offset)])
+
+    def locate(self, packet_number):
+        """(segment index, row) of a packet number"""
+        if not 0 <= packet_number < self.rows:
+            raise IndexError(packet_number)
+        index = bisect_right(self._row_bases, packet_number) - 1
+        return index, packet_number - self._row_bases[index]
+
+    def frame(self, packet_number):
+        """Index in the capture file of the frame of a packet"""
+        index, row = self.locate(packet_number)
+        return self.segments[index]["frame_base"] + int(self.column(index, "frame")[row])
+
+    def packet_at(self, frame):
+        """Number of the first packet whose frame is the given one or a later one; None if there is none"""
+        index = bisect_right(self._last_frames, frame - 1)
+        if index == len(self.segments):
+            return None
+        segment = self.segments[index]
+        row = int(np.searchsorted(self.column(index, "frame"), frame - segment["frame_base"]))
+        return segment["row_base"] + row
+
+    def record(self, index, row):
+        """PacketRecord of a row of a segment"""
+        segment = self.segments[index]
+        record = _row_record(
+            lambda name: self.column(index, name)[row].item(), segment["protocols"], self.extra(index, row)
+        )
+        record.packet_number = segment["row_base"] + row
+        return record
+
+    def query(self, where=None, sort="packet_number", descending=False, limit=100, offset=0):
+        """
+        Rows matching a filter, sorted, one page at a time.
+
+        Ties are broken by packet number. Only offset + limit candidates per
+        segment are kept while sorting, so memory depends on the page, not
+        on the matches.
+
+        Args:
+            where: RecordFilter, None for every row
+            sort: One of SORT_COLUMNS
+            descending: Sort from the largest value down
+            limit: Rows to return
+            offset: Matching rows to skip
+
+        Returns:
+            (matching rows, [PacketRecord])
+
+        Raises:
+            ValueError: Unknown sort column
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column: {sort}. Available: {', '.join(SORT_COLUMNS)}")
+        if sort == "packet_number" and not descending:
+            return self._scan(where, limit, offset)
+
+        wanted = offset + limit
+        total = 0
+        keys = []
+        numbers = []
+        for index, segment in enumerate(self.segments):
+            rows = where.match(self, index) if where is not None else np.arange(segment["rows"])
+            total += len(rows)
+            if not len(rows):
+                continue
+            if sort == "packet_number":
+                key = rows + segment["row_base"]
+            else:
+                key = self.column(index, sort)[rows]
+            if len(rows) > wanted:
+                # The wanted rows and everything tied with the last of them
+                if descending:
+                    kth = np.partition(key, len(key) - wanted)[len(key) - wanted]
+                    keep = np.flatnonzero(key >= kth)
+                else:
+                    kth = np.partition(key, wanted - 1)[wanted - 1]
+                    keep = np.flatnonzero(key <= kth)
+                rows = rows[keep]
+                key = key[keep]
+            keys.append(np.asarray(key, dtype=np.float64 if sort == "timestamp" else np.int64))
+            numbers.append(rows + segment["row_base"])
+        if not keys:
+            return total, []
+
+        keys = np.concatenate(keys)
+        numbers = np.concatenate(numbers)
+        order = np.lexsort((numbers, -keys if descending else keys))
+        page = numbers[order[offset:offset + limit]]
+        return total, [self.record(*self.locate(int(number))) for number in page]
+
+    def _scan(self, where, limit, offset):
+        """query() in packet order, which needs no sorting"""
+        total = 0
+        records = []
+        for index, segment in enumerate(self.segments):
+            if where is None:
+                matched = segment["rows"]
+                start = max(offset - total, 0)
+                stop = min(matched, start + limit - len(records))
+                records.extend(self.record(index, row) for row in range(start, stop))
+            else:
+                rows = where.match(self, index)
+                matched = len(rows)
+                start = max(offset - total, 0)
+                for row in rows[start:start + limit - len(records)]:
+                    records.append(self.record(index, int(row)))
+            total += matched
+        return total, records
+
+    def aggregate(self, group_by, where=None, limit=100):
+        """
+        Packets per value of a column, with the first and last timestamp of
+        each group, the largest groups first.
+
+        Args:
+            group_by: One of GROUP_COLUMNS
+            where: RecordFilter, None for every row
+            limit: Groups to return
+
+        Returns:
+            (matching rows, number of groups, [{group_by: value, "packets",
+            "first_seen", "last_seen"}])
+
+        Raises:
+            ValueError: Unknown group column
+        """
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"Unknown group column: {group_by}. Available: {', '.join(GROUP_COLUMNS)}")
+        groups = {}
+        total = 0
+        for index, segment in enumerate(self.segments):
+            rows = where.match(self, index) if where is not None else None
+            if rows is not None and not len(rows):
+                continue
+            values, inverse, counts = self._group_keys(index, group_by, rows)
+            timestamps = self.column(index, "timestamp")
+            if rows is not None:
+                timestamps = timestamps[rows]
+            total += len(timestamps)
+            order = np.argsort(inverse, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            ordered = np.asarray(timestamps)[order]
+            firsts = np.fmin.reduceat(ordered, starts)
+            lasts = np.fmax.reduceat(ordered, starts)
+            for value, count, first, last in zip(values, counts.tolist(), firsts.tolist(), lasts.tolist()):
+                group = groups.get(value)
+                if group is None:
+                    groups[value] = [count, first, last]
+                else:
+                    group[0] += count
+                    group[1] = min(group[1], first) if not math.isnan(group[1]) else first
+                    group[2] = max(group[2], last) if not math.isnan(group[2]) else last
+
+        largest = sorted(groups.items(), key=lambda item: -item[1][0])[:limit]
+        return total, len(groups), [
+            {
+                group_by: value,
+                "packets": count,
+                "first_seen": None if math.isnan(first) else first,
+                "last_seen": None if math.isnan(last) else last
+            }
+            for value, (count, first, last) in largest
+        ]
+
+    def _group_keys(self, index, group_by, rows):
+        """Distinct values of a column over some rows of a segment, as
+        (values, inverse indices, counts) with the values in JSON form"""
+        def column(name):
+            values = self.column(index, name)
+            return values[rows] if rows is not None else values
+
+        if group_by in ("src_ip", "dst_ip"):
+            side = group_by[:3]
+            keys = np.stack((
+                column("ip_version").astype(np.uint64), column(side + "_hi"), column(side + "_lo")
+            ), axis=1)
+            unique, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+            values = [
+                ip_text(version, (high << 64) | low) if version else None
+                for version, high, low in unique.tolist()
+            ]
+        else:
+            unique, inverse, counts = np.unique(column(group_by), return_inverse=True, return_counts=True)
+            if group_by == "protocol":
+                names = self.segments[index]["protocols"]
+                values = [names[code] for code in unique.tolist()]
+            else:
+                values = [_value(port) for port in unique.tolist()]
+        return values, inverse.reshape(-1), counts
+
+
+def _value(stored):
+    return None if stored == _MISSING else stored
+
+
+def _row_record(value, protocols, extra):
+    """PacketRecord of a row, given value(column name) of the row, the segment's protocol names and extra fields"""
+    record = PacketRecord()
+    record.protocol = protocols[value("protocol")]
+    ip_version = value("ip_version")
+    if ip_version:
+        record.ip_version = ip_version
+        record.src_ip = (value("src_hi") << 64) | value("src_lo")
+        record.dst_ip = (value("dst_hi") << 64) | value("dst_lo")
+    record.src_port = _value(value("src_port"))
+    record.dst_port = _value(value("dst_port"))
+    record.flags = _value(value("flags"))
+    record.seq = _value(value("seq"))
+    record.ack = _value(value("ack"))
+    if extra is not None and "flags" in extra and record.flags is None:
+        extra = dict(extra)
+        record.flags = extra.pop("flags")
+    record.extra = extra
+    timestamp = value("timestamp")
+    record.timestamp = None if math.isnan(timestamp) else timestamp
+    return record
+
+
+class StoreDirectory:
+    """Column stores under one directory, LRU-evicted by total size; max_bytes 0 disables them"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def store_path(self, key):
+        """Directory of the store of a key, see ResultCache.key()"""
+        return os.path.join(self.path, key)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.store_path(key), STORE_FILE))
+
+    def create(self):
+        """A temporary directory to build a store in"""
+        os.makedirs(self.path, exist_ok=True)
+        return tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+
+    def publish(self, tmp_path, key):
+        """
+        Move a built store into place, evicting old stores if needed; a
+        store someone else published for the key first is kept instead.
+
+        Returns:
+            Directory of the store
+        """
+        path = self.store_path(key)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self._evict(keep=path)
+        return path
+
+    def discard(self, tmp_path):
+        """Delete a store that was not finished"""
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _stores(self):
+        """(last use, bytes, directory) of every published store"""
+        stores = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_dir():
+                        continue
+                    try:
+                        used = os.stat(os.path.join(entry.path, STORE_FILE)).st_mtime
+                    except OSError:
+                        continue
+                    stores.append((used, _directory_size(entry.path), entry.path))
+        except OSError:
+            pass
+        return stores
+
+    def _evict(self, keep=None):
+        with self._lock:
+            stores = self._stores()
+            total = sum(size for _, size, _ in stores)
+            if total <= self.max_bytes:
+                return
+            stores.sort()
+            for _, size, path in stores:
+                if path == keep:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def get_stats(self):
+        """Return store count and size on disk"""
+        stores = self._stores()
+        return {
+            "enabled": self.enabled,
+            "stores": len(stores),
+            "bytes": sum(size for _, size, _ in stores),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+
+def _directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+_store_directory = None
+_store_directory_lock = threading.Lock()
+
+
+def get_store_directory():
+    """The process-wide StoreDirectory, configured from the settings"""
+    global _store_directory
+    with _store_directory_lock:
+        if _store_directory is None:
+            from ..config.settings import settings
+            _store_directory = StoreDirectory(settings.COLUMN_STORE_PATH, settings.COLUMN_STORE_MAX_BYTES)
+        return _store_directory
@@ -1,105 +1,450 @@
 # sniffer/core.py
-from .adapters.scapy_adapter import ScapySniffer
-from .protocols import tcp, dns, http, tls
+from .adapters.scapy_adapter import ScapySniffer, build_filter_expr
+from .protocols import dissect_batch, dissect_frames, registry, ParserCounters, StreamDissector
+from .filter_planner import plan_filter, session_needs, render_needs, interface_packet_count
+from .batching import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_DELAY_MS
+from .ring_buffer import RingBuffer
+from .dissect_pool import DissectionPool
+from .pcap_writer import RotatingPcapWriter, get_capture_budget
+from .overload import OverloadController, sample_mask
+from .multiplexer import capture_mux, MuxSubscription
 import threading
+import logging
 import json, time
-import queue
+
+logger = logging.getLogger("smartsniffer")
+
+DEFAULT_BUFFER_SIZE = 10000
+STOP_TIMEOUT = 3  # seconds
+CAPTURE_THREAD_PREFIX = "capture-"
+ADAPTERS = ("scapy", "afpacket")
 
 class Sniffer:
-    def __init__(self, iface="wlan0", filters=None):
+    def __init__(self, iface="wlan0", filters=None, buffer_size=DEFAULT_BUFFER_SIZE, adapter="scapy",
+                 batch_size=DEFAULT_BATCH_SIZE, batch_delay_ms=DEFAULT_BATCH_DELAY_MS, workers=0,
+                 detectors=None, save_pcap=False, pcap_dir=None, adaptive_sampling=True, shared=False,
+                 reassemble=True):
+        if adapter not in ADAPTERS:
+            raise ValueError(f"Unknown capture adapter: {adapter}")
         self.iface = iface
         self.filters = filters or []
-        self.packet_handler = self._handle_packet
-        self.results_queue = queue.Queue()
+        # Detectors consuming this capture; together with the parsers they
+        # decide which packets the kernel filter lets through
+        self.detectors = detectors or []
+        self.capture_filter = ""
+        self._iface_packets_at_start = None
+        self.adapter = adapter
+        self.batch_size = batch_size
+        self.batch_delay_ms = batch_delay_ms
+        # With workers > 0 dissection runs in a DissectionPool and the
+        # capture thread only copies raw frames
+        self.workers = workers
+        self.pool = None
+        # Shared sessions subscribe to one capture per interface instead of
+        # opening their own socket, see multiplexer.py
+        self.shared = shared
+        self.packet_handler = self._handle_batch
+        # Raw frames are recorded to rotating PCAP files under pcap_dir
+        # (settings.PCAP_SAVE_PATH by default) when save_pcap is set
+        self.save_pcap = save_pcap
+        self.pcap_dir = pcap_dir
+        self.pcap_writer = None
+        # Samples the expensive parsers by flow when dissection falls behind
+        self.adaptive_sampling = adaptive_sampling
+        self.controller = None
+        # TCP streams are reassembled for the stream parsers (HTTP); in this
+        # process, or in each pool worker
+        self.reassemble = reassemble
+        self.streams = None
+        self.buffer = RingBuffer(buffer_size)
         self.running = False
         self.thread = None
+        self.capture = None
         self.packet_count = 0
-        self.results = []
+        # Packets run through the parsers in this process (the pool counts its own)
+        self.packets_dissected = 0
+        # Cursor for callers that don't track their own position
+        self._cursor = None
+        # Last counter snapshot, used to turn totals into per-second rates
+        self._rate_snapshot = None
+        self._rates = {}
+        # Parser calls/hits of this session's in-process dissection (the
+        # registry's counters are shared by the whole process)
+        self.parser_counters = ParserCounters()
         
         
-    # Add timestamp to packet data in the _handle_packet method
+    def _handle_batch(self, packets):
+        """Parse a batch of scapy packets"""
+        if packets:
+            self._dissect(
+                packets, lambda items, keep: dissect_batch(items, keep, self.streams, counters=self.parser_counters),
+                [float(packet.time) for packet in packets],
+                lambda: [packet.original or bytes(packet) for packet in packets]
+            )
+
+    def _handle_frames(self, frames):
+        """Entry point for adapters that deliver batches of raw Ethernet frames"""
+        if frames:
+            self._dissect(
+                frames, lambda items, keep: dissect_frames(items, keep, self.streams, counters=self.parser_counters),
+                [timestamp for _, timestamp in frames],
+                lambda: [frame for frame, _ in frames]
+            )
+
+    def _dissect(self, items, dissect, timestamps, raw_frames):
+        """Dissect a batch, store the records and report the load to the controller"""
+        controller = self.controller
+        rate = controller.rate if controller else 1
+        keep = sample_mask(raw_frames(), rate) if rate > 1 else None
+
+        self.packets_dissected += len(items)
+        started = time.perf_counter()
+        records = []
+        for timestamp, record in zip(timestamps, dissect(items, keep)):
+            if record is not None:
+                # Capture time from the adapter, no clock read per packet
+                record.timestamp = timestamp
+                record.sample_rate = rate
+                records.append(record)
+        self._store_records(records)
+
+        if controller:
+            finished = time.perf_counter()
+            controller.observe(
+                len(items), finished - started,
+                lag=time.time() - timestamps[-1],
+                skipped=keep.count(False) if keep else 0
+            )
+
+    def _store_records(self, records):
+        """Append parsed records to the ring buffer; only one thread may call this"""
+        buffer = self.buffer
+        for record in records:
+            # packet_number doubles as the ring buffer sequence number
+            record.packet_number = buffer.next_seq
+            buffer.append(record)
+        self.packet_count += len(records)
+
     def _handle_packet(self, packet):
-        packet_data = {}
-    
-        # Parse protocols
-        tcp_result = tcp.parse(packet)
-        dns_result = dns.parse(packet)
-        http_result = http.parse(packet)
-        tls_result = tls.parse(packet)
-    
-        # Combine results
-        if tcp_result:
-            packet_data.update(tcp_result)
-        if dns_result:
-            packet_data.update(dns_result)
-        if http_result:
-            packet_data.update(http_result)
-        if tls_result:
-            packet_data.update(tls_result)
-        
-        if packet_data:
-            packet_data["packet_number"] = self.packet_count
-            packet_data["timestamp"] = time.time()  # Add timestamp
-            self.results_queue.put(packet_data)
-            self.results.append(packet_data)
-            self.packet_count += 1
-
-    # Add this to the Sniffer class in sniffer/core.py
-    def get_results(self, limit=100, clear=False, since_timestamp=None):
-        """Return the most recent results up to limit"""
-        # If timestamp is provided, filter results by timestamp
-        if since_timestamp is not None:
-            filtered_results = [r for r in self.results if r.get("timestamp", 0) > since_timestamp]
-            results = filtered_results[:limit]
+        self._handle_batch([packet])
+
+    def _record_frames(self, frames):
+        """Record a batch of raw frames to PCAP, then pass them on for dissection"""
+        # Copy once; ring-backed frames are only valid during this call
+        frames = [(bytes(frame), timestamp) for frame, timestamp in frames]
+        self.pcap_writer.write_batch(frames)
+        if self.pool:
+            self.pool.submit(frames)
         else:
-            # Original implementation
-            results = []
-            try:
-                while len(results) < limit and not self.results_queue.empty():
-                    results.append(self.results_queue.get_nowait())
-            except queue.Empty:
-                pass
-            
-        if clear:
-            self.results = self.results[len(results):]
-            
-        return results
+            self._handle_frames(frames)
+
+    def _create_capture(self):
+        """Build the capture adapter selected for this sniffer"""
+        # Every adapter delivers raw frames; the fast-path decoder reads them
+        if self.pcap_writer:
+            frame_handler = self._record_frames
+        else:
+            frame_handler = self.pool.submit if self.pool else self._handle_frames
+        parsers = registry.names()
+
+        if self.shared:
+            needs = session_needs(parsers, self.detectors, self.filters)
+            if needs is not None:
+                # The kernel filter belongs to the shared capture; this
+                # session's filter is applied in userspace
+                self.capture_filter = render_needs(needs)
+                return capture_mux.subscription(
+                    self.adapter, self.iface, needs, frame_handler,
+                    lambda callback, expression: self._build_adapter(
+                        callback, expression, reuse_socket=False
+                    )
+                )
+            logger.info(f"Filters {self.filters} can't be applied in userspace, opening a dedicated capture")
+
+        self.capture_filter = plan_filter(
+            parsers=parsers,
+            detectors=self.detectors,
+            user_filter=build_filter_expr(self.filters),
+            iface=self.iface
+        )
+        return self._build_adapter(frame_handler, self.capture_filter)
+
+    def _build_adapter(self, callback, filter_expr, reuse_socket=True):
+        """Instantiate a capture adapter delivering batches of raw frames"""
+        if self.adapter == "afpacket":
+            from .adapters.afpacket_adapter import AFPacketSniffer
+            from ..config.settings import settings
+            return AFPacketSniffer(
+                self.iface, self.filters, callback,
+                block_size=settings.CAPTURE_RING_BLOCK_SIZE,
+                block_count=settings.CAPTURE_RING_BLOCK_COUNT,
+                frame_size=settings.CAPTURE_RING_FRAME_SIZE,
+                block_timeout_ms=settings.CAPTURE_RING_BLOCK_TIMEOUT_MS,
+                batch_size=self.batch_size,
+                filter_expr=filter_expr,
+                reuse_socket=reuse_socket
+            )
+        return ScapySniffer(
+            self.iface, self.filters, callback,
+            batch_size=self.batch_size, batch_delay_ms=self.batch_delay_ms, raw=True,
+            filter_expr=filter_expr,
+            reuse_socket=reuse_socket
+        )
+
+    def get_results(self, limit=100, after_seq=None):
+        """
+        Return up to limit results newer than after_seq.
+
+        Without after_seq the sniffer's own cursor is used, so repeated calls
+        behave like draining a queue.
+
+        Returns:
+            Tuple of (results, cursor, missed); results are PacketRecords
+            (to_dict() gives the JSON form), pass cursor back as after_seq to
+            resume, missed counts records evicted before they were read
+        """
+        use_own_cursor = after_seq is None
+        if use_own_cursor:
+            after_seq = self._cursor
+
+        records, cursor, missed = self.buffer.read(after_seq=after_seq, limit=limit)
+
+        if use_own_cursor:
+            self._cursor = cursor
+
+        return [record for _, record in records], cursor, missed
             
     def start(self):
         """Start sniffing in a separate thread"""
         if self.running:
             return False
             
+        if self.adaptive_sampling:
+            self.controller = OverloadController()
+        reassembly = self._reassembly_budgets() if self.reassemble else None
+        self.parser_counters = ParserCounters()
+        self.streams = None
+        if self.workers:
+            self.pool = DissectionPool(
+                self.workers, self._store_records, controller=self.controller, reassembly=reassembly
+            )
+        elif reassembly is not None:
+            self.streams = StreamDissector(self.parser_counters, **reassembly)
+        if self.save_pcap and self.pcap_writer is None:
+            # Kept across restarts so the disk budget covers the whole session
+            self.pcap_writer = self._create_pcap_writer()
+        sniffer = self._create_capture()
+        if hasattr(sniffer, "open"):
+            # Surface socket/permission errors to the caller, not the thread
+            sniffer.open()
+
         self.running = True
         self.packet_count = 0
-        self.results = []
-        
-        # Clear queue
-        while not self.results_queue.empty():
-            self.results_queue.get_nowait()
+        self.packets_dissected = 0
+        self._rate_snapshot = None
+        self._rates = {}
+        self.buffer.clear()
+        self._cursor = None
+        self.capture = sniffer
+        self._iface_packets_at_start = interface_packet_count(self.iface)
+        if self.pool:
+            self.pool.start()
+        if self.pcap_writer:
+            self.pcap_writer.start()
             
-        sniffer = ScapySniffer(self.iface, self.filters, self.packet_handler)
-        self.thread = threading.Thread(target=sniffer.start)
-        self.thread.daemon = True
+        if isinstance(sniffer, MuxSubscription):
+            # The shared capture already runs its own thread
+            self.thread = None
+            sniffer.start()
+            return True
+
+        self.thread = threading.Thread(
+            target=sniffer.start,
+            name=f"{CAPTURE_THREAD_PREFIX}{self.adapter}-{self.iface}",
+            daemon=True
+        )
         self.thread.start()
         return True
         
-    def stop(self):
-        """Stop the sniffer thread"""
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop capturing and tear the session down.
+
+        Signals the capture loop, joins its thread, shuts the dissection pool
+        down and hands the socket back to the cache. Returns False if the
+        sniffer was not running.
+        """
         if not self.running:
             return False
             
         self.running = False
-        # Note: Scapy's sniff doesn't have a clean way to stop
-        # We'll need to implement a stopping mechanism in ScapySniffer
+        if self.capture:
+            self.capture.stop(timeout)
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning(f"Capture thread {self.thread.name} did not stop within {timeout}s")
+        if self.pool:
+            self.pool.stop()
+        if self.pcap_writer:
+            self.pcap_writer.stop()
         return True
+
+    def _reassembly_budgets(self):
+        """StreamDissector keyword arguments from the settings"""
+        from ..config.settings import settings
+        return {
+            "memory_budget": settings.REASSEMBLY_MEMORY_BUDGET,
+            "flow_budget": settings.REASSEMBLY_FLOW_BUDGET,
+            "idle_timeout": settings.REASSEMBLY_IDLE_TIMEOUT
+        }
+
+    def get_stream_stats(self):
+        """TCP reassembly memory use and evictions, None when not reassembling"""
+        if self.pool:
+            return self.pool.get_stream_stats()
+        return self.streams.get_stats() if self.streams else None
+
+    def get_parser_stats(self):
+        """Calls and hits per parser for this session"""
+        if self.pool:
+            return self.pool.get_parser_stats()
+        return self.parser_counters.get_stats(registry.entries)
+
+    def _create_pcap_writer(self):
+        """Build the rotating PCAP writer for this session"""
+        from ..config.settings import settings
+        return RotatingPcapWriter(
+            self.pcap_dir or settings.PCAP_SAVE_PATH,
+            prefix=self.iface,
+            rotate_bytes=settings.PCAP_ROTATE_BYTES,
+            rotate_seconds=settings.PCAP_ROTATE_SECONDS,
+            max_total_bytes=settings.PCAP_MAX_TOTAL_BYTES,
+            # Shared by every session recording under PCAP_SAVE_PATH
+            budget=get_capture_budget()
+        )
+
+    def get_pcap_files(self):
+        """List the PCAP files recorded by this session, oldest first"""
+        return self.pcap_writer.list_files() if self.pcap_writer else []
         
     def get_stats(self):
         """Return statistics about the sniffing session"""
+        buffer_stats = self.buffer.get_stats()
+        counters = self.get_counters()
         return {
             "packet_count": self.packet_count,
             "running": self.running,
             "interface": self.iface,
-            "filters": self.filters
+            "filters": self.filters,
+            "buffer_capacity": buffer_stats["capacity"],
+            "buffer_size": buffer_stats["size"],
+            "first_seq": buffer_stats["first_seq"],
+            "last_seq": buffer_stats["last_seq"],
+            "evicted_count": buffer_stats["evicted"],
+            "dropped_count": buffer_stats["evicted_unread"],
+            "workers": self.pool.get_stats() if self.pool else None,
+            "capture_filter": self.capture_filter,
+            "filter_selectivity": self.get_filter_selectivity(),
+            "pcap": self.pcap_writer.get_stats() if self.pcap_writer else None,
+            "sample_rate": self.controller.rate if self.controller else 1,
+            "sampling": self.controller.get_stats() if self.controller else None,
+            "reassembly": self.get_stream_stats(),
+            "parsers": self.get_parser_stats(),
+            "counters": counters,
+            "rates": self._update_rates(counters)
         }
 
+    def get_counters(self):
+        """
+        Where every packet of the session went.
+
+        - received: packets the kernel filter let through to the sniffer
+        - kernel_dropped: packets that passed the filter but were dropped by
+          the kernel because the sniffer did not keep up (None if unknown)
+        - filtered: interface packets the kernel filter rejected (None if unknown)
+        - parsed / unparsed: dissected packets with / without a result record
+        - queue_overflow: packets dropped because the worker queue was full
+        - detector_lagged: results evicted before a consumer read them
+
+        All counters have a single writer, so none of them takes a lock.
+        """
+        capture = self.capture
+        received = getattr(capture, "packets_received", 0) if capture else 0
+
+        kernel = None
+        if capture is not None and hasattr(capture, "get_kernel_stats"):
+            kernel = capture.get_kernel_stats()
+        kernel_dropped = kernel["drops"] if kernel else None
+
+        filtered = None
+        now = interface_packet_count(self.iface)
+        if now is not None and self._iface_packets_at_start is not None:
+            filtered = max(0, now - self._iface_packets_at_start - received - (kernel_dropped or 0))
+
+        dissected = self.pool.processed if self.pool else self.packets_dissected
+        return {
+            "received": received,
+            "kernel_dropped": kernel_dropped,
+            "filtered": filtered,
+            "parsed": self.packet_count,
+            "unparsed": max(0, dissected - self.packet_count),
+            "queue_overflow": self.pool.dropped if self.pool else 0,
+            "detector_lagged": self.buffer.evicted_unread
+        }
+
+    def _update_rates(self, counters, min_interval=1.0):
+        """
+        Per-second rates of the counters since the previous snapshot.
+
+        The snapshot only moves once at least min_interval seconds have passed,
+        so frequent status polls still see rates over a useful window.
+        """
+        now = time.time()
+        snapshot = self._rate_snapshot
+        if snapshot is None:
+            self._rate_snapshot = (now, counters)
+            return self._rates
+
+        then, previous = snapshot
+        elapsed = now - then
+        if elapsed >= min_interval:
+            self._rates = {
+                name: round((value - previous[name]) / elapsed, 2)
+                if value is not None and previous[name] is not None else None
+                for name, value in counters.items()
+            }
+            self._rate_snapshot = (now, counters)
+        return self._rates
+
+    def get_filter_selectivity(self):
+        """
+        Compare what the kernel filter passed with what the interface saw.
+
+        selectivity is the fraction of interface packets that reached
+        userspace; the rest never cost any parsing work.
+        """
+        passed = getattr(self.capture, "packets_received", 0) if self.capture else 0
+        seen = None
+        now = interface_packet_count(self.iface)
+        if now is not None and self._iface_packets_at_start is not None:
+            seen = now - self._iface_packets_at_start
+        return {
+            "kernel_passed": passed,
+            "interface_packets": seen,
+            "selectivity": round(passed / seen, 4) if seen else None
+        }
+
+
+def list_capture_threads():
+    """Describe every live capture thread in this process"""
+    return [
+        {
+            "name": thread.name,
+            "ident": thread.ident,
+            "alive": thread.is_alive(),
+            "daemon": thread.daemon
+        }
+        for thread in threading.enumerate()
+        if thread.name.startswith(CAPTURE_THREAD_PREFIX)
+    ]
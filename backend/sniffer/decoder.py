@@ -0,0 +1,197 @@
+# sniffer/decoder.py
+"""
+Fast-path L2-L4 decoder.
+
+Reads the Ethernet, VLAN, IPv4/IPv6 and TCP/UDP/ICMP headers of a raw frame
+with `struct` in a single pass, without building scapy objects. Parsers look
+at the decoded headers first and only ask for a full scapy dissection (by
+returning NEEDS_DISSECTION) for the few packets they need to look deeper into.
+"""
+import socket
+import struct
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86DD
+VLAN_TYPES = (0x8100, 0x88A8)
+
+PROTO_ICMP = 1
+PROTO_TCP = 6
+PROTO_UDP = 17
+PROTO_ICMPV6 = 58
+
+# IPv6 extension headers walked to reach the transport header
+IPV6_EXT_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+
+ETH_TYPE = struct.Struct("!H")
+IPV4_HEADER = struct.Struct("!BxH2xHBB2x4s4s")
+IPV6_HEADER = struct.Struct("!4xHBB16s16s")
+TCP_HEADER = struct.Struct("!HHIIBB")
+UDP_HEADER = struct.Struct("!HH")
+ICMP_HEADER = struct.Struct("!BB")
+
+# Same letters and order as scapy's str(TCP.flags)
+TCP_FLAG_NAMES = "FSRPAUECN"
+TCP_FLAG_STRINGS = tuple(
+    "".join(name for bit, name in enumerate(TCP_FLAG_NAMES) if value & (1 << bit))
+    for value in range(1 << len(TCP_FLAG_NAMES))
+)
+
+# Returned by a parser's parse_decoded() when it needs the scapy packet
+NEEDS_DISSECTION = object()
+
+
+class Decoded:
+    """Header fields of one frame; fields of absent layers are None"""
+
+    __slots__ = (
+        "frame", "eth_type", "vlan", "ip_version", "src", "dst", "proto", "ttl",
+        "sport", "dport", "tcp_flags", "seq", "ack", "icmp_type", "icmp_code",
+        "payload_offset", "payload_end", "ip_end"
+    )
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.eth_type = None
+        self.vlan = None
+        self.ip_version = None
+        self.src = None
+        self.dst = None
+        self.proto = None
+        self.ttl = None
+        self.sport = None
+        self.dport = None
+        self.tcp_flags = None
+        self.seq = None
+        self.ack = None
+        self.icmp_type = None
+        self.icmp_code = None
+        self.payload_offset = None
+        self.payload_end = None
+        # End of the IP packet as sent, which may lie past a truncated capture
+        self.ip_end = None
+
+    @property
+    def payload(self):
+        """Transport payload as a memoryview, empty if there is none"""
+        if self.payload_offset is None:
+            return memoryview(b"")
+        return memoryview(self.frame)[self.payload_offset:self.payload_end]
+
+    @property
+    def truncated(self):
+        """Payload bytes that were sent but not captured (snap length, ring slot size)"""
+        if self.ip_end is None or self.payload_end is None:
+            return 0
+        return max(0, self.ip_end - self.payload_end)
+
+    @property
+    def flags(self):
+        """TCP flags in scapy notation, e.g. "SA" """
+        return TCP_FLAG_STRINGS[self.tcp_flags] if self.tcp_flags is not None else None
+
+    @property
+    def src_ip(self):
+        return _ntop(self.ip_version, self.src)
+
+    @property
+    def dst_ip(self):
+        return _ntop(self.ip_version, self.dst)
+
+
+def _ntop(version, address):
+    if address is None:
+        return None
+    return socket.inet_ntop(socket.AF_INET if version == 4 else socket.AF_INET6, address)
+
+
+def decode(frame):
+    """
+    Decode the L2-L4 headers of a raw Ethernet frame.
+
+    Truncated or unknown headers simply stop the decode; the fields decoded
+    so far are kept.
+    """
+    d = Decoded(frame)
+    size = len(frame)
+    if size < 14:
+        return d
+
+    eth_type = ETH_TYPE.unpack_from(frame, 12)[0]
+    off = 14
+    while eth_type in VLAN_TYPES and size >= off + 4:
+        if d.vlan is None:
+            d.vlan = ETH_TYPE.unpack_from(frame, off)[0] & 0x0FFF
+        eth_type = ETH_TYPE.unpack_from(frame, off + 2)[0]
+        off += 4
+    d.eth_type = eth_type
+
+    if eth_type == ETH_P_IP:
+        if size < off + 20:
+            return d
+        ver_ihl, total_len, frag, ttl, proto, src, dst = IPV4_HEADER.unpack_from(frame, off)
+        d.ip_version = 4
+        d.ttl = ttl
+        d.proto = proto
+        d.src = src
+        d.dst = dst
+        # Ethernet padding after the IP packet is not payload; a zero
+        # length (segmentation offload) means "up to the end of the frame"
+        end = min(size, off + total_len) if total_len else size
+        if total_len:
+            d.ip_end = off + total_len
+        if frag & 0x1FFF:
+            # Not the first fragment, no transport header here
+            return d
+        off += (ver_ihl & 0x0F) * 4
+    elif eth_type == ETH_P_IPV6:
+        if size < off + 40:
+            return d
+        payload_len, proto, hlim, src, dst = IPV6_HEADER.unpack_from(frame, off)
+        d.ip_version = 6
+        d.ttl = hlim
+        d.src = src
+        d.dst = dst
+        off += 40
+        end = min(size, off + payload_len) if payload_len else size
+        if payload_len:
+            d.ip_end = off + payload_len
+        while proto in IPV6_EXT_HEADERS and size >= off + 2:
+            proto, length = frame[off], frame[off + 1]
+            off += (length + 1) * 8
+        if proto == IPV6_FRAGMENT and size >= off + 8:
+            offset = ETH_TYPE.unpack_from(frame, off + 2)[0] >> 3
+            proto = frame[off]
+            off += 8
+            if offset:
+                d.proto = proto
+                return d
+        d.proto = proto
+    else:
+        return d
+
+    proto = d.proto
+    size = end
+    d.payload_end = end
+    if proto == PROTO_TCP:
+        if size < off + 14:
+            return d
+        sport, dport, seq, ack, data_off, flags = TCP_HEADER.unpack_from(frame, off)
+        d.sport = sport
+        d.dport = dport
+        d.seq = seq
+        d.ack = ack
+        d.tcp_flags = ((data_off & 0x01) << 8) | flags
+        d.payload_offset = min(off + (data_off >> 4) * 4, size)
+    elif proto == PROTO_UDP:
+        if size < off + 8:
+            return d
+        d.sport, d.dport = UDP_HEADER.unpack_from(frame, off)
+        d.payload_offset = off + 8
+    elif proto in (PROTO_ICMP, PROTO_ICMPV6):
+        if size < off + 4:
+            return d
+        d.icmp_type, d.icmp_code = ICMP_HEADER.unpack_from(frame, off)
+        d.payload_offset = off + 8 if size >= off + 8 else size
+    return d
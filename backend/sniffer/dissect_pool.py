@@ -0,0 +1,307 @@
+# sniffer/dissect_pool.py
+"""
+Multi-process packet dissection for the live Sniffer.
+
+The capture thread only copies raw frames into a shared-memory ring owned by
+one of the worker processes and posts a small (start, count) message for each
+batch. Workers dissect the frames and send back compact result records, which
+a collector thread in the parent hands to the Sniffer.
+
+Frames are pinned to a worker by a direction-independent hash of their
+5-tuple, so all packets of a flow are dissected by the same worker in
+capture order.
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import struct
+import threading
+import time
+import zlib
+
+DEFAULT_SLOT_SIZE = 2048
+DEFAULT_SLOT_COUNT = 8192
+
+# Captured length and capture timestamp stored in front of every frame
+SLOT_HEADER = struct.Struct("Id")
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_TYPES = (0x8100, 0x88A8)
+
+
+def flow_hash(frame) -> int:
+    """
+    Hash the 5-tuple of a raw Ethernet frame.
+
+    Both directions of a flow hash the same. IPv4 fragments are hashed on
+    addresses only so every fragment lands with the first one; non-IP frames
+    hash on their EtherType.
+    """
+    size = len(frame)
+    if size < 14:
+        return 0
+
+    eth_type = (frame[12] << 8) | frame[13]
+    off = 14
+    while eth_type in VLAN_TYPES and size >= off + 4:
+        eth_type = (frame[off + 2] << 8) | frame[off + 3]
+        off += 4
+
+    fragmented = False
+    if eth_type == ETH_P_IP:
+        if size < off + 20:
+            return eth_type
+        proto = frame[off + 9]
+        src = bytes(frame[off + 12:off + 16])
+        dst = bytes(frame[off + 16:off + 20])
+        fragmented = ((frame[off + 6] << 8) | frame[off + 7]) & 0x3FFF != 0
+        l4 = off + (frame[off] & 0x0F) * 4
+    elif eth_type == ETH_P_IPV6:
+        if size < off + 40:
+            return eth_type
+        proto = frame[off + 6]
+        src = bytes(frame[off + 8:off + 24])
+        dst = bytes(frame[off + 24:off + 40])
+        l4 = off + 40
+    else:
+        return eth_type
+
+    sport = dport = b"\x00\x00"
+    if proto in (6, 17) and not fragmented and size >= l4 + 4:
+        sport = bytes(frame[l4:l4 + 2])
+        dport = bytes(frame[l4 + 2:l4 + 4])
+
+    a = src + sport
+    b = dst + dport
+    if a > b:
+        a, b = b, a
+    return zlib.crc32(b, zlib.crc32(a)) ^ proto
+
+
+def _worker_main(worker_id, shm_name, slot_size, slot_count, inbox, outbox, reassembly, plugins):
+    """Dissect frames from this worker's ring until told to stop"""
+    from .protocols import dissect_frames, ParserCounters, StreamDissector, registry
+    from .overload import sample_mask
+
+    # Spawned workers only know the built-in parsers until told otherwise
+    registry.load_plugins(plugins)
+
+    counters = ParserCounters()
+    # Flows are pinned to workers, so each worker reassembles its own
+    streams = StreamDissector(counters, **reassembly) if reassembly is not None else None
+
+    # Spawned children share the parent's resource tracker, so attaching
+    # here does not hand ownership of the segment to this process
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buf = shm.buf
+    header_size = SLOT_HEADER.size
+
+    try:
+        while True:
+            msg = inbox.get()
+            if msg is None:
+                break
+            start, count, rate = msg
+            started = time.perf_counter()
+
+            frames = []
+            for i in range(start, start + count):
+                off = (i % slot_count) * slot_size
+                length, timestamp = SLOT_HEADER.unpack_from(buf, off)
+                data_off = off + header_size
+                frames.append((bytes(buf[data_off:data_off + length]), timestamp))
+
+            keep = sample_mask([frame for frame, _ in frames], rate)
+            records = []
+            for (_, timestamp), record in zip(frames, dissect_frames(frames, keep, streams, counters=counters)):
+                if record is not None:
+                    record.timestamp = timestamp
+                    record.sample_rate = rate
+                    records.append(record)
+
+            skipped = keep.count(False) if keep else 0
+            stream_stats = streams.get_stats() if streams else None
+            outbox.put((
+                worker_id, count, records, time.perf_counter() - started, skipped,
+                stream_stats, counters.get_stats(registry.entries)
+            ))
+    finally:
+        del buf
+        shm.close()
+
+
+class DissectionPool:
+    def __init__(self, workers, on_records, slot_size=DEFAULT_SLOT_SIZE, slot_count=DEFAULT_SLOT_COUNT,
+                 controller=None, reassembly=None):
+        """
+        Initialize the dissection pool.
+
+        Args:
+            workers: Number of worker processes
+            on_records: Called from the collector thread with each list of result records
+            slot_size: Bytes per ring slot; longer frames are truncated
+            slot_count: Slots in each worker's ring
+            controller: Optional OverloadController; its sampling rate is sent
+                with every batch and it is fed worker timings and ring fill
+            reassembly: Optional StreamDissector keyword arguments; when set
+                every worker reassembles the TCP streams of its flows
+        """
+        if workers < 1:
+            raise ValueError("Dissection pool needs at least one worker")
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError(f"Slot size must be larger than {SLOT_HEADER.size} bytes")
+
+        self.workers = workers
+        self.on_records = on_records
+        self.slot_size = slot_size
+        self.slot_count = slot_count
+        self.controller = controller
+        self.reassembly = reassembly
+        self.running = False
+
+        self._ctx = mp.get_context("spawn")
+        self._shms = []
+        self._inboxes = []
+        self._outbox = None
+        self._processes = []
+        self._collector = None
+
+        # Written by the capture thread only
+        self._head = [0] * workers
+        self.submitted = 0
+        self.dropped = 0
+        # Written by the collector thread only
+        self._tail = [0] * workers
+        self.processed = 0
+        self._stream_stats = [None] * workers
+        self._parser_stats = [{}] * workers
+
+    def start(self):
+        """Allocate the rings and start the workers and collector thread"""
+        if self.running:
+            return
+
+        from .protocols import registry, BUILTIN_PARSERS
+        plugins = registry.plugins(BUILTIN_PARSERS)
+
+        self._outbox = self._ctx.Queue()
+        for worker_id in range(self.workers):
+            shm = shared_memory.SharedMemory(create=True, size=self.slot_size * self.slot_count)
+            inbox = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_id, shm.name, self.slot_size, self.slot_count, inbox, self._outbox,
+                      self.reassembly, plugins),
+                daemon=True
+            )
+            process.start()
+            self._shms.append(shm)
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        self.running = True
+
+    def submit(self, frames):
+        """
+        Copy a batch of (frame, timestamp) tuples into the worker rings.
+
+        Frames for a worker whose ring is full are dropped and counted.
+        """
+        if not self.running:
+            return
+
+        workers = self.workers
+        slot_size = self.slot_size
+        slot_count = self.slot_count
+        max_len = slot_size - SLOT_HEADER.size
+        head = self._head
+        tail = self._tail
+        starts = list(head)
+        rate = self.controller.rate if self.controller else 1
+
+        for frame, timestamp in frames:
+            w = flow_hash(frame) % workers
+            if head[w] - tail[w] >= slot_count:
+                self.dropped += 1
+                continue
+            off = (head[w] % slot_count) * slot_size
+            length = min(len(frame), max_len)
+            buf = self._shms[w].buf
+            SLOT_HEADER.pack_into(buf, off, length, timestamp)
+            data_off = off + SLOT_HEADER.size
+            buf[data_off:data_off + length] = frame[:length]
+            head[w] += 1
+
+        for w in range(workers):
+            count = head[w] - starts[w]
+            if count:
+                self.submitted += count
+                self._inboxes[w].put((starts[w], count, rate))
+
+    def _collect(self):
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                break
+            worker_id, count, records, elapsed, skipped, stream_stats, parser_stats = item
+            self._tail[worker_id] += count
+            self._stream_stats[worker_id] = stream_stats
+            self._parser_stats[worker_id] = parser_stats
+            self.processed += count
+            if self.controller:
+                backlog = (self._head[worker_id] - self._tail[worker_id]) / self.slot_count
+                self.controller.observe(count, elapsed, backlog=backlog, skipped=skipped)
+            if records:
+                self.on_records(records)
+
+    def stop(self, timeout=5):
+        """Stop the workers, drain their results and release the rings"""
+        if not self.running:
+            return
+        self.running = False
+
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+        self._outbox.put(None)
+        self._collector.join(timeout)
+
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        for inbox in self._inboxes:
+            inbox.close()
+        self._outbox.close()
+
+        self._shms = []
+        self._inboxes = []
+        self._processes = []
+        self._outbox = None
+        self._collector = None
+
+    def get_stats(self):
+        """Return pool throughput and backlog counters"""
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "backlog": [self._head[w] - self._tail[w] for w in range(self.workers)]
+        }
+
+    def get_stream_stats(self):
+        """Reassembly stats added up over the workers, None without reassembly"""
+        from .protocols import merge_stream_stats
+        return merge_stream_stats(stats for stats in self._stream_stats if stats)
+
+    def get_parser_stats(self):
+        """Parser calls and hits added up over the workers"""
+        from .protocols import merge_parser_stats
+        return merge_parser_stats(self._parser_stats)
@@ -0,0 +1,257 @@
+# sniffer/filter_planner.py
+"""
+Builds the kernel BPF filter for a capture from what its consumers need.
+
+Every parser and detector declares the traffic it looks at: parsers through
+the transport, ports and signatures they register with the protocol
+registry, detectors in DETECTOR_NEEDS below. The planner merges those needs, drops the ones another need already covers, and renders
+the smallest BPF expression that still lets every needed packet through.
+"""
+from collections import namedtuple
+import logging
+
+from .decoder import PROTO_ICMP, PROTO_TCP, PROTO_UDP
+
+logger = logging.getLogger("smartsniffer")
+
+# proto: "tcp", "udp", "arp", "icmp" or None for any IP protocol
+# port: only packets to/from this port, None for any port
+# syn: TCP packets with the SYN flag only
+Need = namedtuple("Need", ["proto", "port", "syn"], defaults=[None, None, False])
+
+# Need(None) means "every packet"
+ALL_TRAFFIC = Need(None)
+
+# Parser transports (IP protocol numbers) BPF can name
+TRANSPORT_NAMES = {PROTO_TCP: "tcp", PROTO_UDP: "udp", PROTO_ICMP: "icmp"}
+
+DETECTOR_NEEDS = {
+    "syn_flood": [Need("tcp", syn=True)],
+    "port_scan": [Need("tcp")],
+    "dns_tunneling": [Need(None, 53)],
+    "arp_spoof": [Need("arp")],
+    "tor": [Need("tcp", 9001)],
+    # Payload signature and volume based detectors see everything
+    "metasploit": [ALL_TRAFFIC],
+    "cobalt_strike": [ALL_TRAFFIC],
+    "bandwidth": [ALL_TRAFFIC],
+    "connection_rate": [ALL_TRAFFIC],
+    "timing": [ALL_TRAFFIC],
+}
+
+# Session filter names (see scapy_adapter.BPF_MAP) the multiplexer can
+# evaluate in userspace
+USER_FILTER_NEEDS = {
+    "tcp": [Need("tcp")],
+    "udp": [Need("udp")],
+    "icmp": [Need("icmp")],
+    "dns": [Need(None, 53)],
+    "http": [Need(None, 80)],
+    "https": [Need(None, 443)],
+    "tls": [Need(None, 443)],
+    "arp": [Need("arp")],
+}
+
+
+def _covers(a, b):
+    """True if every packet matching need b also matches need a"""
+    if a == b:
+        return False
+    if a == ALL_TRAFFIC:
+        return True
+    if a.proto is None and a.port is None:
+        return False
+    if a.proto is not None and a.proto != b.proto:
+        return False
+    if a.port is not None and a.port != b.port:
+        return False
+    if a.syn and not b.syn:
+        return False
+    # A port-only need covers the TCP and UDP needs on that port
+    if a.proto is None and b.proto not in ("tcp", "udp"):
+        return False
+    return True
+
+
+def _render(need):
+    if need.proto in ("arp", "icmp"):
+        return need.proto
+    parts = []
+    if need.proto:
+        parts.append(f"{need.proto} port {need.port}" if need.port is not None else need.proto)
+    elif need.port is not None:
+        parts.append(f"port {need.port}")
+    if need.syn:
+        parts.append("tcp[tcpflags] & tcp-syn != 0")
+    return " and ".join(parts)
+
+
+def minimize(needs):
+    """Drop duplicate needs and needs covered by another one"""
+    unique = list(dict.fromkeys(needs))
+    return [n for n in unique if not any(_covers(other, n) for other in unique)]
+
+
+def intersect(a, b):
+    """The need matching packets that match both a and b, None if there are none"""
+    if a == ALL_TRAFFIC:
+        return b
+    if b == ALL_TRAFFIC:
+        return a
+    if a.proto and b.proto and a.proto != b.proto:
+        return None
+    if a.port is not None and b.port is not None and a.port != b.port:
+        return None
+    proto = a.proto or b.proto
+    port = a.port if a.port is not None else b.port
+    syn = a.syn or b.syn
+    if proto in ("arp", "icmp") and (port is not None or syn):
+        return None
+    if syn and proto is None:
+        proto = "tcp"
+    return Need(proto, port, syn)
+
+
+def render_needs(needs):
+    """BPF expression for a list of needs, "" when they cover all traffic"""
+    needs = minimize(needs)
+    if not needs or ALL_TRAFFIC in needs:
+        return ""
+    rendered = [_render(n) for n in needs]
+    return " or ".join(f"({r})" if " and " in r else r for r in rendered)
+
+
+def parser_needs(entry):
+    """
+    Needs of a registered parser, from its declarations.
+
+    A parser sees all of its transport when it takes every port or can
+    recognise its protocol by signature on any port; otherwise only its
+    ports. A transport BPF can't name needs all traffic.
+    """
+    protos = []
+    for transport in entry.transports:
+        proto = TRANSPORT_NAMES.get(transport)
+        if proto is None:
+            return [ALL_TRAFFIC]
+        protos.append(proto)
+    if entry.ports is None or entry.signatures or "icmp" in protos:
+        return [Need(proto) for proto in protos]
+    if "tcp" in protos and "udp" in protos:
+        # Shorter as "port N", which matches both
+        return [Need(None, port) for port in sorted(entry.ports)]
+    return [Need(proto, port) for proto in protos for port in sorted(entry.ports)]
+
+
+def plan_needs(parsers=(), detectors=()):
+    """Minimal list of needs covering the active parsers and detectors"""
+    from .protocols import registry
+    needs = []
+    for name in parsers:
+        entry = registry.get(name)
+        needs.extend(parser_needs(entry) if entry is not None else [ALL_TRAFFIC])
+    for name in detectors:
+        needs.extend(DETECTOR_NEEDS.get(name, [ALL_TRAFFIC]))
+    return minimize(needs) or [ALL_TRAFFIC]
+
+
+def session_needs(parsers=(), detectors=(), filters=()):
+    """
+    Needs of one capture session: its user filters ANDed with the plan.
+
+    Returns None when a user filter is a raw BPF snippet that cannot be
+    expressed as needs (and so cannot be evaluated in userspace).
+    """
+    user = []
+    for name in filters:
+        if name not in USER_FILTER_NEEDS:
+            return None
+        user.extend(USER_FILTER_NEEDS[name])
+    planned = plan_needs(parsers, detectors)
+    if not user:
+        return planned
+    combined = [intersect(u, p) for u in user for p in planned]
+    return minimize([n for n in combined if n is not None])
+
+
+def matches(needs, key):
+    """
+    True if a packet summarised as key matches any of the needs.
+
+    key is (proto, sport, dport, syn) with proto one of "tcp", "udp",
+    "icmp", "arp" or None, as built by multiplexer.frame_key.
+    """
+    proto, sport, dport, syn = key
+    for need in needs:
+        if need == ALL_TRAFFIC:
+            return True
+        if need.proto in ("arp", "icmp"):
+            if proto == need.proto:
+                return True
+            continue
+        if need.proto is not None and need.proto != proto:
+            continue
+        if need.proto is None and proto not in ("tcp", "udp"):
+            continue
+        if need.port is not None and need.port != sport and need.port != dport:
+            continue
+        if need.syn and not syn:
+            continue
+        return True
+    return False
+
+
+def can_compile(expression, iface=None):
+    """True if scapy can compile the BPF expression on this host"""
+    try:
+        from scapy.arch.common import compile_filter
+        compile_filter(expression, iface)
+        return True
+    except Exception:
+        return False
+
+
+def plan_filter(parsers=(), detectors=(), user_filter="", iface=None):
+    """
+    Build the capture filter for a set of active parsers and detectors.
+
+    The planned part is dropped (with a warning) when the host cannot compile
+    BPF filters, so capture still works, just without kernel-side savings.
+
+    Args:
+        parsers: Names of active protocol parsers, see parser_needs()
+        detectors: Names of active detectors, see DETECTOR_NEEDS
+        user_filter: BPF expression the user asked for, ANDed with the plan
+        iface: Interface the filter will be compiled for
+
+    Returns:
+        BPF expression, "" when all traffic is needed and no user filter is set
+    """
+    planned = render_needs(plan_needs(parsers, detectors))
+
+    if planned and not can_compile(planned, iface):
+        logger.warning(f"Cannot compile BPF filters on this host, capturing without the planned filter: {planned}")
+        planned = ""
+
+    if user_filter and planned:
+        expression = f"({user_filter}) and ({planned})"
+    else:
+        expression = user_filter or planned
+
+    logger.info(
+        f"Capture filter planned for parsers={list(parsers)} detectors={list(detectors)}: "
+        f"{expression or '<none>'}"
+    )
+    return expression
+
+
+def interface_packet_count(iface):
+    """Packets the interface has sent and received so far, None if unknown"""
+    try:
+        from psutil import net_io_counters
+        counters = net_io_counters(pernic=True).get(iface)
+    except Exception:
+        return None
+    if counters is None:
+        return None
+    return counters.packets_recv + counters.packets_sent
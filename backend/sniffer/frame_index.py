@@ -0,0 +1,209 @@
+# sniffer/frame_index.py
+"""
+Sidecar index of the frames of a capture file.
+
+Built during the analysis pass from what the reader hands out anyway. Every
+frame, in file order, gets the file offset and length of its bytes, its
+timestamp and its link type, each column in a raw little-endian file. Frame
+N is one lookup away, and its bytes are one read from the capture.
+
+Capture timestamps are not always in order, so the index also keeps their
+running maximum. That column is sorted, and a binary search over it finds
+the first frame at or after a time in O(log n) reads.
+
+Columns are written out every FLUSH_FRAMES frames, so building the index
+takes no more memory for a large capture than for a small one. An analysis
+keeps its index in its column store, whose frame column ties packet numbers
+to frames.
+"""
+from array import array
+import os
+import shutil
+
+import numpy as np
+
+# Directory of the index inside a column store
+INDEX_DIR = "index"
+FLUSH_FRAMES = 64 * 1024
+# Column name -> (array typecode while building, type on disk)
+COLUMNS = {
+    "offset": ("q", "<i8"),
+    "length": ("i", "<i4"),
+    "timestamp": ("d", "<f8"),
+    "linktype": ("H", "<u2"),
+}
+# Running maximum of the timestamps
+TIME_MAX = "time_max"
+# Timestamps per step of the running maximum pass
+_MAX_CHUNK = 1024 * 1024
+
+
+def _column_path(path, name):
+    return os.path.join(path, name + ".bin")
+
+
+class FrameIndexWriter:
+    """
+    Builds the index of a capture, or of a range of its frames.
+
+    Pass offsets to the reader (CaptureReader.batches(), iter_frame_batches())
+    and every batch it yields to add().
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Directory to write the index to
+        """
+        self.path = path
+        self.complete = True
+        self.frames = 0
+        self.offsets = array("q")
+        self._offsets_written = 0
+        self._lengths = array("i")
+        self._timestamps = array("d")
+        self._linktypes = array("H")
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            open(_column_path(path, name), "wb").close()
+
+    def add(self, linktype, frames):
+        """Index a batch of (frame, timestamp) tuples the reader yielded"""
+        for frame, timestamp in frames:
+            self._lengths.append(len(frame))
+            self._timestamps.append(timestamp)
+        self._linktypes.extend([linktype] * len(frames))
+        self.frames += len(frames)
+        # The reader records no offsets for files only scapy can open. It
+        # may have read a record ahead, which is why this is not an equality
+        if self._offsets_written + len(self.offsets) < self.frames:
+            self.complete = False
+        if len(self._lengths) >= FLUSH_FRAMES:
+            self._flush()
+
+    def _flush(self):
+        self._offsets_written += len(self.offsets)
+        columns = (self.offsets, self._lengths, self._timestamps, self._linktypes)
+        for name, values in zip(COLUMNS, columns):
+            if self.complete:
+                with open(_column_path(self.path, name), "ab") as f:
+                    np.asarray(values, dtype=COLUMNS[name][1]).tofile(f)
+            # The reader holds on to offsets, so empty it in place
+            del values[:]
+
+    def close(self):
+        """
+        Write the rest of the index.
+
+        Returns:
+            True if the index is complete; it is deleted otherwise
+        """
+        self._flush()
+        if self._offsets_written != self.frames:
+            self.complete = False
+        if not self.complete:
+            shutil.rmtree(self.path, ignore_errors=True)
+        return self.complete
+
+    def finish(self):
+        """close() a writer of a whole capture and add the running maximum"""
+        if not self.close():
+            return False
+        _write_time_max(self.path)
+        return True
+
+
+def merge_indexes(path, pieces):
+    """
+    Concatenate the indexes of consecutive ranges of a capture into one.
+
+    Args:
+        path: Directory of the merged index
+        pieces: Directories of the range indexes, in file order; deleted
+
+    Returns:
+        False if some range has no complete index
+    """
+    complete = all(os.path.exists(_column_path(piece, "offset")) for piece in pieces)
+    if complete:
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            with open(_column_path(path, name), "wb") as out:
+                for piece in pieces:
+                    with open(_column_path(piece, name), "rb") as f:
+                        shutil.copyfileobj(f, out)
+        _write_time_max(path)
+    for piece in pieces:
+        shutil.rmtree(piece, ignore_errors=True)
+    return complete
+
+
+def _write_time_max(path):
+    timestamps = _open_column(path, "timestamp", COLUMNS["timestamp"][1])
+    carry = -np.inf
+    with open(_column_path(path, TIME_MAX), "wb") as out:
+        for start in range(0, len(timestamps), _MAX_CHUNK):
+            chunk = np.maximum.accumulate(np.fmax(timestamps[start:start + _MAX_CHUNK], carry))
+            chunk.astype("<f8").tofile(out)
+            carry = chunk[-1]
+
+
+def _open_column(path, name, dtype):
+    column_path = _column_path(path, name)
+    if os.path.getsize(column_path) == 0:
+        # np.memmap can't map an empty file
+        return np.empty(0, dtype=dtype)
+    return np.memmap(column_path, dtype=dtype, mode="r")
+
+
+class FrameIndex:
+    """A finished index, memory-mapped"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Index directory
+
+        Raises:
+            OSError: There is no index at path
+        """
+        self.path = path
+        self.offsets = _open_column(path, "offset", COLUMNS["offset"][1])
+        self.lengths = _open_column(path, "length", COLUMNS["length"][1])
+        self.timestamps = _open_column(path, "timestamp", COLUMNS["timestamp"][1])
+        self.linktypes = _open_column(path, "linktype", COLUMNS["linktype"][1])
+        self.time_max = _open_column(path, TIME_MAX, "<f8")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def entry(self, frame):
+        """
+        Where a frame is in the capture file.
+
+        Returns:
+            {"frame", "offset", "length", "timestamp", "linktype"}
+
+        Raises:
+            IndexError: No such frame
+        """
+        if not 0 <= frame < len(self):
+            raise IndexError(frame)
+        return {
+            "frame": frame,
+            "offset": int(self.offsets[frame]),
+            "length": int(self.lengths[frame]),
+            "timestamp": float(self.timestamps[frame]),
+            "linktype": int(self.linktypes[frame])
+        }
+
+    def frame_at(self, timestamp):
+        """First frame, in file order, with a timestamp at or after the given one; None if there is none"""
+        frame = int(np.searchsorted(self.time_max, timestamp, side="left"))
+        return frame if frame < len(self) else None
+
+    def read(self, capture_path, frame):
+        """Bytes of a frame, read from the capture file"""
+        entry = self.entry(frame)
+        with open(capture_path, "rb") as f:
+            return os.pread(f.fileno(), entry["length"], entry["offset"])
@@ -0,0 +1,247 @@
+# sniffer/multiplexer.py
+"""
+One capture per interface, shared by every session watching it.
+
+The first session on an interface opens the capture; later sessions only
+subscribe to it. The kernel filter is the union of the sessions' needs and
+each batch is split per session in userspace with a cheap header check, so
+frames are copied out of the kernel once no matter how many sessions look
+at them. The capture is closed when the last session unsubscribes.
+"""
+import logging
+import threading
+
+from .filter_planner import render_needs, can_compile, matches, ALL_TRAFFIC
+from .dissect_pool import ETH_P_IP, ETH_P_IPV6, VLAN_TYPES
+
+logger = logging.getLogger("smartsniffer")
+
+ETH_P_ARP = 0x0806
+IP_PROTOS = {1: "icmp", 6: "tcp", 17: "udp"}
+TCP_SYN = 0x02
+
+
+def frame_key(frame):
+    """
+    Summarise a raw Ethernet frame for filter matching.
+
+    Returns:
+        (proto, sport, dport, syn); proto is "tcp", "udp", "icmp", "arp"
+        or None, ports are 0 when not known
+    """
+    size = len(frame)
+    if size < 14:
+        return (None, 0, 0, False)
+
+    eth_type = (frame[12] << 8) | frame[13]
+    off = 14
+    while eth_type in VLAN_TYPES and size >= off + 4:
+        eth_type = (frame[off + 2] << 8) | frame[off + 3]
+        off += 4
+
+    if eth_type == ETH_P_ARP:
+        return ("arp", 0, 0, False)
+    if eth_type == ETH_P_IP:
+        if size < off + 20:
+            return (None, 0, 0, False)
+        proto = frame[off + 9]
+        if ((frame[off + 6] << 8) | frame[off + 7]) & 0x1FFF:
+            # Later fragments carry no transport header
+            return (IP_PROTOS.get(proto), 0, 0, False)
+        l4 = off + (frame[off] & 0x0F) * 4
+    elif eth_type == ETH_P_IPV6:
+        if size < off + 40:
+            return (None, 0, 0, False)
+        proto = frame[off + 6]
+        l4 = off + 40
+    else:
+        return (None, 0, 0, False)
+
+    name = IP_PROTOS.get(proto)
+    if name == "icmp" and eth_type != ETH_P_IP:
+        name = None
+    if name not in ("tcp", "udp") or size < l4 + 4:
+        return (name, 0, 0, False)
+
+    sport = (frame[l4] << 8) | frame[l4 + 1]
+    dport = (frame[l4 + 2] << 8) | frame[l4 + 3]
+    syn = name == "tcp" and size > l4 + 13 and bool(frame[l4 + 13] & TCP_SYN)
+    return (name, sport, dport, syn)
+
+
+class MuxSubscription:
+    """
+    A session's view of a shared capture.
+
+    Looks like a capture adapter to the Sniffer (open/start/stop, counters)
+    but owns no socket; frames matching its needs arrive from the shared
+    capture thread.
+    """
+
+    def __init__(self, mux, adapter, iface, needs, callback, factory):
+        self.mux = mux
+        self.adapter = adapter
+        self.iface = iface
+        self.needs = needs
+        self.callback = callback
+        self.factory = factory
+        self.match_all = ALL_TRAFFIC in needs
+        # Frames that passed this session's userspace filter
+        self.packets_received = 0
+        self.running = False
+        self._capture = None
+
+    def open(self):
+        """Join the shared capture, opening it if this is the first session"""
+        if self._capture is None:
+            self._capture = self.mux.subscribe(self)
+
+    def start(self):
+        """Start taking frames; the shared capture thread does the work"""
+        self.open()
+        self.running = True
+        return True
+
+    def stop(self, timeout=3):
+        """Leave the shared capture; the last session closes it"""
+        self.running = False
+        if self._capture is None:
+            return True
+        capture, self._capture = self._capture, None
+        return self.mux.unsubscribe(self, capture, timeout)
+
+    def deliver(self, frames):
+        # Frames arriving between open() and start() are not this session's yet
+        if frames and self.running:
+            self.packets_received += len(frames)
+            self.callback(frames)
+
+    def get_kernel_stats(self):
+        """Kernel totals of the shared socket, counted for all sessions on it"""
+        capture = self._capture
+        if capture is None or not hasattr(capture.adapter, "get_kernel_stats"):
+            return None
+        return capture.adapter.get_kernel_stats()
+
+
+class SharedCapture:
+    """One capture adapter and the sessions subscribed to it"""
+
+    def __init__(self, key, adapter):
+        self.key = key
+        self.adapter = adapter
+        self.thread = None
+        # Replaced, never mutated, so the capture thread reads it without a lock
+        self.subscribers = ()
+
+    def dispatch(self, frames):
+        """Fan a batch out to the subscribers whose needs the frames match"""
+        subscribers = self.subscribers
+        keys = None
+        for sub in subscribers:
+            if sub.match_all:
+                sub.deliver(frames)
+                continue
+            if keys is None:
+                keys = [frame_key(frame) for frame, _ in frames]
+            needs = sub.needs
+            sub.deliver([item for item, key in zip(frames, keys) if matches(needs, key)])
+
+
+class CaptureMultiplexer:
+    def __init__(self):
+        self._captures = {}
+        self._lock = threading.Lock()
+
+    def subscription(self, adapter, iface, needs, callback, factory):
+        """
+        Create a subscription for a session.
+
+        Args:
+            adapter: Adapter name, captures are shared per (adapter, iface)
+            iface: Interface to capture on
+            needs: The session's filter needs, see filter_planner.session_needs
+            callback: Called with batches of (frame, timestamp) tuples
+            factory: factory(callback, filter_expr) builds a raw-frame capture
+                adapter that does not park its socket on close
+        """
+        return MuxSubscription(self, adapter, iface, needs, callback, factory)
+
+    def subscribe(self, sub):
+        key = (sub.adapter, sub.iface)
+        with self._lock:
+            capture = self._captures.get(key)
+            if capture is None:
+                capture = self._open(key, sub)
+            capture.subscribers = capture.subscribers + (sub,)
+            self._update_filter(capture)
+        return capture
+
+    def unsubscribe(self, sub, capture, timeout=3):
+        with self._lock:
+            capture.subscribers = tuple(s for s in capture.subscribers if s is not sub)
+            if capture.subscribers:
+                self._update_filter(capture)
+                return True
+            del self._captures[capture.key]
+
+        stopped = capture.adapter.stop(timeout)
+        capture.thread.join(timeout)
+        if capture.thread.is_alive():
+            logger.warning(f"Shared capture thread {capture.thread.name} did not stop within {timeout}s")
+        logger.info(f"Closed shared capture on {capture.key[1]} ({capture.key[0]})")
+        return stopped
+
+    def _open(self, key, sub):
+        expression = self._union_filter(key[1], [sub])
+        capture = SharedCapture(key, None)
+        adapter = sub.factory(capture.dispatch, expression)
+        adapter.open()
+        capture.adapter = adapter
+
+        from .core import CAPTURE_THREAD_PREFIX
+        capture.thread = threading.Thread(
+            target=adapter.start,
+            name=f"{CAPTURE_THREAD_PREFIX}shared-{key[0]}-{key[1]}",
+            daemon=True
+        )
+        capture.thread.start()
+        self._captures[key] = capture
+        logger.info(f"Opened shared capture on {key[1]} ({key[0]}) with filter: {expression or '<none>'}")
+        return capture
+
+    def _union_filter(self, iface, subscribers):
+        needs = [need for sub in subscribers for need in sub.needs]
+        expression = render_needs(needs)
+        if expression and not can_compile(expression, iface):
+            return ""
+        return expression
+
+    def _update_filter(self, capture):
+        expression = self._union_filter(capture.key[1], capture.subscribers)
+        if expression == capture.adapter.filter_expr:
+            return
+        try:
+            capture.adapter.set_filter(expression)
+        except Exception as e:
+            logger.warning(f"Could not update shared capture filter on {capture.key[1]}: {str(e)}")
+            return
+        logger.info(f"Shared capture on {capture.key[1]} now filtered by: {expression or '<none>'}")
+
+    def get_stats(self):
+        """Describe the open shared captures"""
+        with self._lock:
+            captures = list(self._captures.values())
+        return [
+            {
+                "adapter": capture.key[0],
+                "interface": capture.key[1],
+                "filter": capture.adapter.filter_expr,
+                "sessions": len(capture.subscribers),
+                "packets_received": getattr(capture.adapter, "packets_received", 0)
+            }
+            for capture in captures
+        ]
+
+
+capture_mux = CaptureMultiplexer()
@@ -1,71 +1,379 @@
 # sniffer/offline_analyzer.py
-from scapy.all import rdpcap
-from .protocols import tcp, dns, http, tls
+from array import array
+from itertools import islice
+import os
+import threading
+import time
+
+from .adapters.pcap_adapter import iter_frame_batches, LINKTYPE_ETHERNET
+from .protocols import dissect_batch, dissect_frames, StreamDissector
+
+PROTOCOLS = ("TCP", "UDP", "DNS", "HTTP", "TLS")
+# Frames between updates of the progress counters
+PROGRESS_INTERVAL = 4096
+
+class AnalysisCancelled(Exception):
+    """Raised by OfflineAnalyzer.analyze() when cancel() stopped it"""
+
+class AnalysisState:
+    """
+    Aggregated results of a capture, or of a chunk of one.
+
+    merge() is associative and commutative, so chunks analysed in any order
+    or grouping add up to the state of a single pass over the file.
+    """
+
+    __slots__ = ("packet_count", "protocol_counts")
+
+    def __init__(self):
+        self.packet_count = 0
+        self.protocol_counts = {}
+
+    def add(self, record):
+        self.packet_count += 1
+        counts = self.protocol_counts
+        counts[record.protocol] = counts.get(record.protocol, 0) + 1
+
+    def merge(self, other):
+        """Add another state into this one and return this one"""
+        self.packet_count += other.packet_count
+        counts = self.protocol_counts
+        for protocol, count in other.protocol_counts.items():
+            counts[protocol] = counts.get(protocol, 0) + count
+        return self
+
+    def replace_protocol(self, before, after, count=1):
+        """
+        Account for stream parser results merged into count records after
+        the fact; before is None when the packets had no record without them
+        """
+        counts = self.protocol_counts
+        if before is None:
+            self.packet_count += count
+        else:
+            counts[before] -= count
+        counts[after] = counts.get(after, 0) + count
 
 class OfflineAnalyzer:
-    def __init__(self, filepath):
+    """
+    Streams a capture file through the parsers one batch of frames at a
+    time and keeps only aggregated state (counts, reassembly stats), so
+    memory does not grow with the size of the file. Records are written to
+    a column store on disk (column_store.py), which get_results() and
+    queries read; without one, get_results() dissects the file again up to
+    the requested page. The store also gets an index of the file's frames
+    (frame_index.py), for reading a packet's bytes or seeking to a time.
+
+    Classic pcap files of at least OFFLINE_PARALLEL_MIN_BYTES are split into
+    chunks analysed by several processes, see chunked_analysis.py.
+
+    Summaries are kept in the result cache, so analysing a file with the
+    same content and settings again only hashes it. Column stores are named
+    the same way and shared by analyses of the same capture.
+
+    While analyze() runs, get_progress() reports bytes and frames read,
+    throughput and an estimate of the time left, and cancel() stops it at
+    the next batch of frames.
+    """
+
+    def __init__(self, filepath, reassemble=True, workers=None, content_hash=None, use_cache=True,
+                 use_store=True):
+        """
+        Args:
+            filepath: Capture file (pcap or pcapng)
+            reassemble: Reassemble TCP streams for the stream parsers (HTTP)
+            workers: Processes for large captures; 1 analyses in this
+                process, None uses OFFLINE_ANALYSIS_WORKERS (0 = one per CPU)
+            content_hash: SHA-256 of the file if already known; computed
+                when needed otherwise
+            use_cache: Look the summary up in the result cache and store it there
+            use_store: Write the records to a column store, unless
+                COLUMN_STORE_MAX_BYTES is 0
+        """
         self.filepath = filepath
-        self.results = []
         self.packet_count = 0
-        
+        self.protocol_counts = dict.fromkeys(PROTOCOLS, 0)
+        self.reassemble = reassemble
+        self.workers = workers
+        self.content_hash = content_hash
+        self.use_cache = use_cache
+        self.use_store = use_store
+        self.store_path = None
+        self.stream_stats = None
+        self.cached = False
+        self.bytes_total = 0
+        self.bytes_read = 0
+        self.frames_read = 0
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
     def analyze(self):
-        """Analyze a PCAP file and return the results"""
-        packets = rdpcap(self.filepath)
-        results = []
-        
-        for pkt in packets:
-            packet_data = {}
-            
-            # Parse protocols
-            tcp_result = tcp.parse(pkt)
-            dns_result = dns.parse(pkt)
-            http_result = http.parse(pkt)
-            tls_result = tls.parse(pkt)
-            
-            # Combine results
-            if tcp_result:
-                packet_data.update(tcp_result)
-            if dns_result:
-                packet_data.update(dns_result)
-            if http_result:
-                packet_data.update(http_result)
-            if tls_result:
-                packet_data.update(tls_result)
-                
-            if packet_data:
-                packet_data["packet_number"] = self.packet_count
-                results.append(packet_data)
-                self.packet_count += 1
-                
-        self.results = results
-        return self.get_summary()
-        
+        """
+        Analyze a PCAP file and return the summary
+
+        Raises:
+            AnalysisCancelled: cancel() was called
+        """
+        self.bytes_total = os.path.getsize(self.filepath)
+        self.bytes_read = 0
+        self.frames_read = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        try:
+            return self._analyze()
+        finally:
+            self.finished_at = time.monotonic()
+
+    def _analyze(self):
+        cache = key = stores = store_key = None
+        if self.use_cache:
+            from .result_cache import get_result_cache
+            cache = get_result_cache()
+            if not cache.enabled:
+                cache = None
+        if self.use_store:
+            from .column_store import get_store_directory
+            stores = get_store_directory()
+            if not stores.enabled:
+                stores = None
+        if cache is not None or stores is not None:
+            from .result_cache import ResultCache, file_sha256
+            if self.content_hash is None:
+                self.content_hash = file_sha256(self.filepath)
+            params = self._cache_params()
+            if stores is not None:
+                store_key = ResultCache.key(self.content_hash, "columns", params)
+                if stores.exists(store_key):
+                    self.store_path = stores.store_path(store_key)
+        if cache is not None:
+            key = cache.key(self.content_hash, "offline", params)
+            cached = cache.get(key)
+            # A cached summary is not enough if the records are wanted too
+            if cached is not None and (stores is None or self.store_path is not None):
+                self.packet_count = cached["total_packets"]
+                self.protocol_counts = cached["protocol_distribution"]
+                self.stream_stats = cached["reassembly"]
+                self.cached = True
+                self.bytes_read = self.bytes_total
+                return self.get_summary()
+
+        store_path = stores.create() if stores is not None else None
+        try:
+            result = None
+            workers = self._parallel_workers()
+            if workers > 1:
+                from .chunked_analysis import analyze_chunks
+                budgets = self._stream_budgets() if self.reassemble else None
+                # None for files that can't be split (pcapng)
+                result = analyze_chunks(
+                    self.filepath, workers, budgets, store_path,
+                    progress=self._chunk_done, cancelled=self._cancel.is_set
+                )
+
+            if result is not None:
+                state, self.stream_stats, segments = result
+            else:
+                from .column_store import SegmentWriter
+                from .frame_index import FrameIndexWriter, INDEX_DIR
+                state = AnalysisState()
+                streams = self._create_streams() if self.reassemble else None
+                writer = index = None
+                if store_path is not None:
+                    writer = SegmentWriter(store_path)
+                    index = FrameIndexWriter(os.path.join(store_path, INDEX_DIR))
+                for record in self._iter_records(streams, writer, index, track=True):
+                    state.add(record)
+                if streams:
+                    streams.close_all()
+                    self.stream_stats = streams.get_stats()
+                segments = None
+                if writer is not None:
+                    segments = writer.close()
+                    index.finish()
+
+            if store_path is not None:
+                from .column_store import write_store
+                write_store(store_path, segments)
+                self.store_path = stores.publish(store_path, store_key)
+        except BaseException:
+            if store_path is not None:
+                stores.discard(store_path)
+            raise
+
+        self.bytes_read = self.bytes_total
+        self.packet_count = state.packet_count
+        self.protocol_counts = {protocol: state.protocol_counts.get(protocol, 0) for protocol in PROTOCOLS}
+        summary = self.get_summary()
+        if key is not None:
+            cache.put(key, {
+                "total_packets": self.packet_count,
+                "protocol_distribution": self.protocol_counts,
+                "reassembly": self.stream_stats
+            })
+        return summary
+
+    def _cache_params(self):
+        """What the summary depends on besides the file's content"""
+        from .protocols import registry, BUILTIN_PARSERS
+        plugins = [name for name, _ in registry.plugins(BUILTIN_PARSERS)]
+        params = {"reassemble": self.reassemble, "parsers": plugins}
+        if self.reassemble:
+            params["reassembly"] = self._stream_budgets()
+        return params
+
+    def _parallel_workers(self):
+        """Processes to analyse the file with, 1 for small files"""
+        from ..config.settings import settings
+        if os.path.getsize(self.filepath) < settings.OFFLINE_PARALLEL_MIN_BYTES:
+            return 1
+        workers = self.workers if self.workers is not None else settings.OFFLINE_ANALYSIS_WORKERS
+        return workers or os.cpu_count() or 1
+
+    def iter_records(self):
+        """Dissect the file and yield its PacketRecords in order"""
+        streams = self._create_streams() if self.reassemble else None
+        return self._iter_records(streams)
+
+    def _iter_records(self, streams, writer=None, index=None, track=False):
+        """
+        Records in order; with track, cancel() is honoured and the progress
+        counters updated at batch boundaries
+        """
+        number = 0
+        frame = 0
+        reported = 0
+        offsets = index.offsets if index is not None else None
+        if track and offsets is None:
+            # Only read for the position in the file
+            offsets = array("q")
+        for linktype, frames in iter_frame_batches(self.filepath, offsets=offsets):
+            if track:
+                if self._cancel.is_set():
+                    raise AnalysisCancelled()
+                if frame + len(frames) - reported >= PROGRESS_INTERVAL:
+                    reported = frame + len(frames)
+                    self.frames_read = reported
+                    if offsets:
+                        self.bytes_read = min(offsets[-1] + len(frames[-1][0]), self.bytes_total)
+                if index is None:
+                    del offsets[:]
+            if index is not None:
+                index.add(linktype, frames)
+            for i, record in enumerate(dissect_capture_batch(linktype, frames, streams)):
+                if record is not None:
+                    record.timestamp = frames[i][1]
+                    record.packet_number = number
+                    number += 1
+                    if writer is not None:
+                        writer.append(record, frame + i)
+                    yield record
+            frame += len(frames)
+        if track:
+            self.frames_read = frame
+
+    def _chunk_done(self, frames, size):
+        """Progress of the parallel analysis, called as every chunk comes back"""
+        self.frames_read += frames
+        self.bytes_read += size
+
+    def cancel(self):
+        """Stop analyze() at the next batch boundary; it raises AnalysisCancelled"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def get_progress(self):
+        """Bytes and frames read, throughput and estimated seconds left"""
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        bytes_per_second = self.bytes_read / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.finished_at is not None:
+            eta = 0.0
+        elif bytes_per_second > 0:
+            eta = round((self.bytes_total - self.bytes_read) / bytes_per_second, 1)
+        return {
+            "bytes_read": self.bytes_read,
+            "bytes_total": self.bytes_total,
+            "percent": round(100.0 * self.bytes_read / self.bytes_total, 1) if self.bytes_total else 0.0,
+            "frames_read": self.frames_read,
+            "elapsed": round(elapsed, 3),
+            "bytes_per_second": round(bytes_per_second),
+            "frames_per_second": round(self.frames_read / elapsed) if elapsed > 0 else 0,
+            "eta_seconds": eta,
+            "cancelled": self.cancelled
+        }
+
+    def _stream_budgets(self):
+        from ..config.settings import settings
+        return {
+            "memory_budget": settings.REASSEMBLY_MEMORY_BUDGET,
+            "flow_budget": settings.REASSEMBLY_FLOW_BUDGET,
+            "idle_timeout": settings.REASSEMBLY_IDLE_TIMEOUT
+        }
+
+    def _create_streams(self):
+        return StreamDissector(**self._stream_budgets())
+
     def get_summary(self):
         """Get summary statistics from the analysis"""
-        protocol_counts = {
-            "TCP": 0,
-            "UDP": 0,
-            "DNS": 0,
-            "HTTP": 0,
-            "TLS": 0
-        }
-        
-        for result in self.results:
-            if "protocol" in result:
-                protocol = result["protocol"]
-                if protocol in protocol_counts:
-                    protocol_counts[protocol] += 1
-        
         return {
             "filepath": self.filepath,
             "total_packets": self.packet_count,
-            "protocol_distribution": protocol_counts,
-            "has_results": len(self.results) > 0
+            "protocol_distribution": dict(self.protocol_counts),
+            "has_results": self.packet_count > 0,
+            "reassembly": self.stream_stats
         }
-        
+
     def get_results(self, limit=100, offset=0):
-        """Get a portion of the results"""
-        end = offset + limit
-        return self.results[offset:end]
-    
-    
\ No newline at end of file
+        """Get a portion of the results, as PacketRecords"""
+        store = self.open_store()
+        if store is not None:
+            return store.query(limit=limit, offset=offset)[1]
+        return list(islice(self.iter_records(), offset, offset + limit))
+
+    def open_store(self):
+        """ColumnStore of the records, None if there is none or it was evicted"""
+        if self.store_path is None:
+            return None
+        from .column_store import ColumnStore
+        try:
+            return ColumnStore(self.store_path)
+        except (OSError, ValueError):
+            return None
+
+    def open_index(self):
+        """
+        FrameIndex of the file, kept with the column store; None if there
+        is none (no store, or a file only scapy can read)
+        """
+        if self.store_path is None:
+            return None
+        from .frame_index import FrameIndex, INDEX_DIR
+        try:
+            return FrameIndex(os.path.join(self.store_path, INDEX_DIR))
+        except OSError:
+            return None
+
+def capture_packets(linktype, frames):
+    """Scapy packets of raw frames of a link type the fast path does not decode"""
+    from scapy.config import conf
+    from scapy.packet import Raw
+    cls = conf.l2types.get(linktype, Raw)
+    packets = []
+    for frame, timestamp in frames:
+        packet = cls(bytes(frame))
+        packet.time = timestamp
+        packets.append(packet)
+    return packets
+
+def dissect_capture_batch(linktype, frames, streams=None, stream_parsers=True):
+    """Fast-path decode Ethernet frames, let scapy handle other link types"""
+    if linktype == LINKTYPE_ETHERNET:
+        return dissect_frames(frames, streams=streams, stream_parsers=stream_parsers)
+    return dissect_batch(capture_packets(linktype, frames), streams=streams, stream_parsers=stream_parsers)
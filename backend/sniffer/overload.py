@@ -0,0 +1,133 @@
+# sniffer/overload.py
+"""
+Load shedding for the live pipeline.
+
+The controller watches how long dissection takes per packet and how far the
+pipeline lags behind capture. When either gets out of hand it doubles the
+sampling rate N of the expensive parsers (HTTP, TLS); once things calm down
+it halves it again. A flow is kept when its flow hash is a multiple of N, so
+every packet of a kept flow is parsed and, because N is a power of two, the
+flows kept at 1-in-2N are a subset of those kept at 1-in-N.
+"""
+import logging
+
+from .dissect_pool import flow_hash
+
+logger = logging.getLogger("smartsniffer")
+
+MAX_SAMPLE_RATE = 64
+LATENCY_BUDGET_US = 500     # Per-packet dissection time considered overload
+MAX_LAG = 0.5               # Seconds between capture and dissection considered overload
+MAX_BACKLOG = 0.5           # Fraction of a worker ring in use considered overload
+CALM_BATCHES = 20           # Quiet batches in a row before the rate is halved
+SETTLE_BATCHES = 5          # Batches after a change before the rate is raised again
+EWMA_WEIGHT = 0.2
+
+
+def sample_mask(frames, rate):
+    """
+    Decide per raw frame whether the expensive parsers see it.
+
+    Returns None when nothing is sampled out (rate 1), otherwise one bool per
+    frame; a frame is kept when its flow hash is a multiple of rate.
+    """
+    if rate <= 1:
+        return None
+    return [flow_hash(frame) % rate == 0 for frame in frames]
+
+
+class OverloadController:
+    def __init__(self, max_rate=MAX_SAMPLE_RATE, latency_budget_us=LATENCY_BUDGET_US,
+                 max_lag=MAX_LAG, max_backlog=MAX_BACKLOG, calm_batches=CALM_BATCHES,
+                 settle_batches=SETTLE_BATCHES):
+        """
+        Initialize the controller.
+
+        Args:
+            max_rate: Highest 1-in-N sampling rate, a power of two
+            latency_budget_us: Average per-packet dissection time that counts as overload
+            max_lag: Capture-to-dissection delay in seconds that counts as overload
+            max_backlog: Queue fill ratio (0..1) that counts as overload
+            calm_batches: Batches under half of every limit before sampling is relaxed
+            settle_batches: Batches to wait after a change so the averages catch up
+        """
+        if max_rate < 1 or max_rate & (max_rate - 1):
+            raise ValueError("Maximum sample rate must be a power of two")
+
+        self.max_rate = max_rate
+        self.latency_budget_us = latency_budget_us
+        self.max_lag = max_lag
+        self.max_backlog = max_backlog
+        self.calm_batches = calm_batches
+        self.settle_batches = settle_batches
+
+        # Read by the capture thread, written only by observe()
+        self.rate = 1
+        self.latency_us = 0.0
+        self.lag = 0.0
+        self.backlog = 0.0
+        self.packets_seen = 0
+        self.packets_sampled_out = 0
+        self.rate_changes = 0
+        self._calm = 0
+        self._since_change = settle_batches
+
+    def observe(self, packets, elapsed, lag=0.0, backlog=0.0, skipped=0):
+        """
+        Feed the result of one processed batch and adjust the rate.
+
+        Args:
+            packets: Packets in the batch, sampled or not
+            elapsed: Seconds spent dissecting the batch
+            lag: Seconds between capture of the newest packet and now
+            backlog: Fill ratio of the queue in front of dissection
+            skipped: Packets the expensive parsers skipped because of sampling
+        """
+        if not packets:
+            return
+        self.packets_seen += packets
+        self.packets_sampled_out += skipped
+
+        per_packet = elapsed * 1e6 / packets
+        self.latency_us += EWMA_WEIGHT * (per_packet - self.latency_us)
+        self.lag = lag
+        self.backlog = backlog
+        self._since_change += 1
+
+        overloaded = (self.latency_us > self.latency_budget_us
+                      or lag > self.max_lag
+                      or backlog > self.max_backlog)
+        if overloaded:
+            self._calm = 0
+            if self.rate < self.max_rate and self._since_change >= self.settle_batches:
+                self._set_rate(self.rate * 2)
+            return
+
+        calm = (self.latency_us < self.latency_budget_us / 2
+                and lag < self.max_lag / 2
+                and backlog < self.max_backlog / 2)
+        self._calm = self._calm + 1 if calm else 0
+        if self._calm >= self.calm_batches and self.rate > 1:
+            self._calm = 0
+            self._set_rate(self.rate // 2)
+
+    def _set_rate(self, rate):
+        logger.info(
+            f"Sampling expensive parsers 1 in {rate} (latency {self.latency_us:.0f}us, "
+            f"lag {self.lag:.3f}s, backlog {self.backlog:.0%})"
+        )
+        self.rate = rate
+        self.rate_changes += 1
+        self._since_change = 0
+
+    def get_stats(self):
+        """Return the current sampling rate and the load it is based on"""
+        return {
+            "sample_rate": self.rate,
+            "packets_seen": self.packets_seen,
+            "packets_sampled_out": self.packets_sampled_out,
+            "latency_us": round(self.latency_us, 1),
+            "lag": round(self.lag, 3),
+            "backlog": round(self.backlog, 3),
+            "rate_changes": self.rate_changes
+        }
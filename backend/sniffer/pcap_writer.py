@@ -0,0 +1,313 @@
+# sniffer/pcap_writer.py
+"""
+Background PCAP writer for live sessions.
+
+The capture thread hands frames over by appending to a deque (append and
+popleft are atomic, so neither side takes a lock). A writer thread drains the
+deque, packs records into a large buffer and writes it out in big chunks,
+rotating files by size and age.
+
+The disk budget covers every capture file under a directory tree, not just
+one writer's: all sessions record under PCAP_SAVE_PATH and share one
+CaptureBudget, which deletes the oldest closed files of any session (also
+those left by deleted sessions and earlier runs) once the total exceeds it.
+"""
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger("smartsniffer")
+
+PCAP_MAGIC = 0xA1B2C3D4
+LINKTYPE_ETHERNET = 1
+PCAP_GLOBAL_HEADER = struct.Struct("<IHHiIII")
+PCAP_RECORD_HEADER = struct.Struct("<IIII")
+
+DEFAULT_ROTATE_BYTES = 100 * 1024 * 1024
+DEFAULT_ROTATE_SECONDS = 300
+DEFAULT_MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_PENDING = 200000
+CHUNK_BYTES = 4 * 1024 * 1024
+FLUSH_INTERVAL = 0.5  # seconds
+
+
+class CaptureBudget:
+    """Caps the size of all capture files under a directory tree"""
+
+    def __init__(self, root, max_total_bytes):
+        self.root = Path(root)
+        self.max_total_bytes = max_total_bytes
+        self._lock = threading.Lock()
+        # Files being written -> bytes reserved for them to grow to
+        self._open = {}
+        self.deleted_files = 0
+
+    def opened(self, path, reserve):
+        """A writer started a file that may grow to reserve bytes"""
+        with self._lock:
+            self._open[Path(path).resolve()] = reserve
+
+    def closed(self, path):
+        with self._lock:
+            self._open.pop(Path(path).resolve(), None)
+
+    def _closed_files(self):
+        """(modified, size, path) of every closed capture file under the root"""
+        files = []
+        for path in self.root.resolve().rglob("*.pcap"):
+            if path in self._open:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def enforce(self):
+        """
+        Delete the oldest closed files until they and the room reserved for
+        the open ones fit the budget.
+
+        Returns:
+            Number of files deleted
+        """
+        with self._lock:
+            files = sorted(self._closed_files())
+            total = sum(size for _, size, _ in files) + sum(self._open.values())
+            deleted = 0
+            for _, size, path in files:
+                if total <= self.max_total_bytes:
+                    break
+                try:
+                    path.unlink()
+                    deleted += 1
+                except OSError as e:
+                    logger.warning(f"Could not delete old capture file {path}: {str(e)}")
+                    continue
+                total -= size
+                self._remove_empty_parent(path)
+            self.deleted_files += deleted
+            return deleted
+
+    def _remove_empty_parent(self, path):
+        # Directories of deleted sessions go once their last file does
+        parent = path.parent
+        if parent != self.root.resolve():
+            try:
+                parent.rmdir()
+            except OSError:
+                pass
+
+
+_capture_budget = None
+_capture_budget_lock = threading.Lock()
+
+
+def get_capture_budget():
+    """The process-wide CaptureBudget over PCAP_SAVE_PATH, configured from the settings"""
+    global _capture_budget
+    with _capture_budget_lock:
+        if _capture_budget is None:
+            from ..config.settings import settings
+            _capture_budget = CaptureBudget(settings.PCAP_SAVE_PATH, settings.PCAP_MAX_TOTAL_BYTES)
+        return _capture_budget
+
+
+class RotatingPcapWriter:
+    def __init__(self, directory, prefix,
+                 rotate_bytes=DEFAULT_ROTATE_BYTES,
+                 rotate_seconds=DEFAULT_ROTATE_SECONDS,
+                 max_total_bytes=DEFAULT_MAX_TOTAL_BYTES,
+                 max_pending=DEFAULT_MAX_PENDING,
+                 linktype=LINKTYPE_ETHERNET,
+                 snaplen=65535,
+                 budget=None):
+        """
+        Initialize the writer.
+
+        Args:
+            directory: Where capture files are written
+            prefix: File name prefix, e.g. the interface name
+            rotate_bytes: Start a new file once the current one reaches this size
+            rotate_seconds: Start a new file once the current one is this old
+            max_total_bytes: Delete the oldest files when all files in directory
+                together exceed this; ignored with a budget
+            max_pending: Frames allowed to wait for the writer before new ones are dropped
+            linktype: PCAP link-layer type of the frames
+            snaplen: Snap length recorded in the file header
+            budget: CaptureBudget shared with other writers, whose root
+                contains directory
+        """
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_total_bytes = max_total_bytes
+        self.budget = budget if budget is not None else CaptureBudget(directory, max_total_bytes)
+        self.max_pending = max_pending
+        self.linktype = linktype
+        self.snaplen = snaplen
+
+        self._pending = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._file_path = None
+        self._file_bytes = 0
+        self._file_opened_at = 0.0
+        self._index = 0
+        self._files = deque()
+
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.deleted_files = 0
+
+    # ---- capture thread side ------------------------------------------
+
+    def write(self, frame, timestamp):
+        """Queue one frame; frame must be bytes the caller won't modify"""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((frame, timestamp))
+
+    def write_batch(self, frames):
+        """Queue a batch of (frame, timestamp) tuples"""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += len(frames)
+            return
+        self._pending.extend(frames)
+
+    # ---- writer thread side -------------------------------------------
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"pcap-writer-{self.prefix}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Write out everything still pending and close the current file"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                self._drain()
+                self._stop.wait(FLUSH_INTERVAL)
+            self._drain()
+        except Exception as e:
+            logger.error(f"PCAP writer for {self.prefix} failed: {str(e)}", exc_info=True)
+        finally:
+            self._close_file()
+
+    def _drain(self):
+        pending = self._pending
+        chunk = bytearray()
+        pack = PCAP_RECORD_HEADER.pack
+        snaplen = self.snaplen
+
+        while pending:
+            if self._file is None or self._should_rotate():
+                self._write_chunk(chunk)
+                chunk = bytearray()
+                self._rotate()
+
+            frame, timestamp = pending.popleft()
+            caplen = min(len(frame), snaplen)
+            sec = int(timestamp)
+            chunk += pack(sec, int((timestamp - sec) * 1000000), caplen, len(frame))
+            chunk += frame[:caplen]
+            self.frames_written += 1
+            self._file_bytes += PCAP_RECORD_HEADER.size + caplen
+
+            if len(chunk) >= CHUNK_BYTES:
+                self._write_chunk(chunk)
+                chunk = bytearray()
+
+        self._write_chunk(chunk)
+        if self._file is not None:
+            self._file.flush()
+        if self._file is not None and time.time() - self._file_opened_at >= self.rotate_seconds:
+            self._close_file()
+
+    def _write_chunk(self, chunk):
+        if chunk:
+            self._file.write(chunk)
+            self.bytes_written += len(chunk)
+
+    def _should_rotate(self):
+        return (self._file_bytes >= self.rotate_bytes
+                or time.time() - self._file_opened_at >= self.rotate_seconds)
+
+    def _rotate(self):
+        self._close_file()
+        self._index += 1
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = self.directory / f"{self.prefix}-{stamp}-{self._index:04d}.pcap"
+        # Emptied session directories are removed by the budget
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "wb", buffering=CHUNK_BYTES)
+        self._file.write(PCAP_GLOBAL_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, self.snaplen, self.linktype))
+        self._file_path = path
+        self._file_bytes = PCAP_GLOBAL_HEADER.size
+        self._file_opened_at = time.time()
+        self._files.append(path)
+        # Room for the new file to grow to rotate_bytes is reserved, so the
+        # cap holds until the next rotation
+        self.budget.opened(path, self.rotate_bytes)
+        self.deleted_files += self.budget.enforce()
+        # The budget may have deleted any of our older files
+        while self._files and not self._files[0].exists():
+            self._files.popleft()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self.budget.closed(self._file_path)
+            self._file = None
+            self._file_path = None
+
+    # ---- reporting ----------------------------------------------------
+
+    def list_files(self):
+        """Describe the capture files this writer has kept"""
+        files = []
+        for path in list(self._files):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append({
+                "name": path.name,
+                "path": str(path),
+                "size": stat.st_size,
+                "modified": stat.st_mtime,
+                "active": path == self._file_path
+            })
+        return files
+
+    def get_stats(self):
+        """Return writer throughput and backlog counters"""
+        return {
+            "directory": str(self.directory),
+            "files": sum(1 for path in list(self._files) if path.exists()),
+            "frames_written": self.frames_written,
+            "bytes_written": self.bytes_written,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "deleted_files": self.deleted_files
+        }
@@ -1,3 +1,250 @@
 # sniffer/protocols/__init__.py
 
+import socket
+
 from . import tcp, dns, http, tls
+from .registry import ParserRegistry, ParserCounters, merge_parser_stats
+from ..decoder import decode, NEEDS_DISSECTION, PROTO_TCP
+from ..reassembly import TCPReassembler
+from ..record import PacketRecord
+
+# Built-in parsers; third-party ones register through register_parser().
+# HTTP and TLS are skipped for sampled-out flows when the pipeline is
+# overloaded, and HTTP reads reassembled TCP streams when dissection has a
+# StreamDissector.
+registry = ParserRegistry()
+registry.register(tcp)
+registry.register(dns)
+registry.register(http, sampled=True, stream_table=http.HTTPStreamTable)
+registry.register(tls, sampled=True)
+
+BUILTIN_PARSERS = tuple(registry.names())
+
+register_parser = registry.register
+
+
+class StreamDissector:
+    """
+    TCP reassembly feeding the stream parsers, for one dissection context.
+
+    Each context (a Sniffer, a pool worker, an offline analysis) owns one, so
+    stream state is never shared. Results of the stream parsers are merged
+    into the record of the segment whose arrival completed them.
+    """
+
+    def __init__(self, counters=None, **budgets):
+        """
+        Args:
+            counters: Optional ParserCounters of the context, counting the
+                stream parsers' calls and hits as well
+            budgets: Keyword arguments for TCPReassembler (memory_budget,
+                flow_budget, idle_timeout, max_flows)
+        """
+        self.counters = counters
+        self.tables = [(entry, entry.stream_table()) for entry in registry.entries if entry.stream_table]
+        self.reassembler = TCPReassembler(self._on_data, self._on_gap, self._on_close, **budgets)
+        self._results = []
+
+    def _on_data(self, key, data):
+        for entry, table in self.tables:
+            entry.calls += 1
+            result = table.feed(key, data)
+            if result:
+                entry.hits += 1
+                self._results.append(result)
+            if self.counters is not None:
+                self.counters.add(entry, 1, 1 if result else 0)
+
+    def _on_gap(self, key, size):
+        for _, table in self.tables:
+            table.gap(key, size)
+
+    def _on_close(self, key):
+        for _, table in self.tables:
+            table.close(key)
+
+    def _collect(self):
+        results = self._results
+        if results:
+            self._results = []
+        return results
+
+    def feed_decoded(self, decoded, timestamp):
+        """Feed a fast-path decoded frame; returns the stream parser results it completed"""
+        if decoded.proto != PROTO_TCP or decoded.tcp_flags is None:
+            return ()
+        self.reassembler.feed(
+            (decoded.src, decoded.dst, decoded.sport, decoded.dport),
+            decoded.seq, decoded.tcp_flags, decoded.payload, timestamp,
+            truncated=decoded.truncated
+        )
+        return self._collect()
+
+    def feed_packet(self, packet):
+        """Feed a scapy packet; returns the stream parser results it completed"""
+        from scapy.layers.inet import TCP
+        if not packet.haslayer(TCP):
+            return ()
+        tcp = packet[TCP]
+        ip = tcp.underlayer
+        self.reassembler.feed(
+            (ip.src, ip.dst, tcp.sport, tcp.dport),
+            tcp.seq, int(tcp.flags), bytes(tcp.payload), float(packet.time)
+        )
+        return self._collect()
+
+    def close_all(self):
+        """Flush every stream, e.g. at the end of a capture file"""
+        self.reassembler.close_all()
+        self._results = []
+
+    def get_stats(self):
+        return self.reassembler.get_stats()
+
+def merge_stream_stats(stats):
+    """Add up the reassembly stats of several contexts (e.g. pool workers)"""
+    merged = {}
+    for item in stats:
+        for name, value in item.items():
+            merged[name] = merged.get(name, 0) + value
+    return merged or None
+
+def dissect_batch(packets, keep=None, streams=None, stream_parsers=True, counters=None):
+    """
+    Run every registered parser over a batch of packets.
+
+    Args:
+        packets: Scapy packets
+        keep: Optional list of one bool per packet; sampled parsers only
+            see packets whose entry is True
+        streams: Optional StreamDissector; stream parsers then read
+            reassembled streams instead of single packets
+        stream_parsers: False leaves the stream parsers out altogether,
+            for callers feeding a StreamDissector elsewhere
+        counters: Optional ParserCounters of the calling context, counted
+            on top of the registry's process-wide counters
+
+    Returns one PacketRecord per packet merging the parser results, or None
+    when no parser recognised the packet.
+    """
+    kept = None
+    if keep is not None:
+        kept = [packet for packet, k in zip(packets, keep) if k]
+
+    columns = []
+    skip_streams = streams is not None or not stream_parsers
+    for entry in registry.entries:
+        if skip_streams and entry.stream_table:
+            continue
+        if kept is None or not entry.sampled:
+            results = entry.parse_batch(packets)
+            calls = len(packets)
+        else:
+            parsed = iter(entry.parse_batch(kept))
+            results = [next(parsed) if k else None for k in keep]
+            calls = len(kept)
+        hits = sum(1 for result in results if result)
+        entry.calls += calls
+        entry.hits += hits
+        if counters is not None:
+            counters.add(entry, calls, hits)
+        columns.append(results)
+    merged = []
+    for i, results in enumerate(zip(*columns)):
+        record = None
+        for result in results:
+            if result:
+                if record is None:
+                    record = PacketRecord()
+                record.update(result)
+        if streams is not None and (keep is None or keep[i]):
+            for result in streams.feed_packet(packets[i]):
+                if record is None:
+                    record = PacketRecord()
+                record.update(result)
+        if record is not None:
+            _set_packet_addresses(record, packets[i])
+        merged.append(record)
+    return merged
+
+def _set_packet_addresses(record, packet):
+    from scapy.layers.inet import IP
+    from scapy.layers.inet6 import IPv6
+    if IP in packet:
+        ip = packet[IP]
+        record.set_addresses(4, socket.inet_aton(ip.src), socket.inet_aton(ip.dst))
+    elif IPv6 in packet:
+        ip = packet[IPv6]
+        record.set_addresses(
+            6, socket.inet_pton(socket.AF_INET6, ip.src), socket.inet_pton(socket.AF_INET6, ip.dst)
+        )
+
+def dissect_frames(frames, keep=None, streams=None, stream_parsers=True, counters=None):
+    """
+    Run the parsers the registry selects over a batch of raw Ethernet frames.
+
+    Headers are read by the fast-path decoder, which is all the registry
+    needs to pick the parsers for a frame; a scapy packet is only built for
+    parsers that need to dissect deeper. Takes (frame, timestamp) tuples and
+    returns the same records as dissect_batch.
+    """
+    from scapy.layers.l2 import Ether
+
+    select = registry.select
+    skip_streams = streams is not None or not stream_parsers
+    merged = []
+    for i, (frame, timestamp) in enumerate(frames):
+        decoded = decode(frame)
+        sampled_out = keep is not None and not keep[i]
+        packet = None
+        record = None
+        for entry in select(decoded):
+            if sampled_out and entry.sampled:
+                continue
+            if skip_streams and entry.stream_table:
+                continue
+            entry.calls += 1
+            result = entry.parser.parse_decoded(decoded) if entry.fast else NEEDS_DISSECTION
+            if result is NEEDS_DISSECTION:
+                if packet is None:
+                    packet = Ether(bytes(frame))
+                result = entry.parser.parse(packet)
+            if result:
+                entry.hits += 1
+                if record is None:
+                    record = PacketRecord()
+                record.update(result)
+            if counters is not None:
+                counters.add(entry, 1, 1 if result else 0)
+        if streams is not None and not sampled_out:
+            for result in streams.feed_decoded(decoded, timestamp):
+                if record is None:
+                    record = PacketRecord()
+                record.update(result)
+        if record is not None and decoded.src is not None:
+            record.set_addresses(decoded.ip_version, decoded.src, decoded.dst)
+        merged.append(record)
+    return merged
+
+def feed_streams(frames, streams):
+    """
+    Feed a batch of raw Ethernet frames to a StreamDissector only.
+
+    Returns (index, results) for every frame whose arrival completed stream
+    parser results, index being the frame's position in the batch.
+    """
+    completed = []
+    for i, (frame, timestamp) in enumerate(frames):
+        results = streams.feed_decoded(decode(frame), timestamp)
+        if results:
+            completed.append((i, results))
+    return completed
+
+def feed_stream_packets(packets, streams):
+    """feed_streams for scapy packets"""
+    completed = []
+    for i, packet in enumerate(packets):
+        results = streams.feed_packet(packet)
+        if results:
+            completed.append((i, results))
+    return completed
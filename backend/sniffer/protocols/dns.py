@@ -1,28 +1,200 @@
 # sniffer/protocols/dns.py
-from scapy.layers.dns import DNS
+"""
+DNS wire-format decoder working on the UDP (or TCP) payload.
 
-def parse(packet):
-    if packet.haslayer(DNS):
-        dns_layer = packet[DNS]
-        try:
-            query = dns_layer.qd.qname.decode('utf-8', 'ignore') if dns_layer.qd else None
-            return {
-                "protocol": "DNS",
-                "query": query,
-                "id": dns_layer.id,
-                "qr": dns_layer.qr,
-                "opcode": dns_layer.opcode,
-                "aa": dns_layer.aa,
-                "tc": dns_layer.tc,
-                "rd": dns_layer.rd,
-                "ra": dns_layer.ra,
-                "z": dns_layer.z,
-                "rcode": dns_layer.rcode
-            }
-        except AttributeError:
-            return {
-                "protocol": "DNS",
-                "error": "Failed to parse DNS packet"
-            }
+Returns the header flags plus every question as (name, qtype, qclass) and
+every A/AAAA/CNAME/TXT/MX answer as (name, rtype, ttl, value). Names are
+returned with a trailing dot, like scapy's qname. Compression pointers are
+followed; the text of label runs is memoized, since the same names come up
+over and over in real traffic.
+"""
+from functools import lru_cache
+import socket
+import struct
+
+from scapy.layers.inet import TCP, UDP
+from ..decoder import PROTO_TCP, PROTO_UDP
+
+# Ports DNS (and mDNS/LLMNR) is decoded on
+DNS_PORTS = {
+    PROTO_UDP: (53, 5353, 5355),
+    PROTO_TCP: (53,),
+}
+
+TRANSPORT = (PROTO_UDP, PROTO_TCP)
+PORTS = (53, 5353, 5355)
+
+HEADER = struct.Struct("!HHHHHH")
+QUESTION = struct.Struct("!HH")
+RECORD = struct.Struct("!HHIH")
+U16 = struct.Struct("!H")
+
+TYPE_A = 1
+TYPE_CNAME = 5
+TYPE_MX = 15
+TYPE_TXT = 16
+TYPE_AAAA = 28
+
+MAX_POINTERS = 16           # Compression pointers followed per name
+NAME_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _labels_text(raw):
+    """Text of a run of wire-format labels (length-prefixed, no terminator)"""
+    labels = []
+    off = 0
+    while off < len(raw):
+        length = raw[off]
+        labels.append(raw[off + 1:off + 1 + length].decode("utf-8", "replace"))
+        off += 1 + length
+    return ".".join(labels) + "."
+
+
+def read_name(msg, off):
+    """
+    Read a possibly compressed name starting at off.
+
+    Returns:
+        (name, end) with end the offset just past the name in place
+    """
+    parts = []
+    end = None
+    for _ in range(MAX_POINTERS):
+        start = off
+        while True:
+            length = msg[off]
+            if length == 0 or length >= 0xC0:
+                break
+            off += 1 + length
+        if off > start:
+            parts.append(_labels_text(bytes(msg[start:off])))
+        if length == 0:
+            if end is None:
+                end = off + 1
+            break
+        if end is None:
+            end = off + 2
+        off = U16.unpack_from(msg, off)[0] & 0x3FFF
+    else:
+        raise ValueError("DNS name compression loop")
+    return "".join(parts) or ".", end
+
+
+def _rdata(msg, rtype, off, length):
+    """Compact value of the record types we keep, None for the others"""
+    if rtype == TYPE_A and length == 4:
+        return socket.inet_ntop(socket.AF_INET, bytes(msg[off:off + 4]))
+    if rtype == TYPE_AAAA and length == 16:
+        return socket.inet_ntop(socket.AF_INET6, bytes(msg[off:off + 16]))
+    if rtype == TYPE_CNAME:
+        return read_name(msg, off)[0]
+    if rtype == TYPE_MX:
+        return (U16.unpack_from(msg, off)[0], read_name(msg, off + 2)[0])
+    if rtype == TYPE_TXT:
+        strings = []
+        pos = off
+        end = off + length
+        while pos < end:
+            size = msg[pos]
+            strings.append(bytes(msg[pos + 1:pos + 1 + size]).decode("utf-8", "replace"))
+            pos += 1 + size
+        return tuple(strings)
     return None
 
+
+def parse_message(payload):
+    """
+    Decode a DNS message.
+
+    Returns the DNS record, or None if the payload is too short for a DNS
+    header. Malformed or truncated sections keep what was decoded before
+    them and set "truncated".
+    """
+    msg = memoryview(payload)
+    if len(msg) < HEADER.size:
+        return None
+    msg_id, flags, qdcount, ancount, _, _ = HEADER.unpack_from(msg, 0)
+
+    questions = []
+    answers = []
+    result = {
+        "protocol": "DNS",
+        "query": None,
+        "id": msg_id,
+        "qr": flags >> 15,
+        "opcode": (flags >> 11) & 0x0F,
+        "aa": (flags >> 10) & 1,
+        "tc": (flags >> 9) & 1,
+        "rd": (flags >> 8) & 1,
+        "ra": (flags >> 7) & 1,
+        "z": (flags >> 4) & 0x07,
+        "rcode": flags & 0x0F,
+        "questions": questions,
+        "answers": answers
+    }
+
+    off = HEADER.size
+    try:
+        for _ in range(qdcount):
+            name, off = read_name(msg, off)
+            qtype, qclass = QUESTION.unpack_from(msg, off)
+            off += QUESTION.size
+            questions.append((name, qtype, qclass))
+        for _ in range(ancount):
+            name, off = read_name(msg, off)
+            rtype, _, ttl, length = RECORD.unpack_from(msg, off)
+            off += RECORD.size
+            if off + length > len(msg):
+                raise ValueError("DNS record past end of message")
+            value = _rdata(msg, rtype, off, length)
+            off += length
+            if value is not None:
+                answers.append((name, rtype, ttl, value))
+    except (IndexError, ValueError, struct.error):
+        result["truncated"] = True
+
+    if questions:
+        result["query"] = questions[0][0]
+    return result
+
+
+def _parse_transport(proto, sport, dport, payload):
+    ports = DNS_PORTS.get(proto)
+    if not ports or not payload or (sport not in ports and dport not in ports):
+        return None
+    if proto == PROTO_TCP:
+        # Messages over TCP carry a length prefix; only whole ones at the
+        # start of a segment are decoded
+        if len(payload) < 2 + HEADER.size:
+            return None
+        payload = payload[2:2 + U16.unpack_from(payload, 0)[0]]
+    result = parse_message(payload)
+    if result is None:
+        return {
+            "protocol": "DNS",
+            "error": "Failed to parse DNS packet"
+        }
+    return result
+
+
+def parse(packet):
+    if packet.haslayer(UDP):
+        layer, proto = packet[UDP], PROTO_UDP
+    elif packet.haslayer(TCP):
+        layer, proto = packet[TCP], PROTO_TCP
+    else:
+        return None
+    return _parse_transport(proto, layer.sport, layer.dport, bytes(layer.payload))
+
+
+def parse_decoded(decoded):
+    """Fast path: decode the payload straight from the frame"""
+    if decoded.payload_offset is None:
+        return None
+    return _parse_transport(decoded.proto, decoded.sport, decoded.dport, decoded.payload)
+
+
+def parse_batch(packets):
+    """Parse a batch of packets; returns one result (or None) per packet"""
+    return [parse(packet) for packet in packets]
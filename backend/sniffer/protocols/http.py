@@ -1,28 +1,248 @@
 # sniffer/protocols/http.py
-from scapy.packet import Raw
-import re
+"""
+Incremental HTTP/1.x parser.
+
+Each direction of a TCP connection whose reassembled data starts like an
+HTTP request or response gets an HTTPStream that is fed the stream in
+order. Request and status lines, Host, User-Agent and the body length are
+picked up as the header block completes, even when it spans segments; body
+bytes are skipped by count without being copied or decoded. Directions
+that are not classified as HTTP only cost a prefix check.
+
+Without a reassembly context (parse/parse_decoded) each segment is parsed
+on its own.
+"""
+from scapy.layers.inet import TCP
+from ..decoder import PROTO_TCP
+
+METHODS = (b"GET", b"POST", b"PUT", b"DELETE", b"HEAD", b"OPTIONS", b"PATCH", b"CONNECT", b"TRACE")
+MESSAGE_STARTS = tuple(method + b" " for method in METHODS) + (b"HTTP/1.",)
+PREFIX_LENGTH = max(len(start) for start in MESSAGE_STARTS)
+
+MAX_HEADER_BYTES = 16384    # A header block larger than this ends the stream
+
+TRANSPORT = PROTO_TCP
+PORTS = (80, 8000, 8008, 8080, 8888)
+SIGNATURES = MESSAGE_STARTS
+
+# Parser states
+HEADERS = 0
+BODY = 1
+CHUNK_SIZE = 2
+CHUNK_DATA = 3
+TRAILERS = 4
+UNTIL_CLOSE = 5
+
+
+def looks_like_http(data):
+    """True if data starts with an HTTP/1.x request or status line"""
+    return bytes(data[:PREFIX_LENGTH]).startswith(MESSAGE_STARTS)
+
+
+def _could_start_http(data):
+    """Like looks_like_http, but also true for a prefix too short to tell yet"""
+    data = bytes(data[:PREFIX_LENGTH])
+    return data.startswith(MESSAGE_STARTS) or any(start.startswith(data) for start in MESSAGE_STARTS)
+
+
+def _parse_head(head):
+    """Turn a header block (without the blank line) into a message dict"""
+    lines = head.split(b"\r\n")
+    first = lines[0].split(b" ", 2)
+    if first[0].startswith(b"HTTP/"):
+        message = {"http_version": first[0].decode("latin-1")}
+        if len(first) > 1 and first[1].isdigit():
+            message["status_code"] = int(first[1])
+    else:
+        message = {"method": first[0].decode("latin-1")}
+        if len(first) > 1:
+            message["path"] = first[1].decode("latin-1")
+        if len(first) > 2:
+            message["http_version"] = first[2].decode("latin-1")
+
+    for line in lines[1:]:
+        name, sep, value = line.partition(b":")
+        if not sep:
+            continue
+        name = name.strip().lower()
+        if name == b"host":
+            message["host"] = value.strip().decode("latin-1")
+        elif name == b"user-agent":
+            message["user_agent"] = value.strip().decode("latin-1")
+        elif name == b"content-length":
+            value = value.strip()
+            if value.isdigit():
+                message["content_length"] = int(value)
+        elif name == b"transfer-encoding" and b"chunked" in value.lower():
+            message["chunked"] = True
+    return message
+
+
+class HTTPStream:
+    """Parser state for one direction of an HTTP connection"""
+
+    __slots__ = ("state", "buffer", "remaining", "closed")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the current message, e.g. after missing bytes"""
+        self.state = HEADERS
+        self.buffer = bytearray()
+        self.remaining = 0
+        # Set once the stream stops looking like HTTP; nothing more is parsed
+        self.closed = False
+
+    def feed(self, data):
+        """
+        Consume the next in-order bytes of the stream.
+
+        Returns the messages whose header block completed within data.
+        """
+        messages = []
+        view = memoryview(data)
+        while view and not self.closed:
+            if self.state == HEADERS:
+                view = self._read_headers(view, messages)
+            elif self.state in (BODY, CHUNK_DATA):
+                taken = min(self.remaining, len(view))
+                self.remaining -= taken
+                view = view[taken:]
+                if not self.remaining:
+                    self.state = CHUNK_SIZE if self.state == CHUNK_DATA else HEADERS
+            elif self.state in (CHUNK_SIZE, TRAILERS):
+                view = self._read_chunk_line(view)
+            else:
+                # Body delimited by the end of the connection
+                break
+        return messages
+
+    def _read_headers(self, view, messages):
+        start = len(self.buffer)
+        self.buffer += view
+        if start < PREFIX_LENGTH and not _could_start_http(self.buffer):
+            # Lost track of the message boundaries
+            self.closed = True
+            return view[:0]
+        end = self.buffer.find(b"\r\n\r\n", max(0, start - 3))
+        if end < 0:
+            if len(self.buffer) > MAX_HEADER_BYTES:
+                self.closed = True
+            return view[:0]
+
+        message = _parse_head(bytes(self.buffer[:end]))
+        messages.append(message)
+        rest = view[end + 4 - start:]
+        self.buffer = bytearray()
+
+        if message.get("chunked"):
+            self.state = CHUNK_SIZE
+        elif message.get("content_length"):
+            self.state = BODY
+            self.remaining = message["content_length"]
+        elif "status_code" in message and "content_length" not in message and not (
+                message["status_code"] < 200 or message["status_code"] in (204, 304)):
+            self.state = UNTIL_CLOSE
+        return rest
+
+    def _read_chunk_line(self, view):
+        start = len(self.buffer)
+        self.buffer += view
+        end = self.buffer.find(b"\r\n", max(0, start - 1))
+        if end < 0:
+            if len(self.buffer) > MAX_HEADER_BYTES:
+                self.closed = True
+            return view[:0]
+
+        line = bytes(self.buffer[:end])
+        rest = view[end + 2 - start:]
+        self.buffer = bytearray()
+        if self.state == TRAILERS:
+            if not line:
+                self.state = HEADERS
+            return rest
+
+        try:
+            size = int(line.split(b";", 1)[0], 16)
+        except ValueError:
+            self.closed = True
+            return rest
+        if size:
+            self.state = CHUNK_DATA
+            self.remaining = size + 2   # chunk data and its CRLF
+        else:
+            self.state = TRAILERS
+        return rest
+
+
+class HTTPStreamTable:
+    """
+    The HTTPStreams of one reassembly context, keyed by (src, dst, sport, dport).
+
+    Fed the in-order bytes of every TCP direction; a direction becomes an
+    HTTPStream when its data starts like an HTTP message and is forgotten
+    again when it closes or stops looking like HTTP.
+    """
+
+    def __init__(self):
+        self._streams = {}
+
+    def feed(self, key, data):
+        """Returns the result record for the messages completed by data, or None"""
+        stream = self._streams.get(key)
+        if stream is None:
+            if not looks_like_http(data):
+                return None
+            stream = self._streams[key] = HTTPStream()
+        messages = stream.feed(data)
+        if stream.closed:
+            del self._streams[key]
+        return _result(messages, len(data))
+
+    def gap(self, key, size):
+        """Bytes are missing; pick up again at the next message start"""
+        stream = self._streams.get(key)
+        if stream is not None:
+            stream.reset()
+
+    def close(self, key):
+        self._streams.pop(key, None)
+
+    def __len__(self):
+        return len(self._streams)
+
+
+def _result(messages, size):
+    if not messages:
+        return None
+    result = {"protocol": "HTTP", "raw_size": size}
+    result.update(messages[0])
+    if len(messages) > 1:
+        result["messages"] = len(messages)
+    return result
+
+
+def parse_payload(data):
+    """Parse the messages of a single segment, for callers without reassembly"""
+    if not looks_like_http(data):
+        return None
+    return _result(HTTPStream().feed(data), len(data))
+
 
 def parse(packet):
-    if packet.haslayer(Raw):
-        payload = bytes(packet[Raw]).decode("utf-8", errors="ignore")
-        if "HTTP" in payload:
-            # Extract HTTP method, path, and status code if possible
-            method_match = re.search(r"(GET|POST|PUT|DELETE|HEAD|OPTIONS|PATCH) (.*?) HTTP", payload)
-            status_match = re.search(r"HTTP/\d\.\d (\d{3})", payload)
-            
-            result = {
-                "protocol": "HTTP",
-                "payload_preview": payload[:100],
-                "raw_size": len(payload)
-            }
-            
-            if method_match:
-                result["method"] = method_match.group(1)
-                result["path"] = method_match.group(2)
-            
-            if status_match:
-                result["status_code"] = int(status_match.group(1))
-                
-            return result
+    if packet.haslayer(TCP):
+        return parse_payload(bytes(packet[TCP].payload))
     return None
 
+
+def parse_decoded(decoded):
+    """Fast path: look at the TCP payload straight from the frame"""
+    if decoded.proto == PROTO_TCP and decoded.payload_offset is not None:
+        return parse_payload(decoded.payload)
+    return None
+
+
+def parse_batch(packets):
+    """Parse a batch of packets; returns one result (or None) per packet"""
+    return [parse(packet) for packet in packets]
@@ -0,0 +1,258 @@
+# sniffer/protocols/registry.py
+"""
+Registry of protocol parsers and the dispatch table that picks them.
+
+Each parser declares its transport (IP protocol number or a tuple of them),
+the ports it cares about and, optionally, payload prefixes that identify
+its protocol on other ports. From those the registry precomputes lookup
+tables, so picking the parsers for a decoded frame is a few dict lookups
+instead of running every parser on every packet:
+
+- parsers with PORTS = None see every packet of their transport
+- parsers whose port matches the source or destination port run
+- otherwise the first payload byte indexes the signature table; a matching
+  prefix (confirmed by the parser's probe, if any) selects the parser
+
+Parsers are modules or objects with parse(packet) and, for the fast path,
+parse_decoded(decoded). The declarations are read from the TRANSPORT,
+PORTS, SIGNATURES and PROBE attributes unless passed to register().
+"""
+import importlib
+import logging
+import threading
+import types
+
+logger = logging.getLogger("smartsniffer")
+
+
+class ParserEntry:
+    """A registered parser, its declarations and its counters"""
+
+    __slots__ = ("name", "parser", "transports", "ports", "signatures", "probe", "sampled",
+                 "stream_table", "fast", "calls", "hits", "options")
+
+    def __init__(self, name, parser, transports, ports, signatures, probe, sampled, stream_table,
+                 options=None):
+        self.name = name
+        self.parser = parser
+        self.transports = transports
+        self.ports = ports
+        self.signatures = signatures
+        self.probe = probe
+        self.sampled = sampled
+        self.stream_table = stream_table
+        # Parsers without a fast path get the scapy packet
+        self.fast = hasattr(parser, "parse_decoded")
+        # Packets dispatched to the parser / packets it returned a result for
+        self.calls = 0
+        self.hits = 0
+        # register() keyword arguments, to register the parser again in
+        # worker processes
+        self.options = options or {}
+
+    def parse_batch(self, packets):
+        parse_batch = getattr(self.parser, "parse_batch", None)
+        if parse_batch is not None:
+            return parse_batch(packets)
+        return [self.parser.parse(packet) for packet in packets]
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "transports": list(self.transports),
+            "ports": sorted(self.ports) if self.ports is not None else None,
+            "signatures": [prefix.hex() for prefix in self.signatures],
+            "sampled": self.sampled,
+            "stream": self.stream_table is not None,
+            "calls": self.calls,
+            "hits": self.hits
+        }
+
+
+class ParserRegistry:
+    def __init__(self):
+        self.entries = ()
+        self._lock = threading.Lock()
+        self._every = {}
+        self._by_port = {}
+        self._by_prefix = {}
+
+    def register(self, parser, name=None, transport=None, ports=(), signatures=None, probe=None,
+                 sampled=False, stream_table=None):
+        """
+        Register a parser and rebuild the dispatch tables.
+
+        Args:
+            parser: Module or object with parse(packet), optionally
+                parse_decoded(decoded) and parse_batch(packets)
+            name: Parser name, used by the filter planner and in stats;
+                defaults to the module name
+            transport: IP protocol number or tuple of them; defaults to
+                parser.TRANSPORT
+            ports: Ports the parser cares about, None for every packet of its
+                transport; defaults to parser.PORTS
+            signatures: Payload prefixes identifying the protocol on other
+                ports; defaults to parser.SIGNATURES
+            probe: Optional probe(payload) confirming a signature match;
+                defaults to parser.PROBE
+            sampled: Skip the parser for flows sampled out under overload
+            stream_table: Factory of a per-context stream table fed
+                reassembled TCP data instead of single segments, see
+                StreamDissector
+
+        Returns:
+            The ParserEntry
+        """
+        name = name or getattr(parser, "__name__", type(parser).__name__).rsplit(".", 1)[-1]
+        transport = getattr(parser, "TRANSPORT", None) if transport is None else transport
+        if transport is None:
+            raise ValueError(f"Parser {name} declares no transport")
+        transports = tuple(transport) if isinstance(transport, (tuple, list)) else (transport,)
+        if ports == ():
+            ports = getattr(parser, "PORTS", ())
+        if signatures is None:
+            signatures = getattr(parser, "SIGNATURES", ())
+        if probe is None:
+            probe = getattr(parser, "PROBE", None)
+
+        entry = ParserEntry(
+            name, parser, transports, frozenset(ports) if ports is not None else None,
+            tuple(signatures), probe, sampled, stream_table,
+            options={
+                "name": name, "transport": transport, "ports": ports, "signatures": signatures,
+                "probe": probe, "sampled": sampled, "stream_table": stream_table
+            }
+        )
+        with self._lock:
+            if any(existing.name == name for existing in self.entries):
+                raise ValueError(f"A parser named {name} is already registered")
+            self._rebuild(self.entries + (entry,))
+        logger.debug(f"Registered protocol parser {name}")
+        return entry
+
+    def unregister(self, name):
+        with self._lock:
+            self._rebuild(tuple(entry for entry in self.entries if entry.name != name))
+
+    def _rebuild(self, entries):
+        every = {}
+        by_port = {}
+        by_prefix = {}
+        for entry in entries:
+            for transport in entry.transports:
+                if entry.ports is None:
+                    every.setdefault(transport, []).append(entry)
+                    continue
+                for port in entry.ports:
+                    by_port.setdefault((transport, port), []).append(entry)
+                for prefix in entry.signatures:
+                    by_prefix.setdefault((transport, prefix[0]), []).append((prefix, entry))
+
+        # Swapped in whole, so dispatch never sees half-built tables
+        self._every = {key: tuple(value) for key, value in every.items()}
+        self._by_port = {key: tuple(value) for key, value in by_port.items()}
+        self._by_prefix = {key: tuple(value) for key, value in by_prefix.items()}
+        self.entries = entries
+
+    def select(self, decoded):
+        """The parser entries to run for a decoded frame; those seeing every packet come first"""
+        proto = decoded.proto
+        selected = self._every.get(proto, ())
+        if decoded.sport is None:
+            return selected
+
+        by_port = self._by_port
+        from_port = by_port.get((proto, decoded.sport), ())
+        to_port = by_port.get((proto, decoded.dport), ())
+        if from_port or to_port:
+            if from_port and to_port and from_port != to_port:
+                return selected + tuple(dict.fromkeys(from_port + to_port))
+            return selected + (from_port or to_port)
+
+        # Unknown ports: guess from the first payload bytes
+        if decoded.payload_offset is None or decoded.payload_offset >= decoded.payload_end:
+            return selected
+        candidates = self._by_prefix.get((proto, decoded.frame[decoded.payload_offset]))
+        if not candidates:
+            return selected
+        payload = decoded.payload
+        for prefix, entry in candidates:
+            if entry in selected or bytes(payload[:len(prefix)]) != prefix:
+                continue
+            if entry.probe is None or entry.probe(payload):
+                selected = selected + (entry,)
+        return selected
+
+    def get(self, name):
+        for entry in self.entries:
+            if entry.name == name:
+                return entry
+        return None
+
+    def names(self):
+        return [entry.name for entry in self.entries]
+
+    def plugins(self, builtin=()):
+        """
+        (module name, register() options) of the parser modules registered
+        besides the builtin names, for worker processes to load_plugins()
+        """
+        return [
+            (entry.parser.__name__, entry.options)
+            for entry in self.entries
+            if entry.name not in builtin and isinstance(entry.parser, types.ModuleType)
+        ]
+
+    def load_plugins(self, plugins):
+        """Import and register parser modules listed by plugins() in another process"""
+        for module_name, options in plugins:
+            if self.get(options["name"]) is None:
+                # Importing may already register it
+                module = importlib.import_module(module_name)
+                if self.get(options["name"]) is None:
+                    self.register(module, **options)
+
+    def get_stats(self):
+        """Calls and hits per parser"""
+        return {entry.name: {"calls": entry.calls, "hits": entry.hits} for entry in self.entries}
+
+    def describe(self):
+        """Declarations and counters of every registered parser"""
+        return [entry.describe() for entry in self.entries]
+
+
+class ParserCounters:
+    """
+    Calls and hits per parser for one dissection context (a live session).
+
+    The counters on the registry entries are shared by everything that
+    dissects in the process; a context that reports its own counts passes
+    one of these to the dissect functions as well.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.hits = {}
+
+    def add(self, entry, calls, hits):
+        self.calls[entry.name] = self.calls.get(entry.name, 0) + calls
+        if hits:
+            self.hits[entry.name] = self.hits.get(entry.name, 0) + hits
+
+    def get_stats(self, entries):
+        """Calls and hits of the given registry entries, in the format of ParserRegistry.get_stats()"""
+        return {
+            entry.name: {"calls": self.calls.get(entry.name, 0), "hits": self.hits.get(entry.name, 0)}
+            for entry in entries
+        }
+
+
+def merge_parser_stats(stats):
+    """Add up get_stats() of several processes (e.g. pool workers)"""
+    merged = {}
+    for item in stats:
+        for name, counts in item.items():
+            total = merged.setdefault(name, {"calls": 0, "hits": 0})
+            total["calls"] += counts["calls"]
+            total["hits"] += counts["hits"]
+    return merged
@@ -1,5 +1,10 @@
 # sniffer/protocols/tcp.py
 from scapy.layers.inet import TCP
+from ..decoder import PROTO_TCP
+
+TRANSPORT = PROTO_TCP
+# Every TCP packet
+PORTS = None
 
 def parse(packet):
     if packet.haslayer(TCP):
@@ -13,3 +18,20 @@ def parse(packet):
             "ack": tcp_layer.ack
         }
     return None
+
+def parse_decoded(decoded):
+    """Fast path: build the same record from decoded headers"""
+    if decoded.proto == PROTO_TCP and decoded.sport is not None:
+        return {
+            "protocol": "TCP",
+            "src_port": decoded.sport,
+            "dst_port": decoded.dport,
+            "flags": decoded.flags,
+            "seq": decoded.seq,
+            "ack": decoded.ack
+        }
+    return None
+
+def parse_batch(packets):
+    """Parse a batch of packets; returns one result (or None) per packet"""
+    return [parse(packet) for packet in packets]
@@ -1,13 +1,253 @@
-
 # sniffer/protocols/tls.py
-from scapy.layers.tls.all import TLS
+"""
+TLS record and handshake parser working on raw TCP payload bytes.
+
+Only segments whose first bytes look like a TLS record header are parsed.
+Records are walked in place through a memoryview; ClientHello and
+ServerHello messages are taken apart for version, cipher suites,
+extensions, SNI, ALPN and supported groups, and get their JA3/JA3S hash.
+"""
+import hashlib
+import struct
+
+from scapy.layers.inet import TCP
+from ..decoder import PROTO_TCP
+
+RECORD_HEADER = struct.Struct("!BHH")
+U8 = struct.Struct("!B")
+U16 = struct.Struct("!H")
+# Largest record allowed by the spec (2^14 plus expansion)
+MAX_RECORD_LENGTH = 16384 + 2048
+
+CONTENT_TYPES = {
+    20: "change_cipher_spec",
+    21: "alert",
+    22: "handshake",
+    23: "application_data",
+    24: "heartbeat",
+}
+HANDSHAKE = 22
+
+HANDSHAKE_TYPES = {
+    0: "HelloRequest",
+    1: "ClientHello",
+    2: "ServerHello",
+    4: "NewSessionTicket",
+    8: "EncryptedExtensions",
+    11: "Certificate",
+    12: "ServerKeyExchange",
+    13: "CertificateRequest",
+    14: "ServerHelloDone",
+    15: "CertificateVerify",
+    16: "ClientKeyExchange",
+    20: "Finished",
+}
+CLIENT_HELLO = 1
+SERVER_HELLO = 2
+
+VERSIONS = {
+    0x0300: "SSL 3.0",
+    0x0301: "TLS 1.0",
+    0x0302: "TLS 1.1",
+    0x0303: "TLS 1.2",
+    0x0304: "TLS 1.3",
+}
+
+TRANSPORT = PROTO_TCP
+PORTS = (443, 465, 636, 853, 993, 995, 8443)
+# Record header: content type, then major version 3
+SIGNATURES = tuple(bytes((content_type, 3)) for content_type in CONTENT_TYPES)
+
+EXT_SERVER_NAME = 0
+EXT_SUPPORTED_GROUPS = 10
+EXT_EC_POINT_FORMATS = 11
+EXT_ALPN = 16
+EXT_SUPPORTED_VERSIONS = 43
+
+
+def is_grease(value):
+    """GREASE values (RFC 8701) are random filler and left out of fingerprints"""
+    return (value & 0x0F0F) == 0x0A0A and (value >> 8) == (value & 0xFF)
+
+
+def looks_like_tls(payload):
+    """True if payload starts with something shaped like a TLS record header"""
+    if len(payload) < RECORD_HEADER.size:
+        return False
+    content_type, version, length = RECORD_HEADER.unpack_from(payload, 0)
+    return (content_type in CONTENT_TYPES
+            and version >> 8 == 3 and version & 0xFF <= 4
+            and 0 < length <= MAX_RECORD_LENGTH)
+
+
+def _u16_list(view, off, length):
+    count = length // 2
+    return list(struct.unpack_from(f"!{count}H", view, off)) if count else []
+
+
+def _parse_extensions(view, off, end, hello):
+    """Walk the extension block, filling hello with the fields we know"""
+    extensions = []
+    while off + 4 <= end:
+        ext_type, ext_len = struct.unpack_from("!HH", view, off)
+        off += 4
+        data_end = min(off + ext_len, end)
+        extensions.append(ext_type)
+
+        if ext_type == EXT_SERVER_NAME and data_end - off >= 5:
+            # server_name_list: list length, name type, name length, name
+            name_len = U16.unpack_from(view, off + 3)[0]
+            hello["sni"] = bytes(view[off + 5:min(off + 5 + name_len, data_end)]).decode("ascii", "replace")
+        elif ext_type == EXT_SUPPORTED_GROUPS and data_end - off >= 2:
+            list_len = min(U16.unpack_from(view, off)[0], data_end - off - 2)
+            hello["supported_groups"] = _u16_list(view, off + 2, list_len)
+        elif ext_type == EXT_EC_POINT_FORMATS and data_end - off >= 1:
+            list_len = min(view[off], data_end - off - 1)
+            hello["ec_point_formats"] = list(view[off + 1:off + 1 + list_len])
+        elif ext_type == EXT_ALPN and data_end - off >= 2:
+            protocols = []
+            pos = off + 2
+            while pos < data_end:
+                proto_len = view[pos]
+                protocols.append(bytes(view[pos + 1:pos + 1 + proto_len]).decode("ascii", "replace"))
+                pos += 1 + proto_len
+            hello["alpn"] = protocols
+        elif ext_type == EXT_SUPPORTED_VERSIONS and data_end > off:
+            if hello["handshake"] == "ClientHello":
+                list_len = min(view[off], data_end - off - 1)
+                hello["supported_versions"] = _u16_list(view, off + 1, list_len)
+            elif data_end - off >= 2:
+                hello["supported_versions"] = [U16.unpack_from(view, off)[0]]
+
+        off += ext_len
+    hello["extensions"] = extensions
+
+
+def _parse_hello(view, hs_type, hello):
+    """Parse a ClientHello or ServerHello body; raises on truncation"""
+    end = len(view)
+    version = U16.unpack_from(view, 0)[0]
+    hello["legacy_version"] = version
+    off = 2 + 32
+    off += 1 + view[off]                            # session id
+
+    if hs_type == CLIENT_HELLO:
+        cs_len = U16.unpack_from(view, off)[0]
+        hello["cipher_suites"] = _u16_list(view, off + 2, min(cs_len, end - off - 2))
+        off += 2 + cs_len
+        off += 1 + view[off]                        # compression methods
+    else:
+        hello["cipher_suite"] = U16.unpack_from(view, off)[0]
+        off += 2 + 1                                # cipher suite, compression
+
+    if off + 2 <= end:
+        ext_len = U16.unpack_from(view, off)[0]
+        _parse_extensions(view, off + 2, min(off + 2 + ext_len, end), hello)
+
+
+def _finish_hello(hello):
+    """
+    Derive the effective version and, for a complete hello, the JA3/JA3S
+    fingerprint; a hash of partial cipher or extension lists would be a
+    fingerprint no client has
+    """
+    versions = [v for v in hello.get("supported_versions", []) if not is_grease(v)]
+    version = max(versions) if versions else hello["legacy_version"]
+    hello["tls_version"] = VERSIONS.get(version, hex(version))
+    if hello.get("truncated"):
+        return
+
+    extensions = "-".join(str(e) for e in hello.get("extensions", []) if not is_grease(e))
+    if hello["handshake"] == "ClientHello":
+        ciphers = "-".join(str(c) for c in hello.get("cipher_suites", []) if not is_grease(c))
+        groups = "-".join(str(g) for g in hello.get("supported_groups", []) if not is_grease(g))
+        formats = "-".join(str(f) for f in hello.get("ec_point_formats", []))
+        ja3 = f"{hello['legacy_version']},{ciphers},{extensions},{groups},{formats}"
+        hello["ja3"] = hashlib.md5(ja3.encode()).hexdigest()
+    else:
+        ja3s = f"{hello['legacy_version']},{hello.get('cipher_suite', '')},{extensions}"
+        hello["ja3s"] = hashlib.md5(ja3s.encode()).hexdigest()
+
+
+def parse_handshake(body):
+    """
+    Parse the first handshake message of a handshake record body.
+
+    Returns a dict with at least "handshake" (message name), plus the hello
+    fields for ClientHello/ServerHello. "truncated" is set when the message
+    continues beyond the bytes available; a truncated hello gets no JA3/JA3S,
+    only the reassembled message does.
+    """
+    if len(body) < 4:
+        return {"handshake": "unknown", "truncated": True}
+    hs_type = body[0]
+    hs_len = (body[1] << 16) | U16.unpack_from(body, 2)[0]
+    hello = {"handshake": HANDSHAKE_TYPES.get(hs_type, "unknown")}
+    if hs_type not in (CLIENT_HELLO, SERVER_HELLO):
+        return hello
+
+    message = body[4:4 + hs_len]
+    if len(message) < hs_len:
+        hello["truncated"] = True
+    try:
+        _parse_hello(message, hs_type, hello)
+    except (struct.error, IndexError):
+        hello["truncated"] = True
+    if "legacy_version" in hello:
+        _finish_hello(hello)
+    return hello
+
+
+PROBE = looks_like_tls
+
+
+def parse_payload(payload):
+    """
+    Parse the TLS records at the start of a TCP payload.
+
+    Returns None unless the payload starts with a TLS record header.
+    """
+    view = memoryview(payload)
+    if not looks_like_tls(view):
+        return None
+
+    result = {
+        "protocol": "TLS",
+        "detected": True,
+        "record_version": VERSIONS.get(U16.unpack_from(view, 1)[0]),
+    }
+    record_types = []
+    off = 0
+    end = len(view)
+    while off + RECORD_HEADER.size <= end:
+        content_type, version, length = RECORD_HEADER.unpack_from(view, off)
+        if content_type not in CONTENT_TYPES or version >> 8 != 3:
+            break
+        record_types.append(CONTENT_TYPES[content_type])
+        body_start = off + RECORD_HEADER.size
+        if content_type == HANDSHAKE and "handshake" not in result:
+            result.update(parse_handshake(view[body_start:min(body_start + length, end)]))
+        off = body_start + length
+
+    result["record_types"] = record_types
+    return result
+
 
 def parse(packet):
-    if "TLS" in packet.summary():
-        return {
-            "protocol": "TLS",
-            "summary": packet.summary(),
-            "detected": True
-        }
+    if packet.haslayer(TCP):
+        return parse_payload(bytes(packet[TCP].payload))
     return None
 
+
+def parse_decoded(decoded):
+    """Fast path: parse the TCP payload straight from the frame"""
+    if decoded.proto == PROTO_TCP and decoded.payload_offset is not None:
+        payload = decoded.payload
+        if looks_like_tls(payload):
+            return parse_payload(payload)
+    return None
+
+
+def parse_batch(packets):
+    """Parse a batch of packets; returns one result (or None) per packet"""
+    return [parse(packet) for packet in packets]
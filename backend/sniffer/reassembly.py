@@ -0,0 +1,295 @@
+# sniffer/reassembly.py
+"""
+Memory-capped TCP stream reassembly.
+
+Segments are fed per direction in capture order. In-order payload is handed
+to the on_data callback straight away, without being copied; segments that
+arrive ahead of a hole are buffered until the hole is filled. Retransmitted
+and overlapping bytes are trimmed so every byte of a stream is delivered
+once, in order.
+
+Buffered bytes are bounded per flow and in total. When a flow's buffer is
+full, or the total goes over budget, the oldest holes are given up on: the
+consumer is told how many bytes are missing and delivery continues with the
+buffered data. Flows idle for longer than idle_timeout (in capture time)
+are flushed and closed.
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+DEFAULT_FLOW_BUDGET = 1024 * 1024
+DEFAULT_IDLE_TIMEOUT = 120      # seconds
+DEFAULT_MAX_FLOWS = 65536
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+SEQ_MOD = 1 << 32
+SEQ_HALF = 1 << 31
+
+
+def seq_delta(seq, reference):
+    """Signed distance from reference to seq in 32-bit sequence space"""
+    return (seq - reference + SEQ_HALF) % SEQ_MOD - SEQ_HALF
+
+
+class _Stream:
+    """One direction of a connection"""
+
+    __slots__ = ("next_seq", "next_pos", "positions", "segments", "buffered", "last_seen", "fin")
+
+    def __init__(self, next_seq, timestamp):
+        self.next_seq = next_seq
+        # Unwrapped stream offset of next_seq, so buffered segments sort
+        # correctly across sequence number wrap-around
+        self.next_pos = 0
+        self.positions = []
+        self.segments = []
+        self.buffered = 0
+        self.last_seen = timestamp
+        self.fin = False
+
+
+class TCPReassembler:
+    def __init__(self, on_data, on_gap=None, on_close=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 flow_budget=DEFAULT_FLOW_BUDGET, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_flows=DEFAULT_MAX_FLOWS):
+        """
+        Initialize the reassembler.
+
+        Args:
+            on_data: on_data(key, data) with the next in-order bytes of a
+                direction; data may be a memoryview into the frame and is
+                only valid during the call
+            on_gap: Optional on_gap(key, size) when size bytes of a direction
+                were given up on; the next on_data continues after the hole
+            on_close: Optional on_close(key) when a direction ends (FIN, RST,
+                idle or evicted); nothing more is delivered for it
+            memory_budget: Bytes of out-of-order data buffered over all flows
+            flow_budget: Bytes of out-of-order data buffered per direction
+            idle_timeout: Seconds of capture time after which a quiet
+                direction is flushed and closed
+            max_flows: Directions tracked at once; the least recently
+                active one is closed to make room
+        """
+        self.on_data = on_data
+        self.on_gap = on_gap
+        self.on_close = on_close
+        self.memory_budget = memory_budget
+        self.flow_budget = flow_budget
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+
+        # Least recently active first
+        self._streams = OrderedDict()
+        self._next_expiry = None
+
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+        self.bytes_delivered = 0
+        self.bytes_trimmed = 0
+        self.segments_out_of_order = 0
+        self.gaps = 0
+        self.gap_bytes = 0
+        self.flow_budget_skips = 0
+        self.memory_budget_skips = 0
+        self.evicted_idle = 0
+        self.evicted_max_flows = 0
+        self.closed = 0
+
+    def feed(self, key, seq, flags, payload, timestamp, truncated=0):
+        """
+        Feed one TCP segment.
+
+        Args:
+            key: (src, dst, sport, dport) of the segment's direction
+            seq: TCP sequence number
+            flags: TCP flags as an int
+            payload: Segment payload (bytes or memoryview)
+            timestamp: Capture time, drives idle expiry
+            truncated: Payload bytes after payload that were not captured
+        """
+        streams = self._streams
+        stream = streams.get(key)
+        if stream is None:
+            if flags & TCP_RST or not (payload or flags & TCP_SYN):
+                # Pure ACKs of flows we don't track are not worth a stream
+                return
+            stream = _Stream((seq + 1) % SEQ_MOD if flags & TCP_SYN else seq, timestamp)
+            streams[key] = stream
+            if len(streams) > self.max_flows:
+                self.evicted_max_flows += 1
+                self._close(next(iter(streams)), flush=True)
+        else:
+            streams.move_to_end(key)
+            stream.last_seen = timestamp
+            if flags & TCP_SYN and stream.next_pos == 0 and not stream.segments:
+                stream.next_seq = (seq + 1) % SEQ_MOD
+
+        if payload:
+            self._add(key, stream, seq, payload)
+        if truncated and stream.next_seq == (seq + len(payload)) % SEQ_MOD:
+            # The capture cut the segment short; treat the rest as a hole
+            self._skip(key, stream, truncated)
+
+        if flags & TCP_RST:
+            self._close(key)
+            self._close((key[1], key[0], key[3], key[2]))
+        else:
+            if flags & TCP_FIN:
+                stream.fin = True
+            if stream.fin and not stream.segments:
+                # Everything up to the FIN has been delivered
+                self._close(key)
+
+        if self.buffered_bytes > self.memory_budget:
+            self._shed()
+        if self._next_expiry is None:
+            self._next_expiry = timestamp + self.idle_timeout
+        elif timestamp >= self._next_expiry:
+            self.expire(timestamp)
+
+    def _add(self, key, stream, seq, payload):
+        delta = seq_delta(seq, stream.next_seq)
+        if delta <= 0:
+            if -delta >= len(payload):
+                # Nothing new, a plain retransmission
+                self.bytes_trimmed += len(payload)
+                return
+            if delta:
+                self.bytes_trimmed += -delta
+                payload = payload[-delta:]
+            self._deliver(key, stream, payload)
+            if stream.segments:
+                self._drain(key, stream)
+            return
+
+        # Ahead of a hole; keep a copy until the hole is filled
+        self.segments_out_of_order += 1
+        pos = stream.next_pos + delta
+        index = bisect_right(stream.positions, pos)
+        if index and stream.positions[index - 1] + len(stream.segments[index - 1]) >= pos + len(payload):
+            # Already covered by a buffered segment
+            self.bytes_trimmed += len(payload)
+            return
+        while stream.buffered + len(payload) > self.flow_budget and stream.segments:
+            self.flow_budget_skips += 1
+            self._skip_hole(key, stream)
+            delta = seq_delta(seq, stream.next_seq)
+            pos = stream.next_pos + delta
+            if delta <= 0:
+                self._add(key, stream, seq, payload)
+                return
+            index = bisect_right(stream.positions, pos)
+
+        data = bytes(payload)
+        stream.positions.insert(index, pos)
+        stream.segments.insert(index, data)
+        stream.buffered += len(data)
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes > self.peak_buffered_bytes:
+            self.peak_buffered_bytes = self.buffered_bytes
+
+    def _deliver(self, key, stream, data):
+        size = len(data)
+        stream.next_seq = (stream.next_seq + size) % SEQ_MOD
+        stream.next_pos += size
+        self.bytes_delivered += size
+        self.on_data(key, data)
+
+    def _drain(self, key, stream):
+        """Deliver the buffered segments the stream has caught up with"""
+        positions = stream.positions
+        segments = stream.segments
+        while positions and positions[0] <= stream.next_pos:
+            pos = positions.pop(0)
+            data = segments.pop(0)
+            stream.buffered -= len(data)
+            self.buffered_bytes -= len(data)
+            overlap = stream.next_pos - pos
+            if overlap >= len(data):
+                self.bytes_trimmed += len(data)
+                continue
+            if overlap:
+                self.bytes_trimmed += overlap
+                data = memoryview(data)[overlap:]
+            self._deliver(key, stream, data)
+
+    def _skip_hole(self, key, stream):
+        """Give up on the hole before the first buffered segment"""
+        self._skip(key, stream, stream.positions[0] - stream.next_pos)
+
+    def _skip(self, key, stream, missing):
+        self.gaps += 1
+        self.gap_bytes += missing
+        stream.next_seq = (stream.next_seq + missing) % SEQ_MOD
+        stream.next_pos += missing
+        if self.on_gap:
+            self.on_gap(key, missing)
+        self._drain(key, stream)
+
+    def _flush(self, key, stream):
+        while stream.segments:
+            self._skip_hole(key, stream)
+
+    def _shed(self):
+        """Flush the least recently active buffers until back under 90% of the budget"""
+        target = self.memory_budget * 9 // 10
+        for key, stream in list(self._streams.items()):
+            if self.buffered_bytes <= target:
+                break
+            if stream.segments:
+                self.memory_budget_skips += 1
+                self._flush(key, stream)
+                if stream.fin:
+                    self._close(key)
+
+    def _close(self, key, flush=False):
+        stream = self._streams.pop(key, None)
+        if stream is None:
+            return
+        if flush:
+            self._flush(key, stream)
+        self.buffered_bytes -= stream.buffered
+        self.closed += 1
+        if self.on_close:
+            self.on_close(key)
+
+    def expire(self, now):
+        """Flush and close the directions that have been quiet for idle_timeout"""
+        cutoff = now - self.idle_timeout
+        streams = self._streams
+        while streams:
+            key, stream = next(iter(streams.items()))
+            if stream.last_seen > cutoff:
+                break
+            self.evicted_idle += 1
+            self._close(key, flush=True)
+        self._next_expiry = now + self.idle_timeout / 4
+
+    def close_all(self):
+        """Flush and close every direction, e.g. at the end of a capture file"""
+        for key in list(self._streams):
+            self._close(key, flush=True)
+
+    def get_stats(self):
+        """Return memory use and eviction counters"""
+        return {
+            "flows": len(self._streams),
+            "buffered_bytes": self.buffered_bytes,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            "memory_budget": self.memory_budget,
+            "flow_budget": self.flow_budget,
+            "bytes_delivered": self.bytes_delivered,
+            "bytes_trimmed": self.bytes_trimmed,
+            "segments_out_of_order": self.segments_out_of_order,
+            "gaps": self.gaps,
+            "gap_bytes": self.gap_bytes,
+            "flow_budget_skips": self.flow_budget_skips,
+            "memory_budget_skips": self.memory_budget_skips,
+            "evicted_idle": self.evicted_idle,
+            "evicted_max_flows": self.evicted_max_flows,
+            "closed": self.closed
+        }
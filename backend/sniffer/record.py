@@ -0,0 +1,272 @@
+# sniffer/record.py
+"""
+Compact in-memory form of a parsed packet.
+
+Parsers return dicts, but a dict with a dozen string keys per packet costs
+several hundred bytes, which adds up to gigabytes over a long capture or a
+large PCAP. A PacketRecord keeps the fields most packets have in slots: the
+protocol as an interned string, the TCP flags as their bit value and the
+addresses as integers. Fields only application-layer parsers produce (DNS
+questions, HTTP request lines, TLS hellos) go into a small per-record dict.
+
+Large result sets (a whole PCAP) go into a RecordTable instead, which keeps
+the same fields in typed arrays, one row per packet, and only builds
+PacketRecords for the rows that are read.
+
+Records are turned into the JSON dicts the API returns by to_dict(), at the
+API boundary only.
+"""
+from array import array
+from collections import Counter
+import math
+import socket
+import sys
+
+from .decoder import TCP_FLAG_STRINGS
+
+# str(TCP.flags) as the parsers report it, back to the flag bits
+TCP_FLAG_CODES = {name: value for value, name in enumerate(TCP_FLAG_STRINGS)}
+
+# Parser result keys stored in slots; everything else goes to extra
+SLOT_FIELDS = frozenset(("protocol", "src_port", "dst_port", "flags", "seq", "ack"))
+
+_FAMILIES = {4: (socket.AF_INET, 4), 6: (socket.AF_INET6, 16)}
+
+
+class PacketRecord:
+    """One parsed packet; unset fields are None and left out of to_dict()"""
+
+    __slots__ = (
+        "protocol", "ip_version", "src_ip", "dst_ip", "src_port", "dst_port", "flags", "seq", "ack",
+        "extra", "timestamp", "sample_rate", "packet_number"
+    )
+
+    def __init__(self):
+        self.protocol = None
+        self.ip_version = None
+        self.src_ip = None
+        self.dst_ip = None
+        self.src_port = None
+        self.dst_port = None
+        self.flags = None
+        self.seq = None
+        self.ack = None
+        self.extra = None
+        self.timestamp = None
+        self.sample_rate = None
+        self.packet_number = None
+
+    def update(self, result):
+        """Merge a parser result; later results win, as with dict.update"""
+        for key, value in result.items():
+            if key in SLOT_FIELDS:
+                if key == "protocol":
+                    value = sys.intern(value)
+                elif key == "flags":
+                    value = TCP_FLAG_CODES.get(value, value)
+                setattr(self, key, value)
+            elif self.extra is None:
+                self.extra = {key: value}
+            else:
+                self.extra[key] = value
+
+    def set_addresses(self, ip_version, src, dst):
+        """Store packed IPv4/IPv6 addresses as integers"""
+        self.ip_version = ip_version
+        self.src_ip = int.from_bytes(src, "big")
+        self.dst_ip = int.from_bytes(dst, "big")
+
+    def to_dict(self):
+        """JSON form, with the same keys and values the parsers return"""
+        data = {"protocol": self.protocol}
+        if self.src_ip is not None:
+            data["src_ip"] = ip_text(self.ip_version, self.src_ip)
+            data["dst_ip"] = ip_text(self.ip_version, self.dst_ip)
+        if self.src_port is not None:
+            data["src_port"] = self.src_port
+            data["dst_port"] = self.dst_port
+        flags = self.flags
+        if flags is not None:
+            data["flags"] = TCP_FLAG_STRINGS[flags] if isinstance(flags, int) else flags
+        if self.seq is not None:
+            data["seq"] = self.seq
+            data["ack"] = self.ack
+        if self.extra:
+            data.update(self.extra)
+        if self.timestamp is not None:
+            data["timestamp"] = self.timestamp
+        if self.sample_rate is not None:
+            data["sample_rate"] = self.sample_rate
+        if self.packet_number is not None:
+            data["packet_number"] = self.packet_number
+        return data
+
+    def __getstate__(self):
+        # A plain tuple pickles much smaller than the default slot dict,
+        # which matters for records coming back from pool workers
+        return (
+            self.protocol, self.ip_version, self.src_ip, self.dst_ip, self.src_port, self.dst_port,
+            self.flags, self.seq, self.ack, self.extra, self.timestamp, self.sample_rate,
+            self.packet_number
+        )
+
+    def __setstate__(self, state):
+        (protocol, self.ip_version, self.src_ip, self.dst_ip, self.src_port, self.dst_port,
+         self.flags, self.seq, self.ack, self.extra, self.timestamp, self.sample_rate,
+         self.packet_number) = state
+        self.protocol = sys.intern(protocol) if protocol is not None else None
+
+    def __repr__(self):
+        return f"PacketRecord({self.to_dict()!r})"
+
+
+def ip_text(ip_version, value):
+    """Text form of an integer address"""
+    family, size = _FAMILIES[ip_version]
+    return socket.inet_ntop(family, value.to_bytes(size, "big"))
+
+
+# Integer columns of a RecordTable store None as -1
+_MISSING = -1
+_ADDRESS_SIZE = 16
+
+
+class RecordTable:
+    """
+    Append-only table of packet records backed by typed arrays.
+
+    A row takes around 80 bytes plus its extra fields, against several
+    hundred for a PacketRecord with its boxed ints and floats. Protocol names
+    are stored as codes into a per-table list; addresses as 16 bytes each.
+    """
+
+    def __init__(self):
+        self._protocol_names = []
+        self._protocol_codes = {}
+        self._protocols = array("B")
+        self._ip_versions = array("B")
+        self._addresses = bytearray()
+        self._src_ports = array("i")
+        self._dst_ports = array("i")
+        self._flags = array("h")
+        self._seqs = array("q")
+        self._acks = array("q")
+        self._timestamps = array("d")
+        self._sample_rates = array("I")
+        self._packet_numbers = array("q")
+        # Row -> extra fields, only for rows that have any
+        self._extras = {}
+
+    def __len__(self):
+        return len(self._protocols)
+
+    def _protocol_code(self, protocol):
+        code = self._protocol_codes.get(protocol)
+        if code is None:
+            code = len(self._protocol_names)
+            self._protocol_names.append(protocol)
+            self._protocol_codes[protocol] = code
+        return code
+
+    def append(self, record):
+        """Add a PacketRecord as the next row"""
+        row = len(self._protocols)
+        self._protocols.append(self._protocol_code(record.protocol))
+        if record.src_ip is not None:
+            self._ip_versions.append(record.ip_version)
+            self._addresses += record.src_ip.to_bytes(_ADDRESS_SIZE, "big")
+            self._addresses += record.dst_ip.to_bytes(_ADDRESS_SIZE, "big")
+        else:
+            self._ip_versions.append(0)
+            self._addresses += bytes(2 * _ADDRESS_SIZE)
+        self._src_ports.append(_MISSING if record.src_port is None else record.src_port)
+        self._dst_ports.append(_MISSING if record.dst_port is None else record.dst_port)
+        self._seqs.append(_MISSING if record.seq is None else record.seq)
+        self._acks.append(_MISSING if record.ack is None else record.ack)
+        self._timestamps.append(math.nan if record.timestamp is None else record.timestamp)
+        self._sample_rates.append(record.sample_rate or 0)
+        self._packet_numbers.append(_MISSING if record.packet_number is None else record.packet_number)
+
+        extra = record.extra
+        flags = record.flags
+        if isinstance(flags, int):
+            self._flags.append(flags)
+        else:
+            self._flags.append(_MISSING)
+            if flags is not None:
+                # A flag string no parser of ours produces; keep it as is
+                extra = dict(extra or (), flags=flags)
+        if extra:
+            self._extras[row] = extra
+
+    def __getitem__(self, row):
+        """PacketRecord of a row"""
+        if row < 0:
+            row += len(self)
+        record = PacketRecord()
+        record.protocol = self._protocol_names[self._protocols[row]]
+        ip_version = self._ip_versions[row]
+        if ip_version:
+            off = row * 2 * _ADDRESS_SIZE
+            record.ip_version = ip_version
+            record.src_ip = int.from_bytes(self._addresses[off:off + _ADDRESS_SIZE], "big")
+            record.dst_ip = int.from_bytes(self._addresses[off + _ADDRESS_SIZE:off + 2 * _ADDRESS_SIZE], "big")
+        record.src_port = _value(self._src_ports[row])
+        record.dst_port = _value(self._dst_ports[row])
+        record.flags = _value(self._flags[row])
+        record.seq = _value(self._seqs[row])
+        record.ack = _value(self._acks[row])
+        extra = self._extras.get(row)
+        if extra is not None and "flags" in extra and record.flags is None:
+            extra = dict(extra)
+            record.flags = extra.pop("flags")
+        record.extra = extra
+        timestamp = self._timestamps[row]
+        record.timestamp = None if math.isnan(timestamp) else timestamp
+        record.sample_rate = self._sample_rates[row] or None
+        record.packet_number = _value(self._packet_numbers[row])
+        return record
+
+    def slice(self, offset, limit):
+        """PacketRecords of up to limit rows starting at offset"""
+        return [self[row] for row in range(offset, min(offset + limit, len(self)))]
+
+    def protocol_counts(self):
+        """Rows per protocol name"""
+        names = self._protocol_names
+        return {names[code]: count for code, count in Counter(self._protocols).items()}
+
+    def columns(self):
+        """
+        The table's storage, for writing it out.
+
+        Returns:
+            ({column name: array}, protocol names by code, {row: extra fields});
+            "addresses" holds 32 bytes a row, source then destination
+        """
+        columns = {
+            "protocol": self._protocols,
+            "ip_version": self._ip_versions,
+            "addresses": self._addresses,
+            "src_port": self._src_ports,
+            "dst_port": self._dst_ports,
+            "flags": self._flags,
+            "seq": self._seqs,
+            "ack": self._acks,
+            "timestamp": self._timestamps,
+            "sample_rate": self._sample_rates,
+            "packet_number": self._packet_numbers
+        }
+        return columns, self._protocol_names, self._extras
+
+    def nbytes(self):
+        """Bytes held by the columns, not counting the extra fields"""
+        columns = (
+            self._protocols, self._ip_versions, self._src_ports, self._dst_ports, self._flags,
+            self._seqs, self._acks, self._timestamps, self._sample_rates, self._packet_numbers
+        )
+        return len(self._addresses) + sum(column.itemsize * len(column) for column in columns)
+
+
+def _value(stored):
+    return None if stored == _MISSING else stored
@@ -0,0 +1,176 @@
+# sniffer/result_cache.py
+"""
+Disk-backed cache of analysis results.
+
+Results are keyed by the SHA-256 of the capture file and a hash of what was
+asked of it (which analysis, with which parameters), so the same evidence
+uploaded again, under any name, gets its results back without being read.
+Entries are JSON files in RESULT_CACHE_PATH. Reading an entry touches it,
+and the least recently used entries are deleted once the cache holds more
+than RESULT_CACHE_MAX_BYTES. Several processes can share the directory;
+entries are written to a temporary file and renamed into place.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Part of every key; bump it when results change shape or meaning
+RESULT_FORMAT = 1
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """JSON results on disk, LRU-evicted by total size; max_bytes 0 disables it"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(content_hash, kind, params=None):
+        """
+        Cache key of an analysis of a file.
+
+        Args:
+            content_hash: SHA-256 of the capture file
+            kind: Name of the analysis, e.g. "offline" or "detect/anomalies"
+            params: JSON-serialisable parameters the result depends on
+        """
+        request = json.dumps([RESULT_FORMAT, kind, params or {}], sort_keys=True, separators=(",", ":"))
+        return f"{content_hash}-{hashlib.sha256(request.encode()).hexdigest()[:32]}"
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        """Cached result, or None"""
+        if not self.enabled:
+            return None
+        entry = self._entry(key)
+        try:
+            with open(entry, "rb") as f:
+                value = json.load(f)
+            os.utime(entry)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a JSON-serialisable result, evicting old entries if needed"""
+        if not self.enabled:
+            return
+        data = json.dumps(value, separators=(",", ":")).encode()
+        if len(data) > self.max_bytes:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._entry(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            try:
+                with os.scandir(self.path) as it:
+                    for entry in it:
+                        if entry.name.endswith(".json"):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+                            total += stat.st_size
+            except OSError:
+                return
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def clear(self):
+        """Delete every entry"""
+        with self._lock:
+            try:
+                with os.scandir(self.path) as it:
+                    paths = [entry.path for entry in it if entry.name.endswith(".json")]
+            except OSError:
+                return
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def get_stats(self):
+        """Return entry count, size on disk and hit/miss counters"""
+        count = 0
+        size = 0
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith(".json"):
+                        count += 1
+                        size += entry.stat().st_size
+        except OSError:
+            pass
+        return {
+            "enabled": self.enabled,
+            "entries": count,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """The process-wide ResultCache, configured from the settings"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            from ..config.settings import settings
+            _result_cache = ResultCache(settings.RESULT_CACHE_PATH, settings.RESULT_CACHE_MAX_BYTES)
+        return _result_cache
@@ -0,0 +1,128 @@
+# sniffer/ring_buffer.py
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of records tagged with monotonically increasing
+    sequence numbers.
+
+    A single writer (the capture thread) appends records; any number of
+    readers resume from the last sequence number they saw. Once the buffer
+    is full the oldest record is overwritten, so memory stays bounded no
+    matter how long the sniffer runs.
+
+    Sequence numbers keep increasing across clear(), so a reader's cursor
+    from before a restart never points at records it has not seen.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least 1")
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._next_seq = 0
+        # Sequence numbers below this were cleared
+        self._base_seq = 0
+        # Highest sequence number any reader has been given
+        self._read_seq = -1
+        self.evicted = 0
+        # Evicted records no reader had been given
+        self.evicted_unread = 0
+
+    def append(self, record) -> int:
+        """Store a record and return the sequence number assigned to it"""
+        seq = self._next_seq
+        idx = seq % self.capacity
+        old = self._slots[idx]
+        if old is not None:
+            self.evicted += 1
+            if old[0] > self._read_seq:
+                self.evicted_unread += 1
+        # Slot is written before the sequence is published so readers never
+        # see a sequence number whose record is not there yet
+        self._slots[idx] = (seq, record)
+        self._next_seq = seq + 1
+        return seq
+
+    @property
+    def next_seq(self) -> int:
+        """Sequence number the next appended record will get"""
+        return self._next_seq
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest record, -1 when empty"""
+        return self._next_seq - 1
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest record still held"""
+        return max(self._base_seq, self._next_seq - self.capacity)
+
+    def __len__(self):
+        return self._next_seq - self.first_seq
+
+    def read(self, after_seq=None, limit: int = 100):
+        """
+        Read up to `limit` records newer than `after_seq`.
+
+        Args:
+            after_seq: Last sequence number the reader has seen, None to
+                start from the oldest record held; a cursor past the newest
+                record (from another buffer) starts there as well
+            limit: Maximum number of records to return
+
+        Returns:
+            Tuple of (records, cursor, missed) where:
+            - records: list of (seq, record) tuples in sequence order
+            - cursor: sequence number to pass as `after_seq` next time
+            - missed: records evicted (or cleared) before this reader could
+              see them; only this reader's, buffer-wide loss is in evicted
+        """
+        end_seq = self._next_seq
+        oldest = self.first_seq
+        if after_seq is not None and after_seq >= end_seq:
+            after_seq = None
+        start = oldest if after_seq is None else after_seq + 1
+
+        missed = 0
+        if start < oldest:
+            missed = oldest - start
+            start = oldest
+
+        records = []
+        seq = start
+        stop = min(end_seq, start + limit)
+        while seq < stop:
+            slot = self._slots[seq % self.capacity]
+            # The writer may have lapped us while we were reading
+            if slot is None or slot[0] != seq:
+                missed += 1
+            else:
+                records.append(slot)
+            seq += 1
+
+        if seq - 1 > self._read_seq:
+            self._read_seq = seq - 1
+
+        cursor = seq - 1 if seq > start or after_seq is None else after_seq
+        return records, cursor, missed
+
+    def clear(self):
+        """Drop all records and reset counters; sequence numbers carry on"""
+        self._slots = [None] * self.capacity
+        self._base_seq = self._next_seq
+        self._read_seq = self._next_seq - 1
+        self.evicted = 0
+        self.evicted_unread = 0
+
+    def get_stats(self):
+        """Return buffer occupancy and loss counters"""
+        return {
+            "capacity": self.capacity,
+            "size": len(self),
+            "first_seq": self.first_seq,
+            "last_seq": self.last_seq,
+            "evicted": self.evicted,
+            "evicted_unread": self.evicted_unread
+        }
@@ -0,0 +1,83 @@
+# bench_decoder.py
+# Compares the fast-path decoder with full scapy dissection.
+#
+#   python sniffer/test/bench_decoder.py [capture.pcap] [--packets 1000000] [--scapy-packets 20000]
+#
+# Without a capture, the frames of sample.pcap are repeated until --packets
+# frames are written to a temporary file. Scapy is slow enough that it only
+# runs over the first --scapy-packets frames; its rate is per packet, so the
+# two numbers compare directly.
+
+import argparse
+import os
+import tempfile
+import time
+
+from scapy.utils import RawPcapReader, PcapWriter
+from scapy.layers.l2 import Ether
+
+from sniffer.adapters.pcap_adapter import iter_frame_batches
+from sniffer.decoder import decode, NEEDS_DISSECTION
+from sniffer.protocols import dissect_batch, dissect_frames, registry
+
+
+def build_capture(source, count):
+    frames = [frame for frame, _ in RawPcapReader(source)]
+    fd, path = tempfile.mkstemp(suffix=".pcap")
+    os.close(fd)
+    with PcapWriter(path, linktype=1, sync=False) as writer:
+        for i in range(count):
+            writer.write(Ether(frames[i % len(frames)]))
+    return path
+
+
+def bench(label, count, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12} {count:>9} packets {elapsed:8.2f}s {count / elapsed:>12,.0f} pps")
+    return count / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="?")
+    parser.add_argument("--packets", type=int, default=1000000)
+    parser.add_argument("--scapy-packets", type=int, default=20000)
+    args = parser.parse_args()
+
+    path = args.capture or build_capture(os.path.join(os.path.dirname(__file__), "sample.pcap"), args.packets)
+    try:
+        batches = [frames for _, frames in iter_frame_batches(path)]
+        total = sum(len(frames) for frames in batches)
+
+        def run_fast():
+            for frames in batches:
+                dissect_frames(frames)
+
+        scapy_frames = [item for frames in batches for item in frames][:args.scapy_packets]
+
+        # Frames a parser still hands to scapy dominate the fast
+        # path's cost, so report how many there are and the rate without them
+        shallow = []
+        for item in scapy_frames:
+            decoded = decode(item[0])
+            if all(entry.fast and entry.parser.parse_decoded(decoded) is not NEEDS_DISSECTION
+                   for entry in registry.select(decoded)):
+                shallow.append(item)
+        deep = 1 - len(shallow) / max(1, len(scapy_frames))
+        shallow = shallow * max(1, total // max(1, len(shallow)))
+
+        def run_scapy():
+            packets = [Ether(frame) for frame, _ in scapy_frames]
+            dissect_batch(packets)
+
+        fast = bench("fast path", total, run_fast)
+        slow = bench("scapy", len(scapy_frames), run_scapy)
+        print(f"speed-up: {fast / slow:.1f}x")
+
+        headers = bench("headers only", len(shallow), lambda: dissect_frames(shallow))
+        print(f"{deep:.0%} of frames still need scapy; without them the speed-up is {headers / slow:.1f}x")
+    finally:
+        if not args.capture:
+            os.unlink(path)
@@ -0,0 +1,82 @@
+# bench_parallel.py
+# Serial vs parallel offline analysis of a classic pcap file with TCP
+# reassembly on, the slow case: a pool of N workers (chunks plus stream
+# shards, see chunked_analysis.py) against one pass in this process.
+#
+#   python -m backend.sniffer.test.bench_parallel capture.pcap [--workers 2 4 8]
+#
+# Run from the repository root. Wall times only show the speedup with at
+# least N free cores, so every task of the pool is also timed on its own in
+# this process and the pool's schedule replayed on N cores: "projected" is
+# the wall time it would take there, the critical path included.
+
+import argparse
+import heapq
+import os
+import time
+
+from backend.config.settings import settings
+from backend.sniffer import chunked_analysis
+from backend.sniffer.adapters.pcap_adapter import split_pcap
+from backend.sniffer.offline_analyzer import OfflineAnalyzer
+
+
+def serial(path):
+    settings.OFFLINE_PARALLEL_MIN_BYTES = 0
+    analyzer = OfflineAnalyzer(path, workers=1, use_store=False, use_cache=False)
+    started = time.perf_counter()
+    summary = analyzer.analyze()
+    return time.perf_counter() - started, analyzer._stream_budgets(), summary
+
+
+def pool(path, workers):
+    analyzer = OfflineAnalyzer(path, workers=workers, use_store=False, use_cache=False)
+    started = time.perf_counter()
+    summary = analyzer.analyze()
+    return time.perf_counter() - started, summary
+
+
+def task_times(path, workers, budgets):
+    """Seconds of every task the pool would run, in submission order"""
+    ranges = split_pcap(path, workers * chunked_analysis.CHUNKS_PER_WORKER)
+    shards = workers * chunked_analysis.STREAM_SHARDS_PER_WORKER
+    times = []
+    for shard in range(shards):
+        started = time.perf_counter()
+        chunked_analysis._analyze_streams(path, ranges[0][0], ranges[-1][1], budgets, shard, shards)
+        times.append(time.perf_counter() - started)
+    for start, end in ranges:
+        started = time.perf_counter()
+        chunked_analysis._analyze_chunk(path, start, end, False)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def projected(times, workers):
+    """Wall time of running the tasks in order on workers cores, each taking the next task when free"""
+    free = [0.0] * workers
+    for seconds in times:
+        heapq.heappush(free, heapq.heappop(free) + seconds)
+    return max(free)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    args = parser.parse_args()
+
+    print(f"{args.capture}, {os.cpu_count()} cores")
+    # Imports and the page cache
+    serial(args.capture)
+    elapsed, budgets, expected = serial(args.capture)
+    print(f"  serial     {elapsed:7.2f}s")
+    for workers in args.workers:
+        wall, summary = pool(args.capture, workers)
+        times = task_times(args.capture, workers, budgets)
+        estimate = projected(times, workers)
+        same = summary["protocol_distribution"] == expected["protocol_distribution"]
+        print(
+            f"  {workers} workers  {wall:7.2f}s wall, {estimate:7.2f}s projected "
+            f"({elapsed / estimate:.1f}x), longest task {max(times):.2f}s, same counts: {same}"
+        )
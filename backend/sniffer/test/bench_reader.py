@@ -0,0 +1,60 @@
+# bench_reader.py
+# Records per second iterating a capture file with scapy's RawPcapReader and
+# with the memory-mapped CaptureReader, and the full offline path
+# (iter_frame_batches + fast-path decode) on top of the latter.
+#
+#   python sniffer/test/bench_reader.py capture.pcap [capture.pcapng ...]
+#
+# Run it twice if the file was not in the page cache yet.
+
+import argparse
+import time
+
+from scapy.utils import RawPcapReader
+
+from sniffer.adapters.mmap_reader import CaptureReader
+from sniffer.adapters.pcap_adapter import iter_frame_batches
+from sniffer.decoder import decode
+
+
+def scapy_records(path):
+    with RawPcapReader(path) as reader:
+        return sum(1 for _ in reader)
+
+
+def mmap_records(path):
+    with CaptureReader(path) as reader:
+        return sum(1 for _ in reader)
+
+
+def mmap_batches(path):
+    return sum(len(frames) for _, frames in iter_frame_batches(path))
+
+
+def mmap_decode(path):
+    count = 0
+    for _, frames in iter_frame_batches(path):
+        for frame, _ in frames:
+            decode(frame)
+        count += len(frames)
+    return count
+
+
+def measure(label, read, path):
+    started = time.perf_counter()
+    count = read(path)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<14} {count:>9} records {elapsed:7.2f}s {count / elapsed:>12,.0f} records/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="+")
+    args = parser.parse_args()
+
+    for path in args.captures:
+        print(path)
+        measure("RawPcapReader", scapy_records, path)
+        measure("CaptureReader", mmap_records, path)
+        measure("batches", mmap_batches, path)
+        measure("batches+decode", mmap_decode, path)
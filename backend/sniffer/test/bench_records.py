@@ -0,0 +1,92 @@
+# bench_records.py
+# Memory held by parsed packets: the merged dicts the sniffer and the offline
+# analyzer used to keep per packet, PacketRecords (live ring buffer) and a
+# RecordTable (offline analysis).
+#
+#   python sniffer/test/bench_records.py [capture.pcap] [--packets 1000000]
+#
+# The frames of the capture (sample.pcap by default) are repeated until
+# --packets frames have been dissected. Both layouts are built from the same
+# frames by the same parsers; only what is kept per packet differs.
+
+import argparse
+import gc
+import itertools
+import os
+import time
+import tracemalloc
+
+from scapy.utils import RawPcapReader
+
+from sniffer.decoder import decode
+from sniffer.protocols import dissect_frames, registry
+from sniffer.record import RecordTable
+
+
+def dissect_to_dicts(frames):
+    """The old layout: one dict per packet, parser results merged into it"""
+    merged = []
+    for frame, timestamp in frames:
+        decoded = decode(frame)
+        packet_data = {}
+        for entry in registry.select(decoded):
+            result = entry.parser.parse_decoded(decoded)
+            if result:
+                packet_data.update(result)
+        merged.append(packet_data or None)
+    return merged
+
+
+def keep_dicts(frames):
+    kept = []
+    for (_, timestamp), packet_data in zip(frames, dissect_to_dicts(frames)):
+        if packet_data:
+            packet_data["timestamp"] = timestamp
+            packet_data["sample_rate"] = 1
+            packet_data["packet_number"] = len(kept)
+            kept.append(packet_data)
+    return kept
+
+
+def keep_records(frames):
+    kept = []
+    for (_, timestamp), record in zip(frames, dissect_frames(frames)):
+        if record is not None:
+            record.timestamp = timestamp
+            record.sample_rate = 1
+            record.packet_number = len(kept)
+            kept.append(record)
+    return kept
+
+
+def measure(label, batches, keep, kept):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for frames in batches:
+        for item in keep(frames):
+            kept.append(item)
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<8} {len(kept):>9} packets {size / 2 ** 20:9.1f} MiB {size / len(kept):7.0f} B/packet"
+          f" {elapsed:7.2f}s")
+    del kept
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="?", default=os.path.join(os.path.dirname(__file__), "sample.pcap"))
+    parser.add_argument("--packets", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    frames = [(frame, meta.sec + meta.usec / 1e6) for frame, meta in RawPcapReader(args.capture)]
+    repeated = list(itertools.islice(itertools.cycle(frames), args.packets))
+    batches = [repeated[i:i + args.batch] for i in range(0, len(repeated), args.batch)]
+
+    dicts = measure("dicts", batches, keep_dicts, [])
+    records = measure("records", batches, keep_records, [])
+    table = measure("table", batches, keep_records, RecordTable())
+    print(f"records use {records / dicts:.0%} and a table {table / dicts:.0%} of the memory of dicts")
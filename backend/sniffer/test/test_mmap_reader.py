@@ -0,0 +1,60 @@
+# test_mmap_reader.py
+# A classic pcap file whose last record is cut off must give the same
+# frames from CaptureReader as from scapy's PcapReader.
+# Run from the repository root: python -m pytest backend/sniffer/test/test_mmap_reader.py
+
+import os
+import tempfile
+
+from scapy.layers.inet import IP, TCP
+from scapy.layers.l2 import Ether
+from scapy.utils import PcapReader, wrpcap
+
+from backend.sniffer.adapters.mmap_reader import CaptureReader, PCAP_RECORD_SIZE
+from backend.sniffer.adapters.pcap_adapter import iter_frame_batches
+
+PAYLOAD = 100
+
+
+def write_cut_pcap(cut):
+    """A three-packet pcap file with the last cut bytes taken off"""
+    packets = [Ether() / IP(dst=f"10.0.0.{i}") / TCP() / bytes(PAYLOAD) for i in range(3)]
+    fd, path = tempfile.mkstemp(suffix=".pcap")
+    os.close(fd)
+    wrpcap(path, packets)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - cut)
+    return path
+
+
+def compare(cut):
+    path = write_cut_pcap(cut)
+    try:
+        with PcapReader(path) as reader:
+            expected = [bytes(packet) for packet in reader]
+        with CaptureReader(path) as reader:
+            frames = [bytes(frame) for _, _, frame in reader]
+        batched = [bytes(frame) for _, batch in iter_frame_batches(path) for frame, _ in batch]
+    finally:
+        os.unlink(path)
+    assert len(frames) == len(expected)
+    assert frames == expected
+    assert batched == expected
+    return len(frames)
+
+
+def test_cut_mid_payload():
+    # The last frame comes out short
+    assert compare(PAYLOAD // 2) == 3
+
+
+def test_cut_in_record_header():
+    # Less than a record header left: the file ends after two frames
+    frame_size = 14 + 20 + 20 + PAYLOAD
+    assert compare(frame_size + PCAP_RECORD_SIZE // 2) == 2
+
+
+if __name__ == "__main__":
+    test_cut_mid_payload()
+    test_cut_in_record_header()
+    print("Truncated pcap: OK")
@@ -0,0 +1,88 @@
+# test_tls_split.py
+# A ClientHello split across two TCP segments: the first segment alone must
+# give no JA3, the reassembled stream the right one.
+# Run from the repository root: python -m pytest backend/sniffer/test/test_tls_split.py
+
+import hashlib
+import struct
+
+from backend.sniffer.protocols.tls import parse_payload
+from backend.sniffer.reassembly import TCPReassembler
+from backend.detectors.fingerprinting.tls import TLSFingerprinter
+
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+KEY = ("10.0.0.1", "10.0.0.2", 40000, 443)
+
+CIPHERS = [0x0A0A, 0x1301, 0x1302, 0xC02B, 0xC02F, 0x009C]
+GROUPS = [0x001D, 0x0017, 0x0018]
+FORMATS = [0]
+SNI = b"example.com"
+
+
+def _extension(ext_type, data):
+    return struct.pack("!HH", ext_type, len(data)) + data
+
+
+def client_hello():
+    """A TLS record carrying a ClientHello, and its JA3 string"""
+    sni = struct.pack("!HBH", len(SNI) + 3, 0, len(SNI)) + SNI
+    groups = struct.pack(f"!H{len(GROUPS)}H", 2 * len(GROUPS), *GROUPS)
+    formats = bytes([len(FORMATS)] + FORMATS)
+    # Padding makes the hello long enough to need two segments
+    extensions = (
+        _extension(0, sni) + _extension(10, groups) + _extension(11, formats)
+        + _extension(21, bytes(1200))
+    )
+    body = (
+        struct.pack("!H", 0x0303) + bytes(32) + b"\x00"
+        + struct.pack(f"!H{len(CIPHERS)}H", 2 * len(CIPHERS), *CIPHERS)
+        + b"\x01\x00"
+        + struct.pack("!H", len(extensions)) + extensions
+    )
+    handshake = bytes([1]) + len(body).to_bytes(3, "big") + body
+    record = struct.pack("!BHH", 22, 0x0301, len(handshake)) + handshake
+    ciphers = "-".join(str(c) for c in CIPHERS if c != 0x0A0A)
+    ja3 = f"{0x0303},{ciphers},0-10-11-21,{'-'.join(map(str, GROUPS))},0"
+    return record, hashlib.md5(ja3.encode()).hexdigest()
+
+
+def test_whole_hello_fingerprint():
+    record, expected = client_hello()
+    result = parse_payload(record)
+    assert not result.get("truncated")
+    assert result["ja3"] == expected
+    assert result["sni"] == "example.com"
+
+
+def test_split_hello():
+    record, expected = client_hello()
+    first, second = record[:600], record[600:]
+
+    # The first segment alone is a truncated hello: no fingerprint
+    result = parse_payload(first)
+    assert result["handshake"] == "ClientHello"
+    assert result["truncated"]
+    assert "ja3" not in result
+    fingerprinter = TLSFingerprinter()
+    assert fingerprinter.get_ja3_payload(first) is None
+    assert fingerprinter.get_all_ja3() == set()
+
+    # Put back together by the reassembler, segments out of order
+    stream = bytearray()
+    reassembler = TCPReassembler(
+        lambda key, data: stream.extend(data), lambda key, size: None, lambda key: None
+    )
+    reassembler.feed(KEY, 999, TCP_SYN, b"", 1.0)
+    reassembler.feed(KEY, 1000 + len(first), TCP_ACK, second, 1.0)
+    reassembler.feed(KEY, 1000, TCP_ACK, first, 1.0)
+    assert bytes(stream) == record
+    assert parse_payload(bytes(stream))["ja3"] == expected
+    assert fingerprinter.get_ja3_payload(bytes(stream)) == expected
+    assert fingerprinter.get_all_ja3() == {expected}
+
+
+if __name__ == "__main__":
+    test_whole_hello_fingerprint()
+    test_split_hello()
+    print("TLS split hello: OK")
@@ -18,9 +18,9 @@ export const getLiveSnifferStatus = async (snifferId) => {
   return response.data;
 };
 
-export const getLiveSnifferResults = async (snifferId, limit = 100, clear = false, sinceTimestamp = null) => {
+export const getLiveSnifferResults = async (snifferId, limit = 100, afterSeq = null) => {
   const response = await axios.get(`${API_BASE}/sniffer/live/${snifferId}/results`, {
-    params: { limit, clear, since_timestamp: sinceTimestamp }
+    params: { limit, after_seq: afterSeq }
   });
   return response.data;
 };
@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { useSnackbar } from 'notistack';
 import AlertFeed from '../../components/dashboard/AlertFeed';
 import GeoMap from '../../components/dashboard/GeoMap';
@@ -17,7 +17,9 @@ export default function RealtimeView() {
   const [geoData, setGeoData] = useState([])
   const [protocolData, setProtocolData] = useState([])
   const [trafficData, setTrafficData] = useState([])
-  const [lastUpdate, setLastUpdate] = useState(null)
+  // Read by the polling interval, so a ref: state would be stale in its
+  // closure. Kept per sniffer, since each has its own sequence numbers
+  const cursorRef = useRef({ sniffer: null, seq: -1 })
   const [viewMode, setViewMode] = useState('packets') // 'packets' or 'flows'
 
   // Fetch initial data
@@ -57,17 +59,22 @@ export default function RealtimeView() {
   const fetchPacketUpdates = async () => {
     if (!activeSniffer) return
     
+    const snifferId = activeSniffer
+    // Always pass our own cursor (-1 = from the oldest result), so other
+    // tabs polling the same sniffer don't take our results
+    const cursor = cursorRef.current
+    const afterSeq = cursor.sniffer === snifferId ? cursor.seq : -1
     try {
       const response = await fetchApi(
-        `/api/sniffer/live/${activeSniffer}/results?limit=100&clear=false${lastUpdate ? `&since_timestamp=${lastUpdate}` : ''}`
+        `/api/sniffer/live/${snifferId}/results?limit=100&after_seq=${afterSeq}`
       )
       
+      cursorRef.current = { sniffer: snifferId, seq: response.next_seq }
       if (response.results.length > 0) {
         setPackets(prev => [...response.results, ...prev].slice(0, 1000))
         processTrafficData(response.results)
-        setLastUpdate(response.timestamp)
         console.log('Packet updates fetched:', response.results)
-        console.log("Fetching packets for:", activeSniffer, "Since:", lastUpdate) 
+        console.log("Fetching packets for:", snifferId, "After seq:", afterSeq) 
       }
     } 
     catch (error) {